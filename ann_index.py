@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Путь к сохраненному индексу (если файла нет, индекс строится при старте и сохраняется)
+ANN_INDEX_PATH = os.getenv('ANN_INDEX_PATH', './ann_index_W2V.npz')
+# Сколько ближайших кластеров просматривается при поиске
+ANN_N_PROBE = int(os.getenv('ANN_N_PROBE', 8))
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    # Функция для нормировки векторов (скалярное произведение = косинусная близость)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IVFIndex:
+    # Приближенный поиск ближайших соседей по косинусу (inverted file index):
+    # векторы разбиваются сферическим k-means на n_lists кластеров и хранятся
+    # подряд по кластерам (offsets — границы кластеров). Запрос сравнивается
+    # с центроидами, и точный скоринг идет только внутри n_probe ближайших кластеров.
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray, n_lists: Optional[int] = None,
+                 n_probe: int = ANN_N_PROBE, n_iter: int = 10, seed: int = 0):
+        self.fingerprint = get_fingerprint(ids, vectors)
+        vectors = normalize(vectors)
+        n = len(vectors)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        self.n_probe = n_probe
+
+        # Сферический k-means
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            counts = np.bincount(assignment, minlength=n_lists)
+            empty = counts == 0
+            # Пустые кластеры переинициализируем случайными векторами
+            sums[empty] = vectors[rng.choice(n, int(empty.sum()), replace=False)]
+            centroids = normalize(sums)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind='stable')
+        self.centroids = centroids
+        self.offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1)).astype(np.int64)
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.vectors = vectors[order]
+        self._build_positions()
+
+    def _build_positions(self) -> None:
+        # Плотный массив id -> позиция вектора в индексе (-1, если id нет)
+        self.positions = np.full(int(self.ids.max()) + 1 if len(self.ids) else 0, -1, dtype=np.int32)
+        self.positions[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+
+    @classmethod
+    def from_arrays(cls, centroids, offsets, ids, vectors, n_probe: int = ANN_N_PROBE,
+                    fingerprint: str = '') -> 'IVFIndex':
+        # Функция для создания индекса из готовых массивов
+        index = cls.__new__(cls)
+        index.centroids, index.offsets, index.ids, index.vectors = centroids, offsets, ids, vectors
+        index.n_probe = n_probe
+        index.fingerprint = fingerprint
+        index._build_positions()
+        return index
+
+    def save(self, path: str) -> None:
+        # Функция для сохранения индекса на диск (через временный файл)
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, ids=self.ids, vectors=self.vectors,
+                 fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, n_probe: int = ANN_N_PROBE) -> 'IVFIndex':
+        # Функция для загрузки индекса с диска (у индексов, сохраненных без отпечатка, он пустой)
+        with np.load(path) as data:
+            fingerprint = str(data['fingerprint']) if 'fingerprint' in data.files else ''
+            return cls.from_arrays(data['centroids'], data['offsets'], data['ids'], data['vectors'], n_probe,
+                                   fingerprint)
+
+    def get_vector(self, id: int) -> Optional[np.ndarray]:
+        # Функция для получения (нормированного) вектора по id
+        if id < 0 or id >= len(self.positions) or self.positions[id] < 0:
+            return None
+        return self.vectors[self.positions[id]]
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Функция для приближенного поиска k ближайших: возвращает (ids, близости) по убыванию
+        query = normalize(query)
+        n_probe = min(self.n_probe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        positions = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        return self._top_k(positions, self.vectors[positions] @ query, k)
+
+    def search_exact(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Функция для точного поиска перебором (эталон для оценки recall)
+        query = normalize(query)
+        return self._top_k(np.arange(len(self.ids)), self.vectors @ query, k)
+
+    def _top_k(self, positions: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(positions))
+        if k <= 0:
+            return self.ids[:0], scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return self.ids[positions[top]], scores[top]
+
+    def recall(self, queries: np.ndarray, k: int) -> float:
+        # Функция для оценки recall@k приближенного поиска относительно перебора
+        hits = 0
+        for query in queries:
+            approx_ids, _ = self.search(query, k)
+            exact_ids, _ = self.search_exact(query, k)
+            hits += len(np.intersect1d(approx_ids, exact_ids))
+        return hits / (len(queries) * k)
+
+
+def get_fingerprint(ids: np.ndarray, vectors: np.ndarray) -> str:
+    # Функция для получения отпечатка векторов постов: SHA-256 от id и векторов (float32)
+    # по возрастанию id, чтобы порядок строк в выборке из БД не менял отпечаток
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    digest = hashlib.sha256(ids[order].tobytes())
+    digest.update(np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)[order]).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_or_build_ann_index(post_features, path: str = ANN_INDEX_PATH) -> IVFIndex:
+    # Функция для загрузки индекса по W2V векторам постов (или построения и сохранения).
+    # Сохраненный индекс используется, только если совпал отпечаток id и векторов постов
+    vector_columns = [c for c in post_features.columns if c.startswith('vector_')]
+    ids, vectors = post_features['post_id'].to_numpy(), post_features[vector_columns].to_numpy()
+    if path and os.path.exists(path):
+        index = IVFIndex.load(path)
+        if index.fingerprint == get_fingerprint(ids, vectors):
+            logger.info(f'ann index: loaded from {path}')
+            return index
+        logger.info('ann index: post vectors changed, rebuilding')
+
+    index = IVFIndex(ids, vectors)
+    logger.info(f'ann index: built, {len(index.centroids)} lists')
+    if path:
+        try:
+            index.save(path)
+        except OSError as e:
+            logger.warning(f'ann index: not saved ({e})')
+    return index
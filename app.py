@@ -1,13 +1,41 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response as RawResponse, StreamingResponse
+import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
 from catboost import CatBoostClassifier
-from typing import List
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from sqlalchemy.orm import sessionmaker
-import hashlib
+import asyncio
+import json
+import os
 import logging
+import pstats
+import weakref
+from time import perf_counter
+
+from ann_index import load_or_build_ann_index
+from candidates import CandidateGenerator
+from compiled_model import COMPILED_MODELS, get_model_fingerprint, load_or_build_compiled_model
+from experiments import EXPERIMENTS_PRELOAD, ArmConfig, ExperimentRegistry, load_experiment_config
+from feature_store import FEATURE_STORE_DIR, FeatureStore, get_process_memory
+from feed_cache import FeedCache
+from liked_index import LikedPostsIndex
+import metrics
+from metrics import RECOMMENDATIONS, REQUEST_SECONDS, STAGE_SECONDS, SamplingProfiler
+from likes_refresh import LIKES_DATABASE_URL, LikesRefresher
+from micro_batching import MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WAIT_MS, MicroBatcher
+from model_reload import RELOAD_WARMUP_CALLS
+from post_store import PostStore
+from precomputed_feeds import PRECOMPUTED_FEEDS_DIR, PrecomputedFeeds, get_bucket_time
+from scoring import (TIME_BUCKETS, CompiledScoringEngine, ScoringEngine, get_time_bucket_end, get_time_features,
+                     get_top_positions)
+from scoring_executor import CATBOOST_THREAD_COUNT, SCORING_THREADS, QueueFullError, ScoringExecutor
+from snapshots import load_with_snapshot
+from sql_loader import load_reports, load_sql_compact
+from user_store import UserStore
 
 # Настройка логгера
 logging.basicConfig(level=logging.INFO)
@@ -16,15 +44,35 @@ logger = logging.getLogger(__name__)
 # Создаем экземпляр FastAPI
 app = FastAPI()
 
-# Константы для разделения на A/B группы
-SALT = "salt_value"
-CONTROL_PERCENT = 0.5  # 50/50 разделение
+# Таблица признаков постов с W2V векторами (для похожих постов и отбора кандидатов)
+POST_VECTORS_TABLE = os.getenv('POST_VECTORS_TABLE', 'i_koskin_posts_features_lesson_25')
 
-# Создаем подключение к базе данных PostgreSQL
-engine = create_engine(
+# Количество пользователей, которые скорятся одним вызовом модели в пакетном эндпоинте
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', 16))
+# Максимальное количество пользователей в одном пакетном запросе (больше — ответ 422)
+BATCH_MAX_IDS = int(os.getenv('BATCH_MAX_IDS', 10000))
+# Пауза (в секундах) перед повторной отправкой чанка пакетного запроса в переполненный пул скоринга
+BATCH_RETRY_DELAY = 0.1
+
+# Количество кандидатов, которые передаются в модель (0 — скорить весь каталог)
+CANDIDATES_COUNT = int(os.getenv('CANDIDATES_COUNT', 0))
+
+# Количество постов на пользователя в строках сверки упакованной модели с CatBoost
+PARITY_POSTS = 500
+
+# Кэш ранжированных лент: объем в МиБ (0 — кэш выключен) и глубина сохраняемой ленты
+FEED_CACHE_SIZE_MB = float(os.getenv('FEED_CACHE_SIZE_MB', 64))
+FEED_CACHE_DEPTH = int(os.getenv('FEED_CACHE_DEPTH', 100))
+
+# Адрес базы данных (по умолчанию — учебная PostgreSQL; для нагрузочного теста — синтетическая копия)
+DATABASE_URL = os.getenv(
+    'DATABASE_URL',
     "postgresql://robot-startml-ro:pheiph0hahj1Vaif@"
     "postgres.lab.karpov.courses:6432/startml"
 )
+
+# Создаем подключение к базе данных
+engine = create_engine(DATABASE_URL)
 # Создаем локальную сессию для работы с базой данных
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -48,190 +96,573 @@ class Response(BaseModel):
     exp_group: str
     recommendations: List[PostGet]
 
-# Функция для получения пути к модели в зависимости от окружения
-def get_model_path(model_name: str) -> str:
-    model_paths = {
-        'control': './catboost_model_PCA',  # локальный путь к контрольной модели
-        'test': './catboost_model_W2V'  # локальный путь к тестовой модели
-    }
-
-    if model_name not in model_paths:
-        raise ValueError(f"Unknown model: {model_name}")
-
-    return model_paths[model_name]
+# Функция для приведения времени запроса к локальному времени без часового пояса
+# (так с ним сравнивается datetime.now(); время с поясом переводится в локальное)
+def normalize_time(time: Optional[datetime]) -> Optional[datetime]:
+    if time is None or time.tzinfo is None:
+        return time
+    return time.astimezone().replace(tzinfo=None)
+
+# Модель для пакетного запроса рекомендаций
+class BatchRequest(BaseModel):
+    ids: List[int] = Field(max_length=BATCH_MAX_IDS)
+    limit: int = Field(10, ge=0)
+    time: Optional[datetime] = None
+
+    @field_validator('time')
+    @classmethod
+    def validate_time(cls, time: Optional[datetime]) -> Optional[datetime]:
+        return normalize_time(time)
+
+# Модель для рекомендаций одного пользователя в пакетном ответе
+class BatchItem(Response):
+    id: int
 
-# Функция для загрузки модели
-def load_models(model_name: str):
-    model_path = get_model_path(model_name)
+# Функция для загрузки модели (путь к модели задается в плече эксперимента)
+def load_models(model_path: str):
     loaded_model = CatBoostClassifier()
     loaded_model.load_model(model_path)
     return loaded_model
 
-# Функция для пакетной загрузки данных из SQL в DataFrame
-def batch_load_sql(query: str) -> pd.DataFrame:
-    CHUNKSIZE = 200000 # Размер чанка для загрузки данных
-
-    conn = engine.connect().execution_options(stream_results=True) # Устанавливаем соединение с БД
-    chunks = []
-    for chunk_dataframe in pd.read_sql(query, conn, chunksize=CHUNKSIZE):
-        chunks.append(chunk_dataframe)
-    conn.close()
-    return pd.concat(chunks, ignore_index=True)
-
-# Функция для загрузки признаков постов в зависимости от модели
-def load_posts_features(model_name: str) -> pd.DataFrame:
-    if model_name == 'control':
-        return batch_load_sql('SELECT * FROM i_koskin_posts_features_lesson_22')
-    elif model_name == 'test':
-        return batch_load_sql('SELECT * FROM i_koskin_posts_features_lesson_25')
-    else:
-        raise ValueError(f"Unknown model: {model_name}")
-    
+# Функция для пакетной загрузки данных из SQL в DataFrame: чанки сразу записываются
+# в компактные типы (float32, int32, category), отчет о памяти — в /service/memory
+def batch_load_sql(query: str, parse_dates: Optional[List[str]] = None) -> pd.DataFrame:
+    return load_sql_compact(engine, query, parse_dates)
+
+# Запросы общих для всех плеч таблиц (по ним же считаются отпечатки снимков и хранилища)
+USERS_FEATURES_QUERY = 'SELECT * FROM i_koskin_users_features_lesson_22'
+POST_TEXT_QUERY = 'SELECT * FROM public.post_text_df'
+# Посты, которые пользователи лайкнули, со временем последнего лайка
+# (с самого свежего из них начинается догрузка новых лайков)
+LIKED_POSTS_QUERY = """
+                    SELECT post_id, user_id, max(timestamp) AS timestamp
+                    FROM public.feed_data
+                    WHERE action='like'
+                    GROUP BY post_id, user_id
+                    """
+
+# Функция для получения запроса таблицы признаков постов
+def get_posts_features_query(table: str) -> str:
+    return f'SELECT * FROM {table}'
+
+# Функция для загрузки таблицы признаков постов (refresh — в обход снимка)
+def load_posts_features(table: str, refresh: bool = False) -> pd.DataFrame:
+    return load_with_snapshot(table, get_posts_features_query(table), batch_load_sql, refresh, DATABASE_URL)
+
 # Функция для загрузки признаков пользователей
 def load_users_features() -> pd.DataFrame:
-    return batch_load_sql('SELECT * FROM i_koskin_users_features_lesson_22')
+    return load_with_snapshot('i_koskin_users_features_lesson_22', USERS_FEATURES_QUERY, batch_load_sql,
+                              source=DATABASE_URL)
 
-# Функция для загрузки текстов постов
-def load_post_text() -> pd.DataFrame:
-    return batch_load_sql('SELECT * FROM public.post_text_df')
+# Функция для загрузки текстов постов (refresh — в обход снимка)
+def load_post_text(refresh: bool = False) -> pd.DataFrame:
+    return load_with_snapshot('post_text_df', POST_TEXT_QUERY, batch_load_sql, refresh, DATABASE_URL)
 
 # Функция для загрузки постов, которые пользователи лайкнули
 def load_liked_posts() -> pd.DataFrame:
-    return batch_load_sql("""
-                          SELECT distinct post_id, user_id
-                          FROM public.feed_data
-                          WHERE action='like'
-                          """)
-
-# Загружаем модели и данные
-model_control = load_models('control')  # Загружаем контрольную модель
-model_test = load_models('test')  # Загружаем тестовую модель
-df_user = load_users_features()
-df_post_control = load_posts_features('control')
-df_post_test = load_posts_features('test')
-post_table = load_post_text()
-liked_posts = load_liked_posts()
-
-# Функция для разбиения пользователей на группы
-def get_exp_group(user_id: int) -> str:
-    user_hash = int(hashlib.md5(f"{user_id}{SALT}".encode()).hexdigest(), 16)
-    return "control" if user_hash % 100 < CONTROL_PERCENT * 100 else "test"
-
-# Функции для рекомендаций, привязанные к моделям
-def recommend_with_control_model(id: int, exp_group: str, limit: int) -> List[PostGet]:
-    # Функция для получения рекомендаций с использованием контрольной модели
-    return get_recommended_feed(model_control, id, exp_group, limit)
-
-def recommend_with_test_model(id: int, exp_group: str, limit: int) -> List[PostGet]:
-    # Функция для получения рекомендаций с использованием тестовой модели
-    return get_recommended_feed(model_test, id, exp_group, limit)
-
-def get_recommended_feed(model, id: int, exp_group: str, limit: int = 10):
-    # Функция для получения списка рекоммендованных постов
-    # Получение фич пользователя по его ID
-    logger.info(f'user_id: {id}')
-    logger.info('reading user features')
-    user_features = df_user.loc[df_user['user_id'] == id]
-    user_features = user_features.drop(['user_id'], axis=1)
-
-    # Загрузка фич по постам
-    logger.info('reading posts features')
-    if exp_group == 'control':
-        posts_features = df_post_control.copy()
-    elif exp_group == 'test':
-        posts_features = df_post_test.copy()
+    return load_with_snapshot('liked_posts', LIKED_POSTS_QUERY,
+                              lambda query: batch_load_sql(query, parse_dates=['timestamp']),
+                              source=DATABASE_URL)
+
+# Загружаем общие для всех плеч эксперимента данные (признаки постов плеч — при загрузке плеча)
+if FEATURE_STORE_DIR:
+    # Режим общего хранилища: таблицы загружает первый воркер, остальные
+    # подключают их через mmap без копирования (таблицы, записанные по другому запросу,
+    # из другой БД или старше FEATURE_STORE_MAX_AGE, строятся заново)
+    feature_store = FeatureStore(FEATURE_STORE_DIR, DATABASE_URL)
+    df_user = feature_store.get_or_build_frame('users_features', load_users_features, USERS_FEATURES_QUERY)
+    post_table = feature_store.get_or_build_frame('post_text', load_post_text, POST_TEXT_QUERY)
+    liked_index = LikedPostsIndex.from_arrays(feature_store.get_or_build_arrays(
+        'liked_posts', lambda: LikedPostsIndex(load_liked_posts()).to_arrays(), LIKED_POSTS_QUERY))
+else:
+    df_user = load_users_features()
+    post_table = load_post_text()
+    liked_index = LikedPostsIndex(load_liked_posts())  # Индекс лайков по пользователям
+
+# Признаки пользователей с поиском по user_id за O(1)
+user_store = UserStore(df_user)
+
+# Тексты и темы постов для сборки ответа (с готовыми JSON-фрагментами)
+post_store = PostStore(post_table)
+
+# Функция для получения постов по убыванию числа лайков
+def get_popular_posts(store: PostStore) -> np.ndarray:
+    return store.post_ids[np.argsort(-liked_index.like_counts(store.positions, len(store.post_ids)), kind='stable')]
+
+# Посты по убыванию числа лайков: лента для пользователей, которых нет в таблице признаков
+popular_post_ids = get_popular_posts(post_store)
+
+# Загруженные таблицы признаков постов: плечи с одной таблицей (и индекс похожих постов)
+# используют одну копию, таблица освобождается вместе с последним движком, который ее держит
+posts_features_tables = weakref.WeakValueDictionary()
+
+# Функция для получения таблицы признаков постов (refresh — перечитать из БД)
+def get_posts_features(table: str, refresh: bool = False) -> pd.DataFrame:
+    posts_features = None if refresh else posts_features_tables.get(table)
+    if posts_features is None:
+        if FEATURE_STORE_DIR and not refresh:
+            posts_features = feature_store.get_or_build_frame(f'posts_features_{table}', lambda: load_posts_features(table),
+                                                              get_posts_features_query(table))
+        else:
+            posts_features = load_posts_features(table, refresh)
+        posts_features_tables[table] = posts_features
+    return posts_features
+
+# Потоки CatBoost на вызов модели
+# (с микробатчингом модель вызывается из одного потока на модель, поэтому ей отдаются все ядра)
+catboost_thread_count = -1 if MICRO_BATCH_WAIT_MS > 0 else CATBOOST_THREAD_COUNT
+
+# Функция для сборки строк сверки упакованной модели с CatBoost: признаки нескольких
+# пользователей (каждый в своем временном интервале) по случайным постам каталога
+def get_parity_sample(model: CatBoostClassifier, posts_features: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    scoring_engine = ScoringEngine(model, posts_features, columns)
+    rng = np.random.default_rng(0)
+    samples = []
+    for user_id, bucket in zip(df_user['user_id'].head(len(TIME_BUCKETS)), TIME_BUCKETS):
+        rows = np.sort(rng.choice(scoring_engine.n_posts, min(PARITY_POSTS, scoring_engine.n_posts), replace=False))
+        samples.append(scoring_engine.build_features(user_store.get(int(user_id)), get_bucket_time(bucket), rows))
+    return pd.concat(samples, ignore_index=True)
+
+# Функция для загрузки движка скоринга плеча: модель из ее файла и заранее собранный
+# блок признаков постов (reload_features — перечитать признаки постов из БД)
+# (с reload_features заодно собирается новый каталог постов: он подключается вместе с движком
+# в on_scoring_engine_swap, а если загрузка или прогрев упадут — отбрасывается вместе с ним)
+def load_scoring_engine(arm: ArmConfig, reload_features: bool = False) -> ScoringEngine:
+    posts_features = get_posts_features(arm.features_table, reload_features)
+    posts_catalog = load_posts_catalog(arm.features_table) if reload_features else None
+    if COMPILED_MODELS:
+        # Упакованная модель: CatBoost загружается только для сборки упаковки и ее сверки,
+        # категории постов хэшируются и часть деревьев считается один раз при загрузке
+        compiled_model = load_or_build_compiled_model(
+            arm.model_path, lambda model: get_parity_sample(model, posts_features, arm.get_columns()))
+        scoring_engine = CompiledScoringEngine(compiled_model, posts_features, arm.get_columns())
     else:
-        raise ValueError('Unknown group')
-    
-    
-    # Объединение фич
-    logger.info('zipping features')
-    add_user_features = dict(zip(user_features.columns, user_features.values[0]))
-    logger.info('assigning features')
-    user_posts_features = posts_features.assign(**add_user_features)
-    user_posts_features = user_posts_features.reset_index(drop=True)
-    
-    # Добавление фич о текущей дате рекомендаций
-    logger.info('add time info')
+        fingerprint = get_model_fingerprint(arm.model_path)  # до загрузки: файл мог измениться после нее
+        scoring_engine = ScoringEngine(load_models(arm.model_path), posts_features, arm.get_columns(),
+                                       catboost_thread_count, fingerprint)
+    if posts_catalog is not None:
+        pending_posts_catalogs[scoring_engine] = posts_catalog
+    return scoring_engine
+
+# Планировщики микробатчей: одновременные запросы к одной модели скорятся одним вызовом
+micro_batchers = {}
+
+# Настройка эксперимента (плечи, их модели и веса)
+experiment_config = load_experiment_config()
+
+# Пул потоков для скоринга запросов с ограниченной очередью. С микробатчингом поток скоринга
+# ждет результат своего пакета, поэтому потоков должно хватать, чтобы у каждого плеча набирался
+# полный пакет, пока считается предыдущий (иначе пакеты не больше числа потоков пула)
+scoring_threads = SCORING_THREADS
+if MICRO_BATCH_WAIT_MS > 0:
+    scoring_threads = max(SCORING_THREADS, 2 * MICRO_BATCH_MAX_SIZE * len(experiment_config.arms))
+scoring_executor = ScoringExecutor(scoring_threads)
+
+# Кэш ранжированных лент
+feed_cache = FeedCache(int(FEED_CACHE_SIZE_MB * 2 ** 20), FEED_CACHE_DEPTH)
+
+# Ленты, заранее посчитанные пакетной задачей precompute.py (режим включается PRECOMPUTED_FEEDS_DIR)
+precomputed_feeds = PrecomputedFeeds(PRECOMPUTED_FEEDS_DIR) if PRECOMPUTED_FEEDS_DIR else None
+
+# Индекс ближайших соседей по W2V векторам постов
+# (таблица общая с плечом эксперимента, которое использует те же признаки)
+df_post_vectors = get_posts_features(POST_VECTORS_TABLE)
+ann_index = load_or_build_ann_index(df_post_vectors)
+
+# Генератор кандидатов для двухэтапного ранжирования
+candidate_generator = CandidateGenerator(df_post_vectors, post_table, liked_index, ann_index) if CANDIDATES_COUNT else None
+
+# Каталоги постов, собранные вместе с новыми версиями движков и ждущие их подмены
+# (каталог версии, которая не дошла до подмены, освобождается вместе с ней)
+pending_posts_catalogs = weakref.WeakKeyDictionary()
+
+# Функция для сборки каталога постов вместе с признаками плеча: новые посты из признаков
+# должны попасть в ответ (тексты), в похожие посты и в кандидаты (если обновилась таблица векторов).
+# Объекты только строятся; подключает их publish_posts_catalog при подмене движка
+def load_posts_catalog(features_table: str) -> dict:
+    new_post_table = load_post_text(refresh=True)
+    new_post_store = PostStore(new_post_table)
+    new_post_vectors, new_ann_index, new_candidate_generator = df_post_vectors, ann_index, candidate_generator
+    if features_table == POST_VECTORS_TABLE:
+        new_post_vectors = get_posts_features(POST_VECTORS_TABLE)  # только что перечитанная таблица
+        new_ann_index = load_or_build_ann_index(new_post_vectors)
+    if candidate_generator is not None:
+        new_candidate_generator = CandidateGenerator(new_post_vectors, new_post_table, liked_index, new_ann_index)
+    return {'post_table': new_post_table, 'post_store': new_post_store, 'popular_post_ids': get_popular_posts(new_post_store),
+            'df_post_vectors': new_post_vectors, 'ann_index': new_ann_index, 'candidate_generator': new_candidate_generator}
+
+# Функция для подключения каталога постов (присваиваниями, без остановки обслуживания)
+def publish_posts_catalog(catalog: dict):
+    global post_table, post_store, popular_post_ids, df_post_vectors, ann_index, candidate_generator
+    post_table, post_store, popular_post_ids = catalog['post_table'], catalog['post_store'], catalog['popular_post_ids']
+    df_post_vectors, ann_index = catalog['df_post_vectors'], catalog['ann_index']
+    candidate_generator = catalog['candidate_generator']
+    logger.info(f'posts reloaded: {len(post_store.post_ids)} posts')
+
+# Функция для прогрева новой версии модели несколькими вызовами скоринга перед подменой
+def warm_up_scoring_engine(scoring_engine: ScoringEngine):
     time = datetime.now()
-    time = time.strftime("%Y-%m-%dT%H:%M:%S")
-    user_posts_features['hour'] = pd.to_datetime(time).hour
-    user_posts_features['weekday'] = pd.to_datetime(time).day_of_week
-    user_posts_features['time_of_day'] = pd.cut(
-        user_posts_features['hour'],
-        bins=[0, 6, 12, 18, 24],
-        labels=['night', 'morning', 'afternoon', 'evening'],
-        right=False
-        )
-    user_posts_features['day_of_week'] = pd.cut(
-        user_posts_features['weekday'],
-        bins=[-1, 4, 6],
-        labels=['weekday', 'weekend']
-        )
-
-    user_posts_features = user_posts_features.drop(['hour', 'weekday'], axis=1)
-
-    # Закрепление порядка колонок
-    if exp_group == 'control':
-        user_posts_features = user_posts_features[['post_id', 'time_of_day', 'day_of_week', 'topic',
-                                               'pca_1', 'pca_2', 'gender', 'city','exp_group',
-                                               'os', 'source', 'age_group']]
-    elif exp_group == 'test':
-        user_posts_features = user_posts_features[['post_id', 'time_of_day', 'day_of_week', 'topic', 'vector_0', 'vector_1', 'vector_2', 'vector_3', 'vector_4', 'vector_5',
-                                                   'vector_6', 'vector_7', 'vector_8', 'vector_9', 'vector_10', 'vector_11', 'vector_12', 'vector_13', 'vector_14', 'vector_15',
-                                                   'vector_16', 'vector_17', 'vector_18', 'vector_19', 'vector_20', 'vector_21', 'vector_22', 'vector_23', 'vector_24', 'vector_25',
-                                                   'vector_26', 'vector_27', 'vector_28', 'vector_29', 'vector_30', 'vector_31', 'vector_32', 'vector_33', 'vector_34', 'vector_35',
-                                                   'vector_36', 'vector_37', 'vector_38', 'vector_39', 'vector_40', 'vector_41', 'vector_42', 'vector_43', 'vector_44', 'vector_45',
-                                                   'vector_46', 'vector_47', 'vector_48', 'vector_49', 'vector_50', 'vector_51', 'vector_52', 'vector_53', 'vector_54', 'vector_55',
-                                                   'vector_56', 'vector_57', 'vector_58', 'vector_59', 'vector_60', 'vector_61', 'vector_62', 'vector_63', 'vector_64', 'vector_65',
-                                                   'vector_66', 'vector_67', 'vector_68', 'vector_69', 'vector_70', 'vector_71', 'vector_72', 'vector_73', 'vector_74', 'vector_75',
-                                                   'vector_76', 'vector_77', 'vector_78', 'vector_79', 'vector_80', 'vector_81', 'vector_82', 'vector_83', 'vector_84', 'vector_85',
-                                                   'vector_86', 'vector_87', 'vector_88', 'vector_89', 'vector_90', 'vector_91', 'vector_92', 'vector_93', 'vector_94', 'vector_95',
-                                                   'vector_96', 'vector_97', 'vector_98', 'vector_99', 'gender', 'city', 'exp_group', 'os', 'source', 'age_group']]
-    else:
-        raise ValueError('Unknown group')
-    
-
-    # Формируем вероятности лайкнуть пост для всех постов
-    logger.info('predicting')
-    predicts = model.predict_proba(user_posts_features)[:, 1]
-    user_posts_features['predicts'] = predicts
+    for user_id in df_user['user_id'].head(RELOAD_WARMUP_CALLS):
+        scoring_engine.predict(get_user_features(int(user_id)), time)
+
+# Функция для замены планировщика микробатчей движка old_engine на планировщик new_engine
+# (None — движка нет): старый планировщик досчитывает свою очередь и останавливается
+def replace_micro_batcher(old_engine: Optional[ScoringEngine], new_engine: Optional[ScoringEngine]):
+    global micro_batchers
+    if MICRO_BATCH_WAIT_MS <= 0:
+        return
+    old_batcher = micro_batchers.get(old_engine)
+    batchers = {scoring_engine: micro_batcher for scoring_engine, micro_batcher in micro_batchers.items()
+                if scoring_engine is not old_engine}
+    if new_engine is not None:
+        batchers[new_engine] = MicroBatcher(new_engine)
+    micro_batchers = batchers
+    if old_batcher is not None:
+        old_batcher.close()
+
+# Функция, вызываемая после подмены модели: подключается каталог постов, собранный вместе
+# с новой версией (если признаки перечитывались), у новой версии свой планировщик микробатчей,
+# ленты старой версии сбрасываются
+def on_scoring_engine_swap(arm_name: str, old_engine: ScoringEngine, new_engine: ScoringEngine):
+    posts_catalog = pending_posts_catalogs.pop(new_engine, None)
+    if posts_catalog is not None:
+        publish_posts_catalog(posts_catalog)
+    replace_micro_batcher(old_engine, new_engine)
+    feed_cache.invalidate()
+
+# Плечи эксперимента: плечи с ненулевым весом загружаются при старте, включенные позже — при
+# первом запросе; выгружаются при нулевом весе
+# и перезагружаются по запросу к /service/reload или при изменении файла модели
+experiments = ExperimentRegistry(
+    experiment_config, load_scoring_engine, warm_up_scoring_engine,
+    on_load=lambda arm_name, scoring_engine: replace_micro_batcher(None, scoring_engine),
+    on_swap=on_scoring_engine_swap,
+    on_unload=lambda arm_name, scoring_engine: replace_micro_batcher(scoring_engine, None))
+if EXPERIMENTS_PRELOAD:
+    experiments.preload()
+
+# Функция для подмены индекса лайков (новые лайки догружаются в фоне):
+# популярные посты холодного старта и кандидатов пересчитываются по новым числам лайков
+def set_liked_index(index: LikedPostsIndex):
+    global liked_index, popular_post_ids
+    liked_index = index
+    popular_post_ids = get_popular_posts(post_store)
+    if candidate_generator is not None:
+        candidate_generator.set_liked_index(index)
+
+# Догрузка новых лайков по high-water mark на timestamp (включается LIKES_REFRESH_INTERVAL)
+likes_refresher = LikesRefresher(create_engine(LIKES_DATABASE_URL) if LIKES_DATABASE_URL else engine,
+                                 lambda: liked_index, set_liked_index)
+
+# Функция для разбиения пользователей на группы (плечи эксперимента)
+def get_exp_group(user_id: int) -> str:
+    return experiments.get_arm_name(user_id)
 
-    # Удаление постов, лайкнутых пользователем
-    logger.info('deleting liked posts')
-    like_posts = liked_posts
-    like_posts = list(like_posts[like_posts['user_id'] == id])
-    filtered_ = user_posts_features[~user_posts_features.post_id.isin(like_posts)]
+def get_user_features(id: int) -> Optional[dict]:
+    # Функция для получения фич пользователя по его ID (None, если пользователя нет в таблице)
+    return user_store.get(id)
 
-    # Формирование списка рекомендованных постов
-    top_post_ids = filtered_.nlargest(limit, 'predicts')['post_id'].to_list()
-    post_lookup = post_table.set_index('post_id').loc[top_post_ids]
+def get_popular_post_ids(limit: int) -> List[int]:
+    # Функция для получения самых популярных постов (лента холодного старта)
+    return popular_post_ids[:limit].tolist()
 
-    return [
-        PostGet(
-            id=i,
-            text=post_lookup.loc[i]['text'],
-            topic=post_lookup.loc[i]['topic']
-        ) for i in top_post_ids
-    ]
+def get_top_post_ids(scoring_engine: ScoringEngine, predicts, id: int, limit: int, rows=None) -> List[int]:
+    # Функция для отбора лучших постов по предсказаниям модели
+    # (rows — позиции кандидатов, если скорился не весь каталог)
+    post_ids = scoring_engine.post_ids if rows is None else scoring_engine.post_ids[rows]
 
-@app.get('/post/recommendations', response_model=Response)
-def recommended_posts(id: int, limit: int=10) -> Response:
-    exp_group = get_exp_group(id)  # Определяем группу пользователя
+    # Посты, лайкнутые пользователем, исключаются маской
+    unseen = liked_index.unseen_mask(id, scoring_engine.post_positions, scoring_engine.n_posts)
+    metrics.lap('filter')
 
-    if exp_group == 'control':
-        recommendations = recommend_with_control_model(id, exp_group, limit)
-    elif exp_group == 'test':
-        recommendations = recommend_with_test_model(id, exp_group, limit)
+    # Формирование списка рекомендованных постов
+    top_post_ids = post_ids[get_top_positions(predicts, limit, unseen if rows is None else unseen[rows])].tolist()
+    metrics.lap('top_k')
+    return top_post_ids
+
+def get_posts(post_ids: List[int]) -> List[PostGet]:
+    # Функция для получения текстов и тем постов по списку post_id
+    return [PostGet(**post) for post in post_store.get_posts(post_ids)]
+
+def encode_response(exp_group: str, post_ids: List[int], id: Optional[int] = None) -> bytes:
+    # Функция для сборки JSON ответа (поля как у Response, с id — как у BatchItem)
+    # из готовых фрагментов постов, без создания pydantic-объектов
+    body = b'{"exp_group":' + json.dumps(exp_group).encode() + b',"recommendations":' + post_store.encode(post_ids)
+    if id is not None:
+        body += b',"id":' + str(id).encode()
+    return body + b'}'
+
+def get_precomputed_feed(scoring_engine: ScoringEngine, id: int, exp_group: str, limit: int,
+                         time: datetime) -> Optional[List[int]]:
+    # Функция для получения ленты из заранее посчитанных пакетной задачей. None — ленты нет
+    # (посчитана другой версией модели группы или в ней не осталось limit постов без новых лайков),
+    # и она считается онлайн
+    post_ids = precomputed_feeds.get(id, exp_group, time, scoring_engine.fingerprint)
+    if post_ids is None:
+        return None
+    # После расчета ленты пользователь мог лайкнуть посты из нее
+    post_ids = post_ids[~np.isin(post_ids, liked_index.get(id))]
+    if len(post_ids) < limit:
+        return None
+    RECOMMENDATIONS.inc(exp_group, 'precomputed')
+    return [int(i) for i in post_ids[:limit]]
+
+def get_recommended_feed(scoring_engine: ScoringEngine, id: int, exp_group: str, limit: int = 10,
+                         time: Optional[datetime] = None) -> List[int]:
+    # Функция для получения списка рекоммендованных постов (post_id).
+    # Лента зависит только от пользователя, группы и временного интервала, поэтому
+    # она берется из заранее посчитанных (если режим включен), иначе ранжирование
+    # на глубину кэша сохраняется до конца интервала и отдается срезом.
+    # time — момент показа ленты (по умолчанию текущий; задается для воспроизводимых прогонов).
+    # Срок жизни ленты в кэше считается по текущему времени, а не по заданному
+    now = datetime.now()
+    time = time or now
+    if precomputed_feeds is not None and limit <= precomputed_feeds.depth:
+        post_ids = get_precomputed_feed(scoring_engine, id, exp_group, limit, time)
+        if post_ids is not None:
+            return post_ids
+    if not feed_cache.enabled or limit > feed_cache.depth:
+        return rank_posts(scoring_engine, id, exp_group, limit, time)
+
+    # Поколение кэша запоминается до проверки версии модели: если модель заменят
+    # во время расчета, кэш будет сброшен, и лента старой версии в него не попадет
+    cache_generation = feed_cache.generation
+    cache_key = (id, exp_group) + get_time_features(time)
+    post_ids = feed_cache.get(cache_key, now)
+    if post_ids is None:
+        post_ids = rank_posts(scoring_engine, id, exp_group, feed_cache.depth, time)
+        if scoring_engine is experiments.engines.get(exp_group):
+            feed_cache.put(cache_key, post_ids, get_time_bucket_end(now), cache_generation)
     else:
-        raise ValueError('Unknown group')
+        # Пока лента лежала в кэше, пользователь мог лайкнуть посты из нее (лайки догружаются в фоне)
+        post_ids = post_ids[~np.isin(post_ids, liked_index.get(id))]
+        RECOMMENDATIONS.inc(exp_group, 'cache')
+    return [int(i) for i in post_ids[:limit]]
+
+# Профилирование доли запросов ранжирования (PROFILE_SAMPLE_RATE), отчет — /service/profile
+profiler = SamplingProfiler()
+
+def rank_posts(scoring_engine: ScoringEngine, id: int, exp_group: str, limit: int, time: datetime) -> List[int]:
+    # Функция для ранжирования постов моделью: возвращает post_id лучших limit постов.
+    # Длительность каждого этапа попадает в гистограмму recommendation_stage_seconds
+    with profiler.sample(), metrics.track_stages(exp_group) as timer:
+        # Получение фич пользователя по его ID
+        add_user_features = get_user_features(id)
+        timer.lap('user_lookup')
+        if add_user_features is None:
+            # Неизвестный пользователь: вместо модели отдаются самые популярные посты
+            RECOMMENDATIONS.inc(exp_group, 'popular')
+            return get_popular_post_ids(limit)
+
+        # Отбор кандидатов (если включен): модель скорит только их, а не весь каталог
+        rows = None
+        if candidate_generator is not None:
+            rows = scoring_engine.get_rows(candidate_generator.get_candidates(id, CANDIDATES_COUNT))
+            timer.lap('candidates')
+
+        # Формируем вероятности лайкнуть пост для кандидатов
+        # (признаки постов собраны заранее, подставляются только пользователь и время — этап features;
+        # при включенном микробатчинге запрос скорится вместе с одновременными запросами к той же модели,
+        # и этап predict включает сборку признаков и ожидание пакета)
+        predictor = micro_batchers.get(scoring_engine, scoring_engine)
+        predicts = predictor.predict(add_user_features, time, rows)
+        timer.lap('predict')
+
+        RECOMMENDATIONS.inc(exp_group, 'model')
+        return get_top_post_ids(scoring_engine, predicts, id, limit, rows)
+
+def get_scoring_engine(exp_group: str) -> ScoringEngine:
+    # Функция для выбора текущей версии движка скоринга по группе эксперимента (с загрузкой плеча)
+    return experiments.get_engine(exp_group)
+
+def get_batch_chunks(ids: List[int]) -> Iterator[Tuple[str, List[int]]]:
+    # Функция для разбиения пакетного запроса на чанки: пользователи группируются
+    # по группе эксперимента и делятся на чанки по BATCH_CHUNK_SIZE
+    groups = {}
+    for id in dict.fromkeys(ids):  # убираем повторы, сохраняя порядок
+        groups.setdefault(get_exp_group(id), []).append(id)
+    for exp_group, group_ids in groups.items():
+        for start in range(0, len(group_ids), BATCH_CHUNK_SIZE):
+            yield exp_group, group_ids[start:start + BATCH_CHUNK_SIZE]
+
+def get_recommended_feeds_chunk(exp_group: str, chunk_ids: List[int], limit: int,
+                                time: datetime) -> List[Tuple[int, str, List[int]]]:
+    # Функция для получения рекомендаций одного чанка пользователей одним вызовом модели
+    limit = max(limit, 0)
+    scoring_engine = get_scoring_engine(exp_group)
+    feeds, users_features = [], {}
+    for id in chunk_ids:
+        user_features = get_user_features(id)
+        if user_features is None:
+            # Неизвестному пользователю отдаются популярные посты без вызова модели
+            feeds.append((id, exp_group, get_popular_post_ids(limit)))
+        else:
+            users_features[id] = user_features
+    predicts = scoring_engine.predict_many(list(users_features.values()), time)
+    for id, user_predicts in zip(users_features, predicts):
+        feeds.append((id, exp_group, get_top_post_ids(scoring_engine, user_predicts, id, limit)))
+    return feeds
+
+def get_recommended_feeds_batch(ids: List[int], limit: int = 10,
+                                time: Optional[datetime] = None) -> Iterator[Tuple[int, str, List[int]]]:
+    # Функция для получения рекомендаций сразу для многих пользователей (в текущем потоке,
+    # для пакетных задач): на каждый чанк — один вызов модели. Результаты отдаются
+    # по мере готовности чанка, поэтому в памяти одновременно лежит только один чанк.
+    time = time or datetime.now()
+    for exp_group, chunk_ids in get_batch_chunks(ids):
+        yield from get_recommended_feeds_chunk(exp_group, chunk_ids, limit, time)
+
+async def score_batch_chunk(exp_group: str, chunk_ids: List[int], limit: int, time: datetime,
+                            wait: bool) -> List[Tuple[int, str, List[int]]]:
+    # Функция для расчета чанка пакетного запроса в пуле скоринга: чанк занимает место
+    # в общей очереди наравне с одиночными запросами. При переполненной очереди
+    # wait — подождать и повторить, иначе QueueFullError
+    while True:
+        try:
+            return await scoring_executor.run(('batch', exp_group, tuple(chunk_ids), limit, time),
+                                              get_recommended_feeds_chunk, exp_group, chunk_ids, limit, time)
+        except QueueFullError:
+            if not wait:
+                raise
+            await asyncio.sleep(BATCH_RETRY_DELAY)
+
+def recommend(id: int, exp_group: str, limit: int, time: Optional[datetime] = None) -> List[int]:
+    # Функция для получения рекомендаций моделью группы пользователя
+    # (отрицательный limit при срезе ленты отбросил бы посты с конца, поэтому он ограничен нулем)
+    return get_recommended_feed(get_scoring_engine(exp_group), id, exp_group, max(limit, 0), time)
 
-        # Если recommendations пустой, заменяем на пустой список
-    if recommendations is None:
-        recommendations = []
+@app.get('/post/recommendations', response_model=Response)
+async def recommended_posts(id: int, limit: int = Query(10, ge=0), time: Optional[datetime] = None) -> RawResponse:
+    start = perf_counter()
+    time = normalize_time(time)
+    exp_group = get_exp_group(id)  # Определяем группу пользователя
 
-    # Возвращаем объект Response с информацией о группе и рекомендациями
-    return Response(exp_group=exp_group, recommendations=recommendations)
+    # Скоринг идет в выделенном пуле потоков; одинаковые одновременные запросы
+    # считаются один раз, а при переполненной очереди сервис сразу отвечает 503
+    try:
+        post_ids = await scoring_executor.run((id, limit, time), recommend, id, exp_group, limit, time)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail='Too many requests in progress',
+                            headers={'Retry-After': '1'})
+
+    # Ответ в формате Response собирается из готовых JSON-фрагментов постов
+    serialize_start = perf_counter()
+    body = encode_response(exp_group, post_ids)
+    end = perf_counter()
+    STAGE_SECONDS.observe(end - serialize_start, exp_group, 'serialize')
+    REQUEST_SECONDS.observe(end - start, exp_group)
+    return RawResponse(body, media_type='application/json')
+
+@app.post('/post/recommendations/batch')
+async def recommended_posts_batch(request: BatchRequest) -> StreamingResponse:
+    # Ответ отдается построчно в формате NDJSON: одна строка — один пользователь.
+    # Чанки скорятся в пуле скоринга по одному. Первый чанк считается до начала ответа,
+    # поэтому при переполненной очереди сервис отвечает 503; следующие чанки при
+    # переполнении ждут свободного места, так как статус ответа уже отправлен
+    time = request.time or datetime.now()
+    chunks = list(get_batch_chunks(request.ids))
+    try:
+        first_feeds = await score_batch_chunk(*chunks[0], request.limit, time, wait=False) if chunks else []
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail='Too many requests in progress',
+                            headers={'Retry-After': '1'})
+
+    async def stream() -> AsyncIterator[bytes]:
+        for id, exp_group, post_ids in first_feeds:
+            yield encode_response(exp_group, post_ids, id) + b'\n'
+        for chunk_exp_group, chunk_ids in chunks[1:]:
+            for id, exp_group, post_ids in await score_batch_chunk(chunk_exp_group, chunk_ids, request.limit,
+                                                                   time, wait=True):
+                yield encode_response(exp_group, post_ids, id) + b'\n'
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+@app.get('/post/similar', response_model=List[PostGet])
+def similar_posts(id: int, k: int = Query(10, ge=0)) -> List[PostGet]:
+    # Посты, похожие на данный по W2V вектору (приближенный поиск по косинусу)
+    vector = ann_index.get_vector(id)
+    if vector is None:
+        raise HTTPException(status_code=404, detail='Post not found')
+    similar_ids, _ = ann_index.search(vector, k + 1)
+    return get_posts([int(i) for i in similar_ids if i != id][:k])
+
+@app.get('/service/cache')
+def service_cache() -> dict:
+    # Счетчики кэша лент текущего воркера
+    return feed_cache.stats()
+
+@app.get('/service/executor')
+def service_executor() -> dict:
+    # Счетчики пула скоринга текущего воркера
+    return scoring_executor.stats()
+
+@app.get('/service/batching')
+def service_batching() -> dict:
+    # Счетчики планировщиков микробатчей текущего воркера (пусто, если микробатчинг выключен)
+    return {arm_name: micro_batchers[scoring_engine].stats()
+            for arm_name, scoring_engine in experiments.engines.items() if scoring_engine in micro_batchers}
+
+@app.post('/service/reload', status_code=202)
+def service_reload(model: str, features: bool = False) -> dict:
+    # Перезагрузка модели плеча (features — и признаков постов) в фоне текущего воркера:
+    # ответ не ждет загрузки, запросы обслуживает текущая версия до подмены
+    if model not in experiments.arms:
+        raise HTTPException(status_code=404, detail='Unknown model')
+    try:
+        started = experiments.reloader.reload(model, features)
+    except KeyError:
+        raise HTTPException(status_code=409, detail='Model is not loaded')
+    if not started:
+        raise HTTPException(status_code=409, detail='Reload already in progress')
+    return experiments.stats()[model]
+
+@app.get('/service/models')
+def service_models() -> dict:
+    # Плечи эксперимента текущего воркера: вес, загружена ли модель, ее версия и состояние перезагрузки
+    return experiments.stats()
+
+@app.post('/service/experiments/{arm}')
+def service_experiment_weight(arm: str, weight: float) -> dict:
+    # Изменение веса плеча (вес 0 выгружает модель плеча): текущий воркер применяет его сразу,
+    # остальные — после проверки общего файла весов
+    if arm not in experiments.arms:
+        raise HTTPException(status_code=404, detail='Unknown arm')
+    try:
+        experiments.set_weight(arm, weight)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return experiments.stats()
+
+@app.get('/service/precomputed')
+def service_precomputed() -> dict:
+    # Подключенный прогон заранее посчитанных лент и счетчики попаданий (пусто, если режим выключен)
+    return precomputed_feeds.stats() if precomputed_feeds is not None else {}
+
+@app.get('/service/likes')
+def service_likes() -> dict:
+    # Состояние индекса лайков текущего воркера и счетчики его догрузки
+    return likes_refresher.stats()
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def service_metrics() -> PlainTextResponse:
+    # Метрики текущего воркера в текстовом формате Prometheus
+    return PlainTextResponse(metrics.render_metrics(), media_type='text/plain; version=0.0.4')
+
+@app.get('/service/profile', response_class=PlainTextResponse)
+def service_profile(limit: int = Query(30, ge=0), sort: pstats.SortKey = pstats.SortKey.CUMULATIVE,
+                    reset: bool = False) -> PlainTextResponse:
+    # Самые затратные функции по запросам, выполненным под профилировщиком (reset — начать сбор заново).
+    # sort — ключ сортировки pstats.SortKey (calls, cumulative, time, ...), неизвестный ключ — ответ 422
+    report = profiler.report(limit, sort.value)
+    if reset:
+        profiler.reset()
+    return PlainTextResponse(report)
+
+@app.get('/service/memory')
+def service_memory() -> dict:
+    # Память текущего воркера: в режиме общего хранилища таблицы попадают в shared, а не в private.
+    # tables — таблицы, загруженные из БД: объем с типами по умолчанию и после сжатия типов
+    return {**get_process_memory(), 'tables': load_reports}
 
 
 if __name__ == "__main__":
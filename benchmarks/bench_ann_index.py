@@ -0,0 +1,56 @@
+# Бенчмарк индекса ближайших соседей: время поиска и recall@k относительно перебора.
+# По умолчанию строит индекс по синтетическим кластеризованным векторам; с флагом
+# --service берет W2V векторы постов из сервиса (импортирует app).
+# Запуск из корня проекта: python -m benchmarks.bench_ann_index [--service]
+import sys
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+
+N_POSTS = 7000
+DIM = 100
+N_QUERIES = 500
+TOP_K = 10
+N_PROBES = [1, 2, 4, 8, 16]
+
+
+def make_vectors(seed: int = 0) -> np.ndarray:
+    # Функция для генерации векторов с кластерной структурой, как у усредненных W2V
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(50, DIM))
+    return centers[rng.integers(0, 50, N_POSTS)] + 0.6 * rng.normal(size=(N_POSTS, DIM))
+
+
+def main():
+    if '--service' in sys.argv:
+        import app
+        index = app.ann_index
+    else:
+        start = time.perf_counter()
+        index = IVFIndex(np.arange(N_POSTS), make_vectors())
+        print(f'build: {time.perf_counter() - start:.2f} s')
+
+    # Запросы — векторы самих постов (как в /post/similar)
+    rng = np.random.default_rng(1)
+    queries = index.vectors[rng.choice(len(index.ids), N_QUERIES)]
+
+    start = time.perf_counter()
+    for query in queries:
+        index.search_exact(query, TOP_K)
+    exact_time = (time.perf_counter() - start) / N_QUERIES * 1e6
+
+    print(f'posts: {len(index.ids)}, lists: {len(index.centroids)}, top-k: {TOP_K}')
+    print(f'brute force: {exact_time:8.1f} us/query')
+    for n_probe in N_PROBES:
+        index.n_probe = n_probe
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, TOP_K)
+        search_time = (time.perf_counter() - start) / N_QUERIES * 1e6
+        print(f'n_probe {n_probe:3d}: {search_time:8.1f} us/query, recall@{TOP_K} {index.recall(queries, TOP_K):.3f}')
+
+
+if __name__ == '__main__':
+    main()
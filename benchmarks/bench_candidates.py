@@ -0,0 +1,59 @@
+# Отчет о двухэтапном ранжировании: recall@k кандидатов относительно полного скоринга
+# каталога и ускорение. Работает на данных и моделях сервиса (импортирует app).
+# Запуск из корня проекта: python -m benchmarks.bench_candidates
+import time
+from datetime import datetime
+
+import numpy as np
+
+import app
+from candidates import CandidateGenerator
+
+N_USERS = 200
+TOP_K = 10
+CANDIDATE_COUNTS = [100, 200, 500, 1000]
+
+
+def get_top_positions(scoring_engine, predicts, user_id: int, rows=None) -> set:
+    # Функция для получения top-k постов (позиции в блоке) среди непросмотренных
+    unseen = app.liked_index.unseen_mask(user_id, scoring_engine.post_positions, scoring_engine.n_posts)
+    positions = np.arange(scoring_engine.n_posts) if rows is None else rows
+    mask = unseen[positions]
+    positions, predicts = positions[mask], predicts[mask]
+    return set(positions[np.argsort(-predicts)[:TOP_K]].tolist())
+
+
+def main():
+    generator = app.candidate_generator or CandidateGenerator(app.df_post_vectors, app.post_table, app.liked_index)
+    time_ = datetime.now()
+    user_ids = np.random.default_rng(0).choice(app.df_user['user_id'].to_numpy(), N_USERS, replace=False)
+
+    # Эталон: полный скоринг каталога
+    full_top, full_time = {}, 0.0
+    for user_id in user_ids:
+        scoring_engine = app.get_scoring_engine(app.get_exp_group(int(user_id)))
+        user_features = app.get_user_features(int(user_id))
+        start = time.perf_counter()
+        predicts = scoring_engine.predict(user_features, time_)
+        full_time += time.perf_counter() - start
+        full_top[user_id] = get_top_positions(scoring_engine, predicts, int(user_id))
+
+    print(f'users: {N_USERS}, top-k: {TOP_K}, catalogue: {app.get_scoring_engine("test").n_posts} posts')
+    print(f'full scoring: {full_time / N_USERS * 1000:7.2f} ms/user')
+    for n_candidates in CANDIDATE_COUNTS:
+        recall, stage_time = [], 0.0
+        for user_id in user_ids:
+            scoring_engine = app.get_scoring_engine(app.get_exp_group(int(user_id)))
+            user_features = app.get_user_features(int(user_id))
+            start = time.perf_counter()
+            rows = scoring_engine.get_rows(generator.get_candidates(int(user_id), n_candidates))
+            predicts = scoring_engine.predict(user_features, time_, rows)
+            stage_time += time.perf_counter() - start
+            top = get_top_positions(scoring_engine, predicts, int(user_id), rows)
+            recall.append(len(top & full_top[user_id]) / max(len(full_top[user_id]), 1))
+        print(f'candidates {n_candidates:5d}: recall@{TOP_K} {np.mean(recall):.3f}, '
+              f'{stage_time / N_USERS * 1000:7.2f} ms/user, speedup x{full_time / stage_time:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Отчет об упакованных моделях: время загрузки (CatBoost load_model против CompiledModel.load)
+# и стоимость скоринга запроса по всему каталогу и по кандидатам — ScoringEngine против
+# CompiledScoringEngine, с проверкой совпадения вероятностей. Сверка check_parity дополнительно
+# проверяется на моделях, обученных на строках сверки сервиса только с one-hot признаками
+# и только со счетчиками (CTR) по категориям.
+# Работает на данных и моделях сервиса (импортирует app).
+# Запуск из корня проекта: python -m benchmarks.bench_compiled_model
+import time
+from datetime import datetime
+
+import numpy as np
+from catboost import CatBoostClassifier
+
+import app
+from compiled_model import CompiledModel, check_parity, get_compiled_model_path, load_or_build_compiled_model
+from scoring import CompiledScoringEngine, ScoringEngine
+
+N_USERS = 200
+N_CANDIDATES = 150
+N_LOADS = 5
+
+
+def measure(func, n: int) -> float:
+    # Функция для получения среднего времени одного вызова в миллисекундах
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    return (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    user_ids = rng.choice(app.df_user['user_id'].to_numpy(), N_USERS)
+    users_features = [app.get_user_features(int(user_id)) for user_id in user_ids]
+    time_ = datetime.now()
+
+    print(f'{"model":>8} | {"load, ms":>9} | {"packed load, ms":>15} | {"trees":>5} | {"splits":>6}')
+    engines = {}
+    for name, arm in app.experiments.arms.items():
+        model_path, columns = arm.model_path, arm.get_columns()
+        model = CatBoostClassifier()
+        model.load_model(model_path)
+        df_post = app.get_posts_features(arm.features_table)
+        compiled_model = load_or_build_compiled_model(
+            model_path, lambda model: app.get_parity_sample(model, df_post, columns))
+        load_time = measure(lambda i: CatBoostClassifier().load_model(model_path), N_LOADS)
+        packed_load_time = measure(lambda i: CompiledModel.load(get_compiled_model_path(model_path)), N_LOADS)
+        print(f'{name:>8} | {load_time:9.1f} | {packed_load_time:15.1f} | '
+              f'{compiled_model.n_trees:5d} | {compiled_model.n_splits:6d}')
+        engines[name] = (ScoringEngine(model, df_post, columns),
+                         CompiledScoringEngine(compiled_model, df_post, columns))
+
+    print()
+    print(f'{"model":>8} | {"rows":>5} | {"catboost, ms":>12} | {"packed, ms":>10} | speedup | {"max diff":>8}')
+    for name, (engine, compiled_engine) in engines.items():
+        for n_rows in (engine.n_posts, N_CANDIDATES):
+            rows_list = [None if n_rows == engine.n_posts else np.sort(rng.choice(engine.n_posts, n_rows, replace=False))
+                         for _ in users_features]
+
+            # Вероятности обоих движков совпадают с точностью до округления
+            max_diff = max(np.abs(engine.predict(users_features[i], time_, rows_list[i]) -
+                                  compiled_engine.predict(users_features[i], time_, rows_list[i])).max()
+                           for i in range(20))
+
+            catboost_time = measure(lambda i: engine.predict(users_features[i], time_, rows_list[i]), N_USERS)
+            packed_time = measure(lambda i: compiled_engine.predict(users_features[i], time_, rows_list[i]), N_USERS)
+            print(f'{name:>8} | {n_rows:5d} | {catboost_time:12.2f} | {packed_time:10.3f} | '
+                  f'x{catboost_time / packed_time:6.1f} | {max_diff:8.1e}')
+
+    # Сверка на моделях с разными способами учета категорий (ValueError при расхождении)
+    print()
+    print(f'{"model":>8} | {"categories":>10} | {"rows":>5} | {"max diff":>8}')
+    for name, (engine, _) in engines.items():
+        features = app.get_parity_sample(engine.model, engine.posts_features, engine.columns)
+        target = rng.random(len(features)) < engine.model.predict_proba(features)[:, 1]
+        for kind, one_hot_max_size in (('one-hot', 255), ('ctr', 1)):
+            model = CatBoostClassifier(iterations=50, depth=6, one_hot_max_size=one_hot_max_size, verbose=0,
+                                       allow_writing_files=False, cat_features=engine.cat_columns)
+            model.fit(features, target)
+            max_diff = check_parity(model, CompiledModel.from_catboost(model), features)
+            print(f'{name:>8} | {kind:>10} | {len(features):5d} | {max_diff:8.1e}')
+
+
+if __name__ == '__main__':
+    main()
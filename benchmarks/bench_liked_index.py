@@ -0,0 +1,65 @@
+# Бенчмарк фильтрации лайкнутых постов: скан таблицы лайков против LikedPostsIndex.
+# Запуск из корня проекта: python -m benchmarks.bench_liked_index
+import time
+
+import numpy as np
+import pandas as pd
+
+from liked_index import LikedPostsIndex
+
+N_USERS = 160000  # примерно как в i_koskin_users_features_lesson_22
+N_POSTS = 7000  # примерно как в public.post_text_df
+N_LIKES = 2000000
+N_QUERIES = 200
+
+
+def make_liked_posts(seed: int = 0) -> pd.DataFrame:
+    # Функция для генерации синтетической таблицы лайков (схема как в feed_data)
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'post_id': rng.integers(1, N_POSTS + 1, N_LIKES),
+        'user_id': rng.integers(200, 200 + N_USERS, N_LIKES),
+    }).drop_duplicates()
+
+
+def bench(func, user_ids) -> float:
+    # Функция для замера среднего времени одного вызова в микросекундах
+    start = time.perf_counter()
+    for user_id in user_ids:
+        func(user_id)
+    return (time.perf_counter() - start) / len(user_ids) * 1e6
+
+
+def main():
+    liked_posts = make_liked_posts()
+    candidate_post_ids = np.arange(1, N_POSTS + 1)
+    post_positions = np.full(N_POSTS + 1, -1, dtype=np.int32)
+    post_positions[candidate_post_ids] = np.arange(N_POSTS, dtype=np.int32)
+
+    start = time.perf_counter()
+    index = LikedPostsIndex(liked_posts)
+    build_time = time.perf_counter() - start
+
+    user_ids = np.random.default_rng(1).integers(200, 200 + N_USERS, N_QUERIES)
+
+    def scan_mask(user_id):
+        liked = liked_posts.loc[liked_posts['user_id'] == user_id, 'post_id']
+        return ~np.isin(candidate_post_ids, liked.to_numpy())
+
+    def index_mask(user_id):
+        return index.unseen_mask(user_id, post_positions, N_POSTS)
+
+    # Проверяем, что оба способа дают одинаковую маску
+    for user_id in user_ids[:20]:
+        assert np.array_equal(scan_mask(user_id), index_mask(user_id))
+
+    print(f'likes: {len(liked_posts)}, users: {N_USERS}, posts: {N_POSTS}')
+    print(f'DataFrame memory:  {liked_posts.memory_usage(deep=True).sum() / 2**20:8.1f} MiB')
+    print(f'index memory:      {index.nbytes / 2**20:8.1f} MiB (build {build_time:.2f} s)')
+    print(f'scan + isin:       {bench(scan_mask, user_ids):8.1f} us/request')
+    print(f'index lookup only: {bench(index.get, user_ids):8.1f} us/request')
+    print(f'index + mask:      {bench(index_mask, user_ids):8.1f} us/request')
+
+
+if __name__ == '__main__':
+    main()
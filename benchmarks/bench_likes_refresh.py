@@ -0,0 +1,85 @@
+# Сравнение полной загрузки лайков (проход по всей таблице событий) с догрузкой
+# новых лайков по high-water mark на timestamp и слиянием их в индекс.
+# Таблица событий — синтетическая, в локальной SQLite (как feed_data: timestamp, user_id, post_id, action).
+# Запуск из корня проекта: python -m benchmarks.bench_likes_refresh
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from liked_index import LikedPostsIndex
+from likes_refresh import LikesRefresher
+
+N_EVENTS = 2_000_000
+N_USERS = 100_000
+N_POSTS = 7_000
+LIKE_SHARE = 0.1
+DAYS = 30
+NEW_EVENTS_MINUTES = [1, 5, 30]
+
+FULL_QUERY = """
+    SELECT post_id, user_id, max(timestamp) AS timestamp
+    FROM feed_data
+    WHERE action = 'like'
+    GROUP BY post_id, user_id
+"""
+
+
+def make_events(n_events: int, start: pd.Timestamp, seconds: int, rng: np.random.Generator) -> pd.DataFrame:
+    # Функция для создания синтетических событий ленты (время — строкой, как его хранит SQLite)
+    timestamps = start + pd.to_timedelta(np.sort(rng.integers(0, seconds, n_events)), unit='s')
+    return pd.DataFrame({
+        'timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S'),
+        'user_id': rng.integers(0, N_USERS, n_events),
+        'post_id': rng.integers(0, N_POSTS, n_events),
+        'action': np.where(rng.random(n_events) < LIKE_SHARE, 'like', 'view'),
+    })
+
+
+def main():
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp('2021-10-01')
+    events = make_events(N_EVENTS, start, DAYS * 86400, rng)
+    events_per_second = N_EVENTS / (DAYS * 86400)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f'sqlite:///{os.path.join(tmp_dir, "feed.db")}')
+        events.to_sql('feed_data', engine, index=False, chunksize=100_000)
+        with engine.begin() as conn:
+            conn.exec_driver_sql('CREATE INDEX feed_data_timestamp ON feed_data (timestamp)')
+
+        begin = time.perf_counter()
+        with engine.connect() as conn:
+            liked_posts = pd.read_sql(FULL_QUERY, conn, parse_dates=['timestamp'])
+        index = LikedPostsIndex(liked_posts)
+        full_time = time.perf_counter() - begin
+        print(f'events: {N_EVENTS}, likes: {index.n_likes}, full load: {full_time * 1000:.0f} ms')
+
+        print(f'{"new, min":>8} | {"events":>7} | {"refresh, ms":>11} | {"query, ms":>9} | {"merge, ms":>9} | vs full')
+        end = start + pd.Timedelta(days=DAYS)
+        for minutes in NEW_EVENTS_MINUTES:
+            new_events = make_events(int(events_per_second * minutes * 60), end, minutes * 60, rng)
+            new_events.to_sql('feed_data', engine, index=False, if_exists='append')
+            end += pd.Timedelta(minutes=minutes)
+
+            current = {'index': index}
+            refresher = LikesRefresher(engine, lambda: current['index'], lambda new: current.update(index=new),
+                                       interval=0, table='feed_data')
+            begin = time.perf_counter()
+            new_likes = refresher.load_new_likes(index.high_water_mark)
+            query_time = time.perf_counter() - begin
+            refresher.refresh()
+            refresh_time = refresher.last_duration_s
+            merge_time = refresh_time - query_time
+            print(f'{minutes:8d} | {len(new_events):7d} | {refresh_time * 1000:11.0f} | {query_time * 1000:9.0f} | '
+                  f'{merge_time * 1000:9.0f} | x{full_time / refresh_time:5.1f}')
+            index = current['index']
+            assert len(new_likes) and index.high_water_mark > np.datetime64(end - pd.Timedelta(minutes=minutes))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
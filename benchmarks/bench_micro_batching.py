@@ -0,0 +1,69 @@
+# Отчет о микробатчинге: пропускная способность и задержки скоринга при разном числе
+# одновременных запросов — отдельный вызов модели на запрос против пакетов MicroBatcher.
+# Работает на данных и моделях сервиса (импортирует app). Планировщик вызывается напрямую из
+# потоков, в обход пула скоринга; сервис целиком — MICRO_BATCH_WAIT_MS=5 python -m benchmarks.bench_service
+# Запуск из корня проекта: python -m benchmarks.bench_micro_batching
+import copy
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import app
+from micro_batching import MicroBatcher
+
+N_REQUESTS = 256
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+WAITS_MS = [2, 5]
+MAX_BATCH_SIZE = 32
+
+
+def run_load(predictor, users_features, concurrency: int):
+    # Функция для прогона N_REQUESTS запросов в concurrency потоков: возвращает (запросов/с, задержки в мс)
+    time_ = datetime.now()
+
+    def call(user_features):
+        start = time.perf_counter()
+        predictor.predict(user_features, time_)
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = np.array(list(pool.map(call, users_features)))
+        elapsed = time.perf_counter() - start
+    return N_REQUESTS / elapsed, latencies
+
+
+def report(name: str, concurrency: int, throughput: float, latencies: np.ndarray):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f'{name:>14} | {concurrency:4d} | {throughput:8.1f} | {p50:8.2f} | {p95:8.2f} | {p99:8.2f}')
+
+
+def main():
+    user_ids = np.random.default_rng(0).choice(app.df_user['user_id'].to_numpy(), N_REQUESTS)
+    users_features = [app.get_user_features(int(user_id)) for user_id in user_ids]
+    cpu_count = os.cpu_count() or 1
+
+    print(f'model: test, catalogue: {app.get_scoring_engine("test").n_posts} posts, requests: {N_REQUESTS}, cores: {cpu_count}')
+    print(f'{"mode":>14} | conc |    req/s |  p50, ms |  p95, ms |  p99, ms')
+    for concurrency in CONCURRENCY_LEVELS:
+        # Без микробатчинга ядра делятся между одновременными вызовами модели
+        direct = copy.copy(app.get_scoring_engine('test'))
+        direct.thread_count = max(1, cpu_count // concurrency)
+        report('direct', concurrency, *run_load(direct, users_features, concurrency))
+
+        # С микробатчингом модель вызывается из одного потока и получает все ядра
+        batched = copy.copy(app.get_scoring_engine('test'))
+        batched.thread_count = -1
+        for wait_ms in WAITS_MS:
+            micro_batcher = MicroBatcher(batched, wait_ms, MAX_BATCH_SIZE)
+            throughput, latencies = run_load(micro_batcher, users_features, concurrency)
+            report(f'batch {wait_ms} ms', concurrency, throughput, latencies)
+            stats = micro_batcher.stats()
+            print(f'{"":>14} | mean batch {stats["mean_batch"]:.1f}, largest {stats["largest_batch"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+# Сквозной нагрузочный тест /post/recommendations на синтетических данных.
+# Строит таблицы с теми же схемами, что и в учебной БД (признаки пользователей, признаки постов
+# lesson_22/lesson_25, тексты постов, feed_data), в локальной SQLite, обучает на них небольшие
+# модели CatBoost вместо настоящих и для каждого размера каталога запускает сервис в отдельном
+# процессе (DATABASE_URL, EXPERIMENTS_CONFIG). Запросы идут через ASGI-клиент в том же процессе:
+# сначала по одному, затем с CONNECTIONS одновременных соединений. В отчете — p50/p95/p99 задержки,
+# пропускная способность, среднее время этапов запроса (по метрикам сервиса), время старта и пиковый RSS.
+# Остальные переменные окружения сервиса (CANDIDATES_COUNT, MICRO_BATCH_WAIT_MS, COMPILED_MODELS, ...)
+# передаются как есть; кэш лент по умолчанию выключен, чтобы каждый запрос доходил до модели.
+# С --save-baseline результаты сохраняются в BASELINE_PATH, без него — сравниваются с сохраненными:
+# если p95 или пропускная способность хуже базовых больше чем на REGRESSION_TOLERANCE, код выхода 1.
+# Базовые результаты зависят от машины, поэтому в репозиторий не попадают (см. .gitignore): проверка
+# регрессий локальная — baseline сохраняется на той же машине до изменений, а без него сравнение пропускается.
+# Запуск из корня проекта: python -m benchmarks.bench_service [--sizes 1000 7000] [--save-baseline]
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from experiments import DEFAULT_EXPERIMENT
+from metrics import STAGE_SECONDS
+from scoring import CONTROL_COLUMNS, TEST_COLUMNS, get_time_features
+
+N_USERS = 20_000
+CATALOGUE_SIZES = [1_000, 7_000, 20_000]
+N_EVENTS_PER_USER = 20
+N_TRAIN = 50_000
+N_SEQUENTIAL = 200
+N_CONCURRENT = 1_000
+CONNECTIONS = 32
+LIMIT = 5
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_service_baseline.json')
+REGRESSION_TOLERANCE = 0.2
+
+TOPICS = ['business', 'covid', 'entertainment', 'movie', 'politics', 'sport', 'tech']
+CITIES = ['Moscow', 'Saint Petersburg', 'Novosibirsk', 'Yekaterinburg', 'Kazan', 'Omsk', 'Samara']
+AGE_GROUPS = ['0-18', '19-25', '26-35', '36-45', '46-55', '56-65', '65+']
+WORDS = np.array(['market', 'team', 'film', 'vaccine', 'election', 'growth', 'match', 'season', 'company',
+                  'people', 'government', 'study', 'world', 'price', 'player', 'story', 'series', 'report'])
+STAGES = ['user_lookup', 'candidates', 'features', 'predict', 'filter', 'top_k', 'serialize']
+
+
+def make_tables(n_posts: int, n_users: int, rng: np.random.Generator) -> dict:
+    # Функция для создания синтетических таблиц со схемами учебной БД
+    post_ids = np.arange(1, n_posts + 1)
+    topics = rng.choice(TOPICS, n_posts)
+    n_words = rng.integers(30, 300, n_posts)
+    post_text = pd.DataFrame({
+        'post_id': post_ids,
+        'text': [' '.join(rng.choice(WORDS, n)) for n in n_words],
+        'topic': topics,
+    })
+
+    vectors = rng.normal(size=(n_posts, 100)).astype(np.float64)
+    posts_w2v = pd.concat([pd.DataFrame({'post_id': post_ids, 'topic': topics}),
+                           pd.DataFrame(vectors, columns=[f'vector_{i}' for i in range(100)])], axis=1)
+    posts_pca = pd.DataFrame({'post_id': post_ids, 'topic': topics,
+                              'pca_1': vectors[:, :50].sum(axis=1) / 7, 'pca_2': vectors[:, 50:].sum(axis=1) / 7})
+
+    users = pd.DataFrame({
+        'user_id': np.arange(200, 200 + n_users),
+        'gender': rng.choice(['0', '1'], n_users),
+        'city': rng.choice(CITIES, n_users),
+        'exp_group': rng.choice(['0', '1', '2', '3', '4'], n_users),
+        'os': rng.choice(['Android', 'iOS'], n_users),
+        'source': rng.choice(['ads', 'organic'], n_users),
+        'age_group': rng.choice(AGE_GROUPS, n_users),
+        'time_of_day': rng.choice(['night', 'morning', 'afternoon', 'evening'], n_users),
+        'day_of_week': rng.choice(['weekday', 'weekend'], n_users),
+    })
+
+    n_events = n_users * N_EVENTS_PER_USER
+    timestamps = pd.Timestamp('2021-10-01') + pd.to_timedelta(rng.integers(0, 30 * 86400, n_events), unit='s')
+    actions = np.where(rng.random(n_events) < 0.1, 'like', 'view')
+    feed_data = pd.DataFrame({
+        'timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S'),
+        'user_id': rng.choice(users['user_id'].to_numpy(), n_events),
+        'post_id': rng.integers(1, n_posts + 1, n_events),
+        'action': actions,
+        'target': (actions == 'like').astype(np.int64),
+    })
+    return {'users': users, 'posts_pca': posts_pca, 'posts_w2v': posts_w2v,
+            'post_text': post_text, 'feed_data': feed_data}
+
+
+def write_database(tables: dict, work_dir: str) -> str:
+    # Функция для записи таблиц в SQLite: таблицы схемы public — в отдельный файл,
+    # который подключается как схема public (ATTACH), поэтому запросы сервиса не меняются
+    main_path, public_path = os.path.join(work_dir, 'startml.db'), os.path.join(work_dir, 'public.db')
+    with sqlite3.connect(main_path) as conn:
+        tables['users'].to_sql('i_koskin_users_features_lesson_22', conn, index=False)
+        tables['posts_pca'].to_sql('i_koskin_posts_features_lesson_22', conn, index=False)
+        tables['posts_w2v'].to_sql('i_koskin_posts_features_lesson_25', conn, index=False)
+    with sqlite3.connect(public_path) as conn:
+        tables['post_text'].to_sql('post_text_df', conn, index=False)
+        tables['feed_data'].to_sql('feed_data', conn, index=False, chunksize=100_000)
+        conn.execute('CREATE INDEX feed_data_timestamp ON feed_data (timestamp)')
+    return f'sqlite:///{main_path}'
+
+
+def attach_public_schema(public_path: str):
+    # Функция для подключения файла схемы public ко всем соединениям SQLite процесса
+    @event.listens_for(Engine, 'connect')
+    def attach(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            dbapi_connection.execute('ATTACH DATABASE ? AS public', (public_path,))
+
+
+def train_models(tables: dict, work_dir: str, rng: np.random.Generator) -> dict:
+    # Функция для обучения небольших моделей на синтетических показах (колонки — как у моделей сервиса)
+    users = tables['users'].drop(columns=['time_of_day', 'day_of_week'])
+    posts = tables['posts_w2v'].join(tables['posts_pca'][['pca_1', 'pca_2']])
+    times = pd.Timestamp('2021-10-01') + pd.to_timedelta(rng.integers(0, 30 * 86400, N_TRAIN), unit='s')
+    time_features = np.array([get_time_features(t) for t in times])
+    views = pd.concat([
+        users.iloc[rng.integers(0, len(users), N_TRAIN)].reset_index(drop=True),
+        posts.iloc[rng.integers(0, len(posts), N_TRAIN)].reset_index(drop=True),
+        pd.DataFrame(time_features, columns=['time_of_day', 'day_of_week']),
+    ], axis=1)
+    # Вероятность лайка зависит от признаков пользователя, поста и времени, чтобы деревья были непустыми
+    logit = (views['vector_0'] * (views['gender'] == '1') + 0.5 * views['vector_1'] * (views['os'] == 'iOS')
+             + (views['topic'] == 'covid') * views['age_group'].isin(AGE_GROUPS[3:])
+             + (views['time_of_day'] == 'evening') - 2)
+    target = rng.random(N_TRAIN) < 1 / (1 + np.exp(-logit))
+
+    model_paths = {}
+    for name, columns, iterations in (('PCA', CONTROL_COLUMNS, 100), ('W2V', TEST_COLUMNS, 200)):
+        model = CatBoostClassifier(iterations=iterations, depth=6, verbose=0, allow_writing_files=False,
+                                   cat_features=[c for c in columns if not pd.api.types.is_numeric_dtype(views[c])])
+        model.fit(views[columns], target)
+        model_paths[name] = os.path.join(work_dir, f'catboost_model_{name}')
+        model.save_model(model_paths[name])
+    return model_paths
+
+
+def write_experiment_config(model_paths: dict, work_dir: str) -> str:
+    # Функция для записи настройки эксперимента с моделями-заменителями (плечи — как по умолчанию)
+    config = DEFAULT_EXPERIMENT.model_copy(deep=True)
+    for arm in config.arms:
+        arm.model_path = model_paths['PCA' if arm.columns == 'pca' else 'W2V']
+    path = os.path.join(work_dir, 'experiments.json')
+    with open(path, 'w') as f:
+        f.write(config.model_dump_json())
+    return path
+
+
+def get_percentiles(latencies: list) -> dict:
+    # Функция для получения перцентилей задержки в мс
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2)}
+
+
+async def run_load(asgi_app, user_ids: np.ndarray, connections: int) -> dict:
+    # Функция для прогона запросов через connections одновременных соединений (закрытый цикл:
+    # каждое соединение отправляет следующий запрос после ответа на предыдущий)
+    import httpx
+
+    latencies, errors = [], 0
+    queue = iter(user_ids.tolist())
+
+    async def connection(client):
+        nonlocal errors
+        for user_id in queue:
+            start = time.perf_counter()
+            response = await client.get('/post/recommendations', params={'id': user_id, 'limit': LIMIT})
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(connection(client) for _ in range(connections)))
+        duration = time.perf_counter() - start
+    return {**get_percentiles(latencies), 'rps': round(len(latencies) / duration, 1), 'errors': errors}
+
+
+def get_stage_totals() -> dict:
+    # Функция для получения числа и суммарной длительности этапов запросов (гистограмма сервиса, все группы)
+    totals = {stage: [0, 0.0] for stage in STAGES}
+    for (exp_group, stage), (count, total) in STAGE_SECONDS.totals().items():
+        totals[stage][0] += count
+        totals[stage][1] += total
+    return totals
+
+
+def run_worker(work_dir: str, n_posts: int) -> dict:
+    # Функция для прогона в отдельном процессе: старт сервиса на синтетической БД и нагрузка
+    attach_public_schema(os.path.join(work_dir, 'public.db'))
+    import logging
+
+    start = time.perf_counter()
+    import app
+    startup_s = time.perf_counter() - start
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(1)
+    user_ids = app.df_user['user_id'].to_numpy()
+    # Прогрев: первые вызовы моделей и пулов потоков не попадают в замеры
+    asyncio.run(run_load(app.app, rng.choice(user_ids, 50), 4))
+
+    # Этапы — среднее по запросам обоих прогонов из метрик сервиса (recommendation_stage_seconds)
+    warm_up_totals = get_stage_totals()
+    sequential = asyncio.run(run_load(app.app, rng.choice(user_ids, N_SEQUENTIAL), 1))
+    concurrent = asyncio.run(run_load(app.app, rng.choice(user_ids, N_CONCURRENT), CONNECTIONS))
+    stages_ms = {}
+    for stage, (count, total) in get_stage_totals().items():
+        count -= warm_up_totals[stage][0]
+        total -= warm_up_totals[stage][1]
+        stages_ms[stage] = round(total / count * 1000, 3) if count else 0.0
+
+    # Средний размер пакета микробатчинга (0 — микробатчинг выключен)
+    batching = app.service_batching().values()
+    batches = sum(stats['batches'] for stats in batching)
+    mean_batch = sum(stats['requests'] for stats in batching) / batches if batches else 0.0
+
+    return {
+        'posts': n_posts,
+        'startup_s': round(startup_s, 2),
+        'mean_batch': round(mean_batch, 1),
+        'sequential': sequential,
+        'concurrent': concurrent,
+        'stages_ms': stages_ms,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_size(n_posts: int, rng: np.random.Generator, base_dir: str) -> dict:
+    # Функция для подготовки данных одного размера каталога и запуска процесса с сервисом
+    work_dir = os.path.join(base_dir, str(n_posts))
+    os.makedirs(work_dir)
+    tables = make_tables(n_posts, N_USERS, rng)
+    database_url = write_database(tables, work_dir)
+    config_path = write_experiment_config(train_models(tables, work_dir, rng), work_dir)
+
+    env = {**os.environ, 'DATABASE_URL': database_url, 'EXPERIMENTS_CONFIG': config_path,
+           'EXPERIMENTS_PRELOAD': '1', 'EXPERIMENTS_WEIGHTS': '', 'SNAPSHOT_DIR': '', 'FEATURE_STORE_DIR': '',
+           'ANN_INDEX_PATH': os.path.join(work_dir, 'ann_index.npz'), 'LIKES_REFRESH_INTERVAL': '0',
+           'MODEL_WATCH_INTERVAL': '0'}
+    env.setdefault('FEED_CACHE_SIZE_MB', '0')
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_service', '--worker', work_dir, str(n_posts)],
+                            env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_results(results: list):
+    print(f'{"posts":>6} | {"mode":>10} | {"p50, ms":>8} | {"p95, ms":>8} | {"p99, ms":>8} | {"rps":>7} | errors')
+    for result in results:
+        for mode in ('sequential', 'concurrent'):
+            load = result[mode]
+            print(f'{result["posts"]:6d} | {mode:>10} | {load["p50_ms"]:8.2f} | {load["p95_ms"]:8.2f} | '
+                  f'{load["p99_ms"]:8.2f} | {load["rps"]:7.1f} | {load["errors"]}')
+    print()
+    print(f'{"posts":>6} | ' + ' | '.join(f'{stage:>13}' for stage in STAGES) + f' | {"batch":>5} | {"startup, s":>10} | peak RSS, MB')
+    for result in results:
+        print(f'{result["posts"]:6d} | ' + ' | '.join(f'{result["stages_ms"][stage]:10.3f} ms' for stage in STAGES)
+              + f' | {result.get("mean_batch", 0.0):5.1f} | {result["startup_s"]:10.2f} | {result["peak_rss_mb"]:.1f}')
+
+
+def compare_with_baseline(results: list, baseline: list) -> bool:
+    # Функция для сравнения с сохраненными результатами: True, если регрессий нет
+    baseline_by_size = {result['posts']: result for result in baseline}
+    ok = True
+    print()
+    print(f'{"posts":>6} | {"mode":>10} | {"p95 vs base":>11} | {"rps vs base":>11}')
+    for result in results:
+        base = baseline_by_size.get(result['posts'])
+        if base is None:
+            continue
+        for mode in ('sequential', 'concurrent'):
+            p95_ratio = result[mode]['p95_ms'] / base[mode]['p95_ms']
+            rps_ratio = result[mode]['rps'] / base[mode]['rps']
+            regression = p95_ratio > 1 + REGRESSION_TOLERANCE or rps_ratio < 1 - REGRESSION_TOLERANCE
+            ok = ok and not regression
+            print(f'{result["posts"]:6d} | {mode:>10} | x{p95_ratio:10.2f} | x{rps_ratio:10.2f}'
+                  + (' | REGRESSION' if regression else ''))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=CATALOGUE_SIZES)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--worker', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker[0], int(args.worker[1]))))
+        return
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as base_dir:
+        results = [run_size(n_posts, rng, base_dir) for n_posts in args.sizes]
+    print(f'users: {N_USERS}, connections: {CONNECTIONS}, limit: {LIMIT}')
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'baseline saved: {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            if not compare_with_baseline(results, json.load(f)):
+                sys.exit(1)
+    else:
+        print(f'no baseline at {args.baseline}: comparison skipped (save one with --save-baseline)')
+
+
+if __name__ == '__main__':
+    main()
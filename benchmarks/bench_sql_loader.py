@@ -0,0 +1,99 @@
+# Сравнение загрузки таблиц из БД: список чанков с типами по умолчанию и pd.concat (прежний
+# batch_load_sql) против sql_loader.load_sql_compact (чанки сразу пишутся в выделенные массивы
+# в компактных типах). Для каждой из пяти таблиц, которые сервис загружает при старте, —
+# время, пик выделенной памяти (tracemalloc) и размер готовой таблицы.
+# Таблицы — синтетические, в локальной SQLite (схемы — как в bench_service). Перед замерами
+# check_chunk_types проверяет смену типа колонки между чанками (пропуски в целых колонках).
+# Запуск из корня проекта: python -m benchmarks.bench_sql_loader
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Integer, create_engine
+
+from benchmarks.bench_service import attach_public_schema, make_tables, write_database
+from sql_loader import get_memory_mb, load_sql_compact
+
+N_USERS = 163_000
+N_POSTS = 7_000
+CONCAT_CHUNKSIZE = 200_000  # размер чанка прежнего batch_load_sql
+
+QUERIES = {
+    'users': 'SELECT * FROM i_koskin_users_features_lesson_22',
+    'posts PCA': 'SELECT * FROM i_koskin_posts_features_lesson_22',
+    'posts W2V': 'SELECT * FROM i_koskin_posts_features_lesson_25',
+    'post texts': 'SELECT * FROM public.post_text_df',
+    'likes': """
+        SELECT post_id, user_id, max(timestamp) AS timestamp
+        FROM public.feed_data
+        WHERE action='like'
+        GROUP BY post_id, user_id
+    """,
+}
+
+
+def load_concat(engine, query: str, parse_dates=None) -> pd.DataFrame:
+    # Функция прежней загрузки: все чанки в списке, затем склейка
+    conn = engine.connect().execution_options(stream_results=True)
+    chunks = []
+    for chunk_dataframe in pd.read_sql(query, conn, chunksize=CONCAT_CHUNKSIZE, parse_dates=parse_dates):
+        chunks.append(chunk_dataframe)
+    conn.close()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def check_chunk_types(engine):
+    # Функция для проверки целых колонок, в которых пропуск встречается не в первом чанке:
+    # колонка должна перейти во float64 с NaN и в int32, и в уже расширенном int64 буфере
+    values = {'small': [1, 2, None, 4], 'wide': [2 ** 40, 1, None, 3], 'late_wide': [1, 2, 2 ** 40, None]}
+    expected = pd.DataFrame(values, dtype=np.float64)
+    expected.to_sql('chunk_types', engine, index=False, dtype={column: Integer() for column in values})
+    for chunksize in (1, 2, 4):
+        df = load_sql_compact(engine, 'SELECT * FROM chunk_types', chunksize=chunksize)
+        pd.testing.assert_frame_equal(df.astype(np.float64), expected)
+    # Без пропусков колонка остается целой (int32, при больших значениях — int64)
+    df = load_sql_compact(engine, 'SELECT * FROM chunk_types WHERE rowid <= 2', chunksize=1)
+    assert [str(dtype) for dtype in df.dtypes] == ['int32', 'int64', 'int32'], df.dtypes
+    print('chunk types: ok')
+
+
+def measure(load):
+    # Функция для замера времени и пика выделенной памяти (МиБ) одной загрузки
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = load()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, duration, peak / 2 ** 20
+
+
+def main():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as work_dir:
+        database_url = write_database(make_tables(N_POSTS, N_USERS, rng), work_dir)
+        attach_public_schema(os.path.join(work_dir, 'public.db'))
+        engine = create_engine(database_url)
+        check_chunk_types(engine)
+
+        print(f'{"table":>10} | {"rows":>7} | {"concat, s":>9} | {"peak, MiB":>9} | {"size, MiB":>9} | '
+              f'{"compact, s":>10} | {"peak, MiB":>9} | {"size, MiB":>9} | dtypes')
+        for name, query in QUERIES.items():
+            parse_dates = ['timestamp'] if name == 'likes' else None  # как в load_liked_posts
+            df_concat, concat_time, concat_peak = measure(lambda: load_concat(engine, query, parse_dates))
+            df_compact, compact_time, compact_peak = measure(lambda: load_sql_compact(engine, query, parse_dates))
+            # Значения совпадают с точностью до float32
+            pd.testing.assert_frame_equal(df_concat, df_compact, check_dtype=False, check_categorical=False,
+                                          check_exact=False, rtol=1e-6)
+            dtypes = ', '.join(sorted({str(dtype) for dtype in df_compact.dtypes}))
+            print(f'{name:>10} | {len(df_compact):7d} | {concat_time:9.2f} | {concat_peak:9.1f} | '
+                  f'{get_memory_mb(df_concat):9.1f} | {compact_time:10.2f} | {compact_peak:9.1f} | '
+                  f'{get_memory_mb(df_compact):9.1f} | {dtypes}')
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Сравнение расчета W2V векторов постов: как в ноутбуке Project_catboost_model_W2V.ipynb
+# (apply(preprocess_text) и vectorize_text — поиск и усреднение векторов слово за словом)
+# против text_embeddings (номера слов по словарю, выборка строк матрицы векторов, сумма по отрезкам)
+# в одном процессе и в пуле процессов. Затем — полная сборка таблицы признаков и инкрементальная
+# догрузка новых постов в локальной SQLite. Словарь, векторы и тексты — синтетические.
+# Запуск из корня проекта: python -m benchmarks.bench_text_embeddings
+import os
+import re
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from benchmarks.bench_service import attach_public_schema
+from text_embeddings import WordVectors, embed_texts, update_post_features
+
+N_POSTS = 7_023
+N_NEW_POSTS = 100
+VOCABULARY_SIZE = 30_000
+VECTOR_SIZE = 100
+OOV_SHARE = 0.1  # доля слов текстов, которых нет в словаре
+WORKERS = [1, os.cpu_count() or 1]
+
+
+class NotebookVectors:
+    # Векторы с интерфейсом model.wv из gensim: word in wv, wv[word]
+    def __init__(self, words, vectors):
+        self.key_to_index = {word: i for i, word in enumerate(words)}
+        self.vectors = vectors
+        self.vector_size = vectors.shape[1]
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def __getitem__(self, word):
+        return self.vectors[self.key_to_index[word]]
+
+
+class NotebookModel:
+    def __init__(self, wv):
+        self.wv = wv
+        self.vector_size = wv.vector_size
+
+
+def preprocess_text(text):
+    text = text.lower()  # Привести к нижнему регистру
+    text = re.sub(r'\W', ' ', text)  # Удалить знаки препинания
+    return text
+
+
+def vectorize_text(text, model):
+    words = text.split()
+    vectors = [model.wv[word] for word in words if word in model.wv]
+    if not vectors:  # Если нет слов из модели
+        return np.zeros(model.vector_size)
+    return np.mean(vectors, axis=0)
+
+
+def embed_notebook(texts: pd.Series, model) -> np.ndarray:
+    # Функция для расчета векторов так же, как в ноутбуке
+    cleaned_text = texts.apply(preprocess_text)
+    return np.stack(cleaned_text.apply(lambda x: vectorize_text(x, model)).values)
+
+
+def make_texts(n_posts: int, words: np.ndarray, rng: np.random.Generator) -> pd.Series:
+    # Функция для создания текстов: слова словаря и незнакомые слова, разный регистр и пунктуация
+    texts = []
+    for n_words in rng.integers(30, 300, n_posts):
+        tokens = rng.choice(words, n_words).astype(object)
+        oov = rng.random(n_words) < OOV_SHARE
+        tokens[oov] = [f'unknown{i}' for i in rng.integers(0, 10 ** 6, oov.sum())]
+        upper = rng.random(n_words) < 0.1
+        tokens[upper] = [token.capitalize() for token in tokens[upper]]
+        separators = rng.choice([' ', ' ', ' ', ', ', '. ', ' - ', '!\n'], n_words)
+        texts.append(''.join(token + separator for token, separator in zip(tokens, separators)))
+    return pd.Series(texts, dtype=object)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    words = np.array([''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz'), rng.integers(3, 12)))
+                      for _ in range(VOCABULARY_SIZE)])
+    words = pd.unique(words)
+    vectors = rng.normal(size=(len(words), VECTOR_SIZE)).astype(np.float32)
+    texts = make_texts(N_POSTS, words, rng)
+    word_vectors = WordVectors(words, vectors)
+
+    start = time.perf_counter()
+    expected = embed_notebook(texts, NotebookModel(NotebookVectors(words, vectors)))
+    notebook_time = time.perf_counter() - start
+    print(f'{N_POSTS} posts, vocabulary {len(words)}, vector size {VECTOR_SIZE}')
+    print(f'{"method":>20} | {"time, s":>8} | {"speedup":>7} | max abs diff')
+    print(f'{"notebook":>20} | {notebook_time:8.2f} | {1:7.1f} |')
+    for workers in dict.fromkeys(WORKERS):
+        start = time.perf_counter()
+        embeddings = embed_texts(word_vectors, texts.tolist(), workers)
+        duration = time.perf_counter() - start
+        max_diff = np.abs(embeddings - expected).max()
+        print(f'{f"vectorized x{workers}":>20} | {duration:8.2f} | {notebook_time / duration:7.1f} | {max_diff:.2e}')
+
+    # Таблица признаков: полная сборка, затем догрузка новых постов
+    with tempfile.TemporaryDirectory() as work_dir:
+        public_path = os.path.join(work_dir, 'public.db')
+        post_text = pd.DataFrame({'post_id': np.arange(1, N_POSTS + 1), 'text': texts,
+                                  'topic': rng.choice(['covid', 'movie', 'sport'], N_POSTS)})
+        with sqlite3.connect(public_path) as conn:
+            post_text.to_sql('post_text_df', conn, index=False)
+        attach_public_schema(public_path)
+        engine = create_engine(f'sqlite:///{os.path.join(work_dir, "startml.db")}')
+
+        start = time.perf_counter()
+        n_full = update_post_features(engine, word_vectors, full=True, workers=os.cpu_count() or 1)
+        full_time = time.perf_counter() - start
+
+        new_posts = pd.DataFrame({'post_id': np.arange(N_POSTS + 1, N_POSTS + N_NEW_POSTS + 1),
+                                  'text': make_texts(N_NEW_POSTS, words, rng), 'topic': 'covid'})
+        with sqlite3.connect(public_path) as conn:
+            new_posts.to_sql('post_text_df', conn, index=False, if_exists='append')
+        start = time.perf_counter()
+        n_new = update_post_features(engine, word_vectors)
+        incremental_time = time.perf_counter() - start
+        engine.dispose()
+    print(f'full table: {n_full} posts in {full_time:.2f} s, incremental: {n_new} new posts in {incremental_time:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
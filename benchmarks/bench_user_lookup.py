@@ -0,0 +1,66 @@
+# Сравнение поиска признаков пользователя: проход по таблице (df_user.loc[df_user['user_id'] == id])
+# против UserStore с плотным индексом user_id -> строка.
+# Запуск из корня проекта: python -m benchmarks.bench_user_lookup
+import time
+
+import numpy as np
+import pandas as pd
+
+from user_store import UserStore
+
+N_USERS = [10_000, 100_000, 200_000]
+N_LOOKUPS = 2_000
+
+
+def make_users(n_users: int, rng: np.random.Generator) -> pd.DataFrame:
+    # Функция для создания синтетической таблицы признаков пользователей (колонки как в сервисе)
+    return pd.DataFrame({
+        'user_id': rng.permutation(n_users * 2)[:n_users],
+        'gender': rng.integers(0, 2, n_users),
+        'city': rng.choice([f'city_{i}' for i in range(1000)], n_users),
+        'exp_group': rng.integers(0, 5, n_users),
+        'os': rng.choice(['Android', 'iOS'], n_users),
+        'source': rng.choice(['ads', 'organic'], n_users),
+        'age_group': rng.choice(['14-18', '19-25', '26-35', '36-50', '50+'], n_users),
+    })
+
+
+def scan_lookup(df_user: pd.DataFrame, user_id: int) -> dict:
+    # Прежний способ из app.py
+    user_features = df_user.loc[df_user['user_id'] == user_id]
+    user_features = user_features.drop(['user_id'], axis=1)
+    return dict(zip(user_features.columns, user_features.values[0]))
+
+
+def measure(func, user_ids) -> float:
+    # Функция для получения среднего времени одного вызова в микросекундах
+    start = time.perf_counter()
+    for user_id in user_ids:
+        func(int(user_id))
+    return (time.perf_counter() - start) / len(user_ids) * 1e6
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"users":>8} | {"scan, us":>10} | {"store, us":>10} | speedup | build, ms')
+    for n_users in N_USERS:
+        df_user = make_users(n_users, rng)
+        user_ids = rng.choice(df_user['user_id'].to_numpy(), N_LOOKUPS)
+
+        start = time.perf_counter()
+        user_store = UserStore(df_user)
+        build_time = (time.perf_counter() - start) * 1000
+
+        # Результаты обоих способов совпадают
+        for user_id in user_ids[:100]:
+            expected = scan_lookup(df_user, int(user_id))
+            actual = user_store.get(int(user_id))
+            assert {k: str(v) for k, v in expected.items()} == {k: str(v) for k, v in actual.items()}
+
+        scan_time = measure(lambda user_id: scan_lookup(df_user, user_id), user_ids[:200])
+        store_time = measure(user_store.get, user_ids)
+        print(f'{n_users:8d} | {scan_time:10.1f} | {store_time:10.2f} | x{scan_time / store_time:6.0f} | {build_time:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
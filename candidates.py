@@ -0,0 +1,105 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from ann_index import IVFIndex
+from liked_index import LikedPostsIndex
+
+# Доля кандидатов из ближайших соседей в пространстве W2V (остальное — популярное по темам)
+NEIGHBOURS_SHARE = 0.5
+
+
+class CandidateGenerator:
+    # Дешевый отбор кандидатов перед ранжированием CatBoost:
+    # - популярные посты (по числу лайков) в темах, которые лайкает пользователь;
+    # - ближайшие по косинусу посты к среднему W2V вектору лайкнутых постов.
+    # Для пользователей без лайков — просто самые популярные посты.
+    # Если передан ann_index, соседи ищутся приближенно по индексу, а не перебором.
+
+    def __init__(self, post_vectors: pd.DataFrame, post_table: pd.DataFrame, liked_index: LikedPostsIndex,
+                 ann_index: Optional[IVFIndex] = None):
+        self.ann_index = ann_index
+
+        posts = post_vectors.merge(post_table[['post_id', 'topic']], on='post_id', how='left',
+                                   suffixes=('_features', ''))
+        self.post_ids = posts['post_id'].to_numpy(dtype=np.int64)
+        self.n_posts = len(posts)
+
+        self.post_positions = np.full(int(self.post_ids.max()) + 1 if self.n_posts else 0, -1, dtype=np.int32)
+        self.post_positions[self.post_ids] = np.arange(self.n_posts, dtype=np.int32)
+
+        # Нормированные векторы постов: скалярное произведение = косинусная близость
+        vector_columns = [c for c in posts.columns if c.startswith('vector_')]
+        vectors = posts[vector_columns].to_numpy(dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.maximum(norms, 1e-12)
+
+        self.topic_codes, self.topics = pd.factorize(posts['topic'].astype(str))
+        self.set_liked_index(liked_index)
+
+    def set_liked_index(self, liked_index: LikedPostsIndex):
+        # Функция для подмены индекса лайков (после догрузки новых лайков) с пересчетом популярности
+        like_counts = liked_index.like_counts(self.post_positions, self.n_posts)
+        popular = np.argsort(-like_counts, kind='stable').astype(np.int32)
+        # Посты каждой темы, отсортированные по популярности
+        popular_by_topic = [popular[self.topic_codes[popular] == code] for code in range(len(self.topics))]
+        self.liked_index, self.popular, self.popular_by_topic = liked_index, popular, popular_by_topic
+
+    def get_liked_positions(self, user_id: int) -> np.ndarray:
+        # Функция для получения позиций лайкнутых пользователем постов
+        liked = self.liked_index.get(user_id)
+        liked = liked[liked < len(self.post_positions)]
+        positions = self.post_positions[liked]
+        return positions[positions >= 0]
+
+    def get_neighbours(self, liked_positions: np.ndarray, n: int, unseen: np.ndarray) -> np.ndarray:
+        # Функция для поиска непросмотренных постов, ближайших к профилю пользователя
+        if n <= 0 or not len(liked_positions):
+            return np.empty(0, dtype=np.int32)
+        profile = self.vectors[liked_positions].mean(axis=0)
+        if self.ann_index is not None:
+            # Берем с запасом на уже лайкнутые посты, которые тоже окажутся рядом
+            neighbour_ids, _ = self.ann_index.search(profile, n + len(liked_positions))
+            neighbour_ids = neighbour_ids[neighbour_ids < len(self.post_positions)]
+            positions = self.post_positions[neighbour_ids]
+            positions = positions[positions >= 0]
+            return positions[unseen[positions]][:n]
+
+        similarity = self.vectors @ profile
+        similarity[~unseen] = -np.inf
+        n = min(n, int(unseen.sum()))
+        top = np.argpartition(-similarity, n - 1)[:n] if n else np.empty(0, dtype=np.int64)
+        return top[np.argsort(-similarity[top])].astype(np.int32)
+
+    def get_topic_popular(self, liked_positions: np.ndarray, n: int, unseen: np.ndarray) -> np.ndarray:
+        # Функция для отбора популярных постов пропорционально интересу пользователя к темам
+        if n <= 0:
+            return np.empty(0, dtype=np.int32)
+        if not len(liked_positions):
+            popular = self.popular[unseen[self.popular]]
+            return popular[:n]
+
+        topic_counts = np.bincount(self.topic_codes[liked_positions], minlength=len(self.topics))
+        quotas = np.ceil(n * topic_counts / topic_counts.sum()).astype(int)
+        parts = []
+        for code, quota in enumerate(quotas):
+            if quota:
+                topic_popular = self.popular_by_topic[code]
+                parts.append(topic_popular[unseen[topic_popular]][:quota])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+    def get_candidates(self, user_id: int, n_candidates: int) -> np.ndarray:
+        # Функция для получения post_id кандидатов для пользователя (без уже лайкнутых)
+        liked_positions = self.get_liked_positions(user_id)
+        unseen = np.ones(self.n_posts, dtype=bool)
+        unseen[liked_positions] = False
+
+        n_neighbours = int(n_candidates * NEIGHBOURS_SHARE) if len(liked_positions) else 0
+        parts = [
+            self.get_neighbours(liked_positions, n_neighbours, unseen),
+            self.get_topic_popular(liked_positions, n_candidates - n_neighbours, unseen),
+            self.popular[unseen[self.popular]][:n_candidates],  # добор до нужного числа
+        ]
+        positions = pd.unique(np.concatenate(parts))[:n_candidates]
+        return self.post_ids[positions]
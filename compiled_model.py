@@ -0,0 +1,502 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+
+logger = logging.getLogger(__name__)
+
+# Включает скоринг упакованными моделями (без CatBoost и хэширования строк на каждый вызов)
+COMPILED_MODELS = os.getenv('COMPILED_MODELS', '0') == '1'
+
+# Константа, которой CatBoost смешивает хэши элементов комбинации категориальных признаков
+HASH_MAGIC_MULT = np.uint64(0x4906ba494954cb65)
+
+SPLIT_FLOAT = 0    # числовой признак больше порога
+SPLIT_ONE_HOT = 1  # хэш категории равен значению
+SPLIT_CTR = 2      # счетчик по комбинации категорий больше порога
+
+# Допустимое расхождение вероятностей упакованной модели и CatBoost (округление float32)
+PARITY_TOLERANCE = 1e-5
+
+
+# Константы CityHash64 (версия 1.0, которой CatBoost хэширует значения категориальных признаков)
+_MASK64 = 0xffffffffffffffff
+_K0 = 0xc3a5c85c97cb3127
+_K1 = 0xb492b66fbe98f273
+_K2 = 0x9ae16a3b2f90404f
+_K3 = 0xc949d7c7509e6557
+_K_MUL = 0x9ddfea08eb382d69
+
+
+def _fetch64(data: bytes, i: int) -> int:
+    return struct.unpack_from('<Q', data, i)[0]
+
+
+def _fetch32(data: bytes, i: int) -> int:
+    return struct.unpack_from('<I', data, i)[0]
+
+
+def _rotate(value: int, shift: int) -> int:
+    return value if shift == 0 else ((value >> shift) | (value << (64 - shift))) & _MASK64
+
+
+def _shift_mix(value: int) -> int:
+    return value ^ (value >> 47)
+
+
+def _hash_len16(u: int, v: int) -> int:
+    a = ((u ^ v) * _K_MUL) & _MASK64
+    a ^= a >> 47
+    b = ((v ^ a) * _K_MUL) & _MASK64
+    b ^= b >> 47
+    return (b * _K_MUL) & _MASK64
+
+
+def _hash_len0to16(data: bytes) -> int:
+    n = len(data)
+    if n > 8:
+        a = _fetch64(data, 0)
+        b = _fetch64(data, n - 8)
+        return _hash_len16(a, _rotate((b + n) & _MASK64, n)) ^ b
+    if n >= 4:
+        a = _fetch32(data, 0)
+        return _hash_len16((n + (a << 3)) & _MASK64, _fetch32(data, n - 4))
+    if n > 0:
+        y = (data[0] + (data[n >> 1] << 8)) & 0xffffffff
+        z = (n + (data[n - 1] << 2)) & 0xffffffff
+        return (_shift_mix((y * _K2 ^ z * _K3) & _MASK64) * _K2) & _MASK64
+    return _K2
+
+
+def _hash_len17to32(data: bytes) -> int:
+    n = len(data)
+    a = (_fetch64(data, 0) * _K1) & _MASK64
+    b = _fetch64(data, 8)
+    c = (_fetch64(data, n - 8) * _K2) & _MASK64
+    d = (_fetch64(data, n - 16) * _K0) & _MASK64
+    return _hash_len16((_rotate((a - b) & _MASK64, 43) + _rotate(c, 30) + d) & _MASK64,
+                       (a + _rotate(b ^ _K3, 20) - c + n) & _MASK64)
+
+
+def _hash_len33to64(data: bytes) -> int:
+    n = len(data)
+    z = _fetch64(data, 24)
+    a = (_fetch64(data, 0) + (n + _fetch64(data, n - 16)) * _K0) & _MASK64
+    b = _rotate((a + z) & _MASK64, 52)
+    c = _rotate(a, 37)
+    a = (a + _fetch64(data, 8)) & _MASK64
+    c = (c + _rotate(a, 7)) & _MASK64
+    a = (a + _fetch64(data, 16)) & _MASK64
+    vf = (a + z) & _MASK64
+    vs = (b + _rotate(a, 31) + c) & _MASK64
+    a = (_fetch64(data, 16) + _fetch64(data, n - 32)) & _MASK64
+    z = _fetch64(data, n - 8)
+    b = _rotate((a + z) & _MASK64, 52)
+    c = _rotate(a, 37)
+    a = (a + _fetch64(data, n - 24)) & _MASK64
+    c = (c + _rotate(a, 7)) & _MASK64
+    a = (a + _fetch64(data, n - 16)) & _MASK64
+    wf = (a + z) & _MASK64
+    ws = (b + _rotate(a, 31) + c) & _MASK64
+    r = _shift_mix(((vf + ws) * _K2 + (wf + vs) * _K0) & _MASK64)
+    return (_shift_mix((r * _K0 + vs) & _MASK64) * _K2) & _MASK64
+
+
+def _weak_hash_len32(data: bytes, i: int, a: int, b: int):
+    w, x, y, z = (_fetch64(data, i + offset) for offset in (0, 8, 16, 24))
+    a = (a + w) & _MASK64
+    b = _rotate((b + a + z) & _MASK64, 21)
+    c = a
+    a = (a + x + y) & _MASK64
+    b = (b + _rotate(a, 44)) & _MASK64
+    return (a + z) & _MASK64, (b + c) & _MASK64
+
+
+def city_hash64(data: bytes) -> int:
+    # Функция для получения CityHash64 строки байт
+    n = len(data)
+    if n <= 16:
+        return _hash_len0to16(data)
+    if n <= 32:
+        return _hash_len17to32(data)
+    if n <= 64:
+        return _hash_len33to64(data)
+
+    x = _fetch64(data, 0)
+    y = _fetch64(data, n - 16) ^ _K1
+    z = _fetch64(data, n - 56) ^ _K0
+    v = _weak_hash_len32(data, n - 64, n, y)
+    w = _weak_hash_len32(data, n - 32, (n * _K1) & _MASK64, _K0)
+    z = (z + _shift_mix(v[1]) * _K1) & _MASK64
+    x = (_rotate((z + x) & _MASK64, 39) * _K1) & _MASK64
+    y = (_rotate(y, 33) * _K1) & _MASK64
+    # Блоки по 64 байта (последний неполный блок уже учтен выше)
+    for i in range(0, (n - 1) & ~63, 64):
+        x = (_rotate((x + y + v[0] + _fetch64(data, i + 16)) & _MASK64, 37) * _K1) & _MASK64
+        y = (_rotate((y + v[1] + _fetch64(data, i + 48)) & _MASK64, 42) * _K1) & _MASK64
+        x ^= w[1]
+        y ^= v[0]
+        z = _rotate(z ^ w[0], 33)
+        v = _weak_hash_len32(data, i, (v[1] * _K1) & _MASK64, (x + w[0]) & _MASK64)
+        w = _weak_hash_len32(data, i + 32, (z + w[1]) & _MASK64, y)
+        z, x = x, z
+    return _hash_len16((_hash_len16(v[0], w[0]) + _shift_mix(y) * _K1 + z) & _MASK64,
+                       (_hash_len16(v[1], w[1]) + x) & _MASK64)
+
+
+def hash_cat_values(values: Sequence) -> np.ndarray:
+    # Функция для получения хэшей категориальных значений в том виде, в каком их считает CatBoost:
+    # младшие 32 бита CityHash64 строкового представления значения как знаковое число
+    hashes = [city_hash64(str(value).encode('utf-8')) & 0xffffffff for value in values]
+    return np.asarray(hashes, dtype=np.uint32).view(np.int32).astype(np.int64)
+
+
+def combine_hashes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Функция для добавления элемента к хэшу комбинации (арифметика по модулю 2^64, как в CatBoost)
+    return HASH_MAGIC_MULT * (a + HASH_MAGIC_MULT * b)
+
+
+class CompiledModel:
+    # Модель CatBoost (симметричные деревья), разобранная из JSON-выгрузки в массивы numpy.
+    # Все бинарные признаки модели (порог числового признака, значение категории для one-hot,
+    # порог счетчика по комбинации категорий) пронумерованы как в CatBoost (split_index),
+    # дерево — это номера его бинарных признаков по уровням и таблица значений листьев.
+    # Категориальные признаки подаются уже хэшированными, поэтому скоринг не разбирает строки,
+    # а часть бинарных признаков, зависящая только от постов, может быть посчитана один раз.
+
+    def __init__(self, meta: Dict, arrays: Dict[str, np.ndarray]):
+        self.feature_names = meta['feature_names']
+        self.cat_features = meta['cat_features']  # позиции категориальных признаков во входе модели
+        self.ctrs = meta['ctrs']
+        self.scale = meta['scale']
+        self.bias = meta['bias']
+        self.fingerprint = meta['fingerprint']
+        self.parity_checked = meta.get('parity_checked', False)  # вероятности сверены с CatBoost
+
+        self.split_kinds = arrays['split_kinds']
+        self.split_features = arrays['split_features']  # позиция во входе модели или номер счетчика
+        self.split_borders = arrays['split_borders']
+        self.split_values = arrays['split_values']
+        self.tree_splits = arrays['tree_splits']  # (деревья × глубина), -1 — уровня нет
+        self.leaf_values = arrays['leaf_values']  # (деревья × 2^глубина)
+        self.ctr_tables = [(arrays[f'ctr_{i}_keys'], arrays[f'ctr_{i}_counts']) for i in range(len(self.ctrs))]
+
+        self.n_splits = len(self.split_kinds)
+        self.n_trees, self.depth = self.tree_splits.shape
+
+        # Входы модели, от которых зависит каждый бинарный признак
+        self.split_inputs = []
+        for kind, feature in zip(self.split_kinds, self.split_features):
+            if kind == SPLIT_CTR:
+                ctr = self.ctrs[feature]
+                self.split_inputs.append(set(ctr['cat_features']) | {e['feature'] for e in ctr['bin_features']})
+            else:
+                self.split_inputs.append({int(feature)})
+
+    @classmethod
+    def from_catboost(cls, model: CatBoostClassifier, fingerprint: str = '') -> 'CompiledModel':
+        # Функция для упаковки обученной модели CatBoost
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'model.json')
+            model.save_model(path, format='json')
+            with open(path) as f:
+                data = json.load(f)
+
+        features_info = data['features_info']
+        float_positions = {f['feature_index']: f['flat_feature_index'] for f in features_info.get('float_features', [])}
+        cat_positions = {f['feature_index']: f['flat_feature_index'] for f in features_info.get('categorical_features', [])}
+
+        # Бинарные признаки в порядке нумерации CatBoost: пороги числовых признаков,
+        # значения one-hot категорий, пороги счетчиков
+        kinds, features, borders, values = [], [], [], []
+        for f in features_info.get('float_features', []):
+            for border in f['borders']:
+                kinds.append(SPLIT_FLOAT), features.append(f['flat_feature_index'])
+                borders.append(border), values.append(0)
+        for f in features_info.get('categorical_features', []):
+            for value in f.get('values', []):
+                kinds.append(SPLIT_ONE_HOT), features.append(f['flat_feature_index'])
+                borders.append(0.0), values.append(value)
+
+        ctrs, ctr_arrays = [], {}
+        for i, ctr in enumerate(features_info.get('ctrs', [])):
+            if ctr['ctr_type'] not in ('Borders', 'Buckets', 'Counter', 'FeatureFreq'):
+                raise ValueError(f"Unsupported ctr type: {ctr['ctr_type']}")
+            # Хэш комбинации: сначала значения категорий, затем бинарные признаки
+            # (пороги числовых признаков, затем точные значения категорий), как в CatBoost
+            cat_features, bin_features = [], []
+            for element in ctr['elements']:
+                kind = element['combination_element']
+                if kind == 'cat_feature_value':
+                    cat_features.append(cat_positions[element['cat_feature_index']])
+                elif kind == 'float_feature':
+                    bin_features.append({'kind': SPLIT_FLOAT, 'feature': float_positions[element['float_feature_index']],
+                                         'border': element['border'], 'value': 0})
+                elif kind == 'cat_feature_exact_value':
+                    bin_features.append({'kind': SPLIT_ONE_HOT, 'feature': cat_positions[element['cat_feature_index']],
+                                         'border': 0.0, 'value': element['value']})
+                else:
+                    raise ValueError(f'Unsupported ctr element: {kind}')
+            bin_features.sort(key=lambda e: e['kind'])
+
+            table = data['ctr_data'][ctr['identifier']]
+            stride = table['hash_stride']
+            if ctr['ctr_type'] == 'Borders' and stride != 3:
+                raise ValueError('Only binary classification ctrs are supported')
+            hash_map = table['hash_map']
+            keys = np.array([int(key) for key in hash_map[::stride]], dtype=np.uint64)
+            counts = np.array([hash_map[j + 1:j + stride] for j in range(0, len(hash_map), stride)],
+                              dtype=np.float32).reshape(len(keys), stride - 1)
+            order = np.argsort(keys)
+            ctr_arrays[f'ctr_{i}_keys'] = keys[order]
+            ctr_arrays[f'ctr_{i}_counts'] = counts[order]
+            ctrs.append({
+                'type': ctr['ctr_type'],
+                'cat_features': cat_features,
+                'bin_features': bin_features,
+                'prior_num': ctr['prior_numerator'],
+                'prior_denom': ctr['prior_denomerator'],
+                'shift': ctr['shift'],
+                'scale': ctr['scale'],
+                'target_border_idx': ctr['target_border_idx'],
+                'counter_denominator': table.get('counter_denominator', 0),
+            })
+            for border in ctr['borders']:
+                kinds.append(SPLIT_CTR), features.append(i), borders.append(border), values.append(0)
+
+        trees = data['oblivious_trees']
+        for tree in trees:
+            tree['splits'] = tree.get('splits') or []  # у дерева без разбиений splits = null
+        depth = max((len(tree['splits']) for tree in trees), default=0)
+        tree_splits = np.full((len(trees), depth), -1, dtype=np.int32)
+        leaf_values = np.zeros((len(trees), 2 ** depth), dtype=np.float64)
+        for t, tree in enumerate(trees):
+            if len(tree['leaf_values']) != 2 ** len(tree['splits']):
+                raise ValueError('Only single-dimensional models are supported')
+            for d, split in enumerate(tree['splits']):
+                tree_splits[t, d] = split['split_index']
+            leaf_values[t, :len(tree['leaf_values'])] = tree['leaf_values']
+
+        scale, bias = data.get('scale_and_bias', [1, [0]])
+        meta = {
+            'feature_names': list(model.feature_names_),
+            'cat_features': sorted(cat_positions.values()),
+            'ctrs': ctrs,
+            'scale': scale,
+            'bias': bias[0] if isinstance(bias, list) else bias,
+            'fingerprint': fingerprint,
+        }
+        arrays = {
+            'split_kinds': np.array(kinds, dtype=np.int8),
+            'split_features': np.array(features, dtype=np.int32),
+            'split_borders': np.array(borders, dtype=np.float32),
+            'split_values': np.array(values, dtype=np.int64),
+            'tree_splits': tree_splits,
+            'leaf_values': leaf_values,
+            **ctr_arrays,
+        }
+        return cls(meta, arrays)
+
+    def save(self, path: str):
+        # Функция для сохранения упакованной модели одним файлом .npz (запись через временный файл)
+        arrays = {
+            'meta': np.frombuffer(json.dumps({
+                'feature_names': self.feature_names, 'cat_features': self.cat_features, 'ctrs': self.ctrs,
+                'scale': self.scale, 'bias': self.bias, 'fingerprint': self.fingerprint,
+                'parity_checked': self.parity_checked,
+            }).encode(), dtype=np.uint8),
+            'split_kinds': self.split_kinds,
+            'split_features': self.split_features,
+            'split_borders': self.split_borders,
+            'split_values': self.split_values,
+            'tree_splits': self.tree_splits,
+            'leaf_values': self.leaf_values,
+        }
+        for i, (keys, counts) in enumerate(self.ctr_tables):
+            arrays[f'ctr_{i}_keys'] = keys
+            arrays[f'ctr_{i}_counts'] = counts
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledModel':
+        # Функция для загрузки упакованной модели
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        meta = json.loads(arrays.pop('meta').tobytes().decode())
+        return cls(meta, arrays)
+
+    def get_inputs(self, features: pd.DataFrame) -> Dict[int, np.ndarray]:
+        # Функция для перевода таблицы признаков (колонки в порядке входов модели) во входы модели:
+        # числовые — float32, категориальные — хэши строкового представления, как у CatBoost
+        inputs = {}
+        for position, column in enumerate(features.columns):
+            if position in self.cat_features:
+                codes, uniques = pd.factorize(features[column].astype(str))
+                inputs[position] = hash_cat_values(uniques)[codes]
+            else:
+                inputs[position] = features[column].to_numpy(dtype=np.float32)
+        return inputs
+
+    def get_ctr_values(self, index: int, inputs: Dict[int, np.ndarray]) -> np.ndarray:
+        # Функция для расчета счетчика по комбинации категорий (как CTR в CatBoost, во float32)
+        ctr = self.ctrs[index]
+        ctr_hash = np.zeros(1, dtype=np.uint64)
+        for position in ctr['cat_features']:
+            ctr_hash = combine_hashes(ctr_hash, inputs[position].view(np.uint64))
+        for element in ctr['bin_features']:
+            bit = self.get_bits(element['kind'], element['feature'], element['border'], element['value'], inputs)
+            ctr_hash = combine_hashes(ctr_hash, bit.astype(np.uint64))
+
+        keys, counts = self.ctr_tables[index]
+        positions = np.minimum(np.searchsorted(keys, ctr_hash), max(len(keys) - 1, 0))
+        found = (keys[positions] == ctr_hash) if len(keys) else np.zeros(len(ctr_hash), dtype=bool)
+        counts = np.where(found[:, None], counts[positions], np.float32(0)) if len(keys) else \
+            np.zeros((len(ctr_hash), 1), dtype=np.float32)
+
+        if ctr['type'] == 'Borders':
+            good, total = counts[:, 1], counts[:, 0] + counts[:, 1]
+        elif ctr['type'] == 'Buckets':
+            good, total = counts[:, ctr['target_border_idx']], counts.sum(axis=1)
+        else:  # Counter, FeatureFreq
+            good = counts[:, 0]
+            total = np.where(found, np.float32(ctr['counter_denominator']), np.float32(0))
+        value = (good + np.float32(ctr['prior_num'])) / (total + np.float32(ctr['prior_denom']))
+        return (value + np.float32(ctr['shift'])) * np.float32(ctr['scale'])
+
+    def get_bits(self, kind: int, feature: int, border: float, value: int, inputs: Dict[int, np.ndarray]) -> np.ndarray:
+        # Функция для расчета одного бинарного признака
+        if kind == SPLIT_FLOAT:
+            return inputs[feature] > np.float32(border)
+        if kind == SPLIT_ONE_HOT:
+            return inputs[feature] == value
+        return self.get_ctr_values(feature, inputs) > np.float32(border)
+
+    def get_split_bits(self, splits: np.ndarray, inputs: Dict[int, np.ndarray]) -> List[np.ndarray]:
+        # Функция для расчета бинарных признаков splits. inputs — позиция входа модели -> массив
+        # (float32 для числовых, хэши int64 для категориальных); массив длины 1 — одно значение
+        # на все строки, такие признаки считаются один раз
+        bits, ctr_values = [], {}
+        for split in splits:
+            kind, feature = self.split_kinds[split], self.split_features[split]
+            if kind == SPLIT_CTR:
+                if feature not in ctr_values:  # у счетчика бывает несколько порогов
+                    ctr_values[feature] = self.get_ctr_values(feature, inputs)
+                bits.append(ctr_values[feature] > self.split_borders[split])
+            else:
+                bits.append(self.get_bits(kind, feature, self.split_borders[split], self.split_values[split], inputs))
+        return bits
+
+    def get_leaf_indexes(self, splits: np.ndarray, inputs: Dict[int, np.ndarray], n_rows: int,
+                         trees: Optional[np.ndarray] = None) -> np.ndarray:
+        # Функция для расчета вклада бинарных признаков splits в номера листьев деревьев trees
+        # (по умолчанию всех): матрица (деревья × строки)
+        tree_splits = self.tree_splits if trees is None else self.tree_splits[trees]
+        local = np.full(self.n_splits, -1, dtype=np.int64)
+        local[splits] = np.arange(len(splits))
+        tree_local = np.where(tree_splits >= 0, local[np.maximum(tree_splits, 0)], -1)
+
+        # Матрица битов + нулевая строка для уровней, которые не входят в splits
+        bit_matrix = np.zeros((len(splits) + 1, n_rows), dtype=np.uint8)
+        for i, bit in enumerate(self.get_split_bits(splits, inputs)):
+            bit_matrix[i] = bit
+
+        index_type = np.uint8 if self.depth <= 8 else np.uint16
+        indexes = np.zeros((len(tree_splits), n_rows), dtype=index_type)
+        for d in range(self.depth):
+            indexes |= bit_matrix[tree_local[:, d]].astype(index_type) << index_type(d)
+        return indexes
+
+    def get_leaf_sums(self, indexes: np.ndarray, trees: Optional[np.ndarray] = None) -> np.ndarray:
+        # Функция для суммирования значений листьев по деревьям (indexes — номера листьев деревьев trees)
+        leaf_values = self.leaf_values if trees is None else self.leaf_values[trees]
+        offsets = (np.arange(len(leaf_values)) * leaf_values.shape[1])[:, None]
+        return np.take(leaf_values, indexes + offsets).sum(axis=0)
+
+    def predict_proba(self, inputs: Dict[int, np.ndarray], n_rows: int) -> np.ndarray:
+        # Функция для получения вероятности класса 1 по всем деревьям
+        indexes = self.get_leaf_indexes(np.arange(self.n_splits), inputs, n_rows)
+        return self.get_probability(self.get_leaf_sums(indexes))
+
+    def get_probability(self, raw: np.ndarray) -> np.ndarray:
+        return 1 / (1 + np.exp(-(self.scale * raw + self.bias)))
+
+
+def get_model_fingerprint(model_path: str) -> str:
+    # Функция для получения отпечатка файла модели (упаковка пересобирается при его изменении)
+    digest = hashlib.md5()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_compiled_model_path(model_path: str) -> str:
+    return f'{model_path}.compiled.npz'
+
+
+def check_parity(model: CatBoostClassifier, compiled_model: CompiledModel, features: pd.DataFrame,
+                 tolerance: float = PARITY_TOLERANCE) -> float:
+    # Функция для сверки вероятностей упакованной модели с CatBoost на строках features
+    # (ValueError при расхождении больше tolerance). Возвращает наибольшее расхождение
+    expected = model.predict_proba(features)[:, 1]
+    actual = compiled_model.predict_proba(compiled_model.get_inputs(features), len(features))
+    max_diff = float(np.abs(actual - expected).max()) if len(features) else 0.0
+    if not max_diff <= tolerance:
+        raise ValueError(f'Compiled model differs from CatBoost: max diff {max_diff:.1e} on {len(features)} rows')
+    return max_diff
+
+
+def load_or_build_compiled_model(model_path: str,
+                                 get_parity_sample: Optional[Callable[[CatBoostClassifier], pd.DataFrame]] = None
+                                 ) -> CompiledModel:
+    # Функция для загрузки упакованной модели, собранной из файла model_path, без загрузки CatBoost.
+    # Модель CatBoost читается, только если упаковки нет, модель изменилась или упаковка еще не
+    # сверена с CatBoost: get_parity_sample(model) возвращает строки признаков для сверки
+    # (check_parity), и при расхождении упаковка не сохраняется и не используется
+    fingerprint = get_model_fingerprint(model_path)
+    path = get_compiled_model_path(model_path)
+    compiled_model = None
+    if os.path.exists(path):
+        compiled_model = CompiledModel.load(path)
+        if compiled_model.fingerprint != fingerprint:
+            compiled_model = None
+        elif compiled_model.parity_checked or get_parity_sample is None:
+            logger.info(f'compiled model: loaded from {path}')
+            return compiled_model
+
+    start = time.perf_counter()
+    model = CatBoostClassifier()
+    model.load_model(model_path)
+    if compiled_model is None:
+        compiled_model = CompiledModel.from_catboost(model, fingerprint)
+    if get_parity_sample is not None:
+        features = get_parity_sample(model)
+        max_diff = check_parity(model, compiled_model, features)
+        compiled_model.parity_checked = True
+        logger.info(f'compiled model: {path} matches CatBoost on {len(features)} rows (max diff {max_diff:.1e})')
+    compiled_model.save(path)
+    logger.info(f'compiled model: built {path} in {time.perf_counter() - start:.1f} s')
+    return compiled_model
+
+
+def main(model_paths: List[str]):
+    # Шаг упаковки: python -m compiled_model ./catboost_model_PCA ./catboost_model_W2V
+    # (без данных сервиса: упаковка сверяется с CatBoost при первом старте сервиса)
+    logging.basicConfig(level=logging.INFO)
+    for model_path in model_paths:
+        load_or_build_compiled_model(model_path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,259 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+from model_reload import ModelReloader
+from scoring import COLUMN_SCHEMAS, ScoringEngine
+
+logger = logging.getLogger(__name__)
+
+# JSON-файл с настройкой эксперимента (пустое значение — две группы control/test 50/50)
+EXPERIMENTS_CONFIG = os.getenv('EXPERIMENTS_CONFIG', '')
+# Загружать плечи с ненулевым весом при старте (0 — при первом запросе пользователя плеча)
+EXPERIMENTS_PRELOAD = os.getenv('EXPERIMENTS_PRELOAD', '1') == '1'
+# JSON-файл с весами плеч, измененными без перезапуска (общий для всех воркеров;
+# пустое значение — вес меняется только в воркере, принявшем запрос)
+EXPERIMENTS_WEIGHTS = os.getenv('EXPERIMENTS_WEIGHTS', '')
+# Как часто (в секундах) воркер проверяет, не изменился ли файл весов
+EXPERIMENTS_WEIGHTS_CHECK_INTERVAL = float(os.getenv('EXPERIMENTS_WEIGHTS_CHECK_INTERVAL', 5))
+
+
+# Плечо эксперимента: своя модель, таблица признаков постов и схема колонок модели
+class ArmConfig(BaseModel):
+    name: str
+    model_path: str
+    features_table: str
+    columns: Union[str, List[str]]  # имя схемы из scoring.COLUMN_SCHEMAS или список колонок
+    weight: float = 0.0  # доля пользователей (относительно суммы весов всех плеч)
+
+    def get_columns(self) -> List[str]:
+        return COLUMN_SCHEMAS[self.columns] if isinstance(self.columns, str) else self.columns
+
+
+class ExperimentConfig(BaseModel):
+    salt: str = 'salt_value'
+    arms: List[ArmConfig]
+
+
+# Эксперимент по умолчанию: PCA-модель против W2V-модели, 50/50
+DEFAULT_EXPERIMENT = ExperimentConfig(arms=[
+    ArmConfig(name='control', model_path='./catboost_model_PCA',
+              features_table='i_koskin_posts_features_lesson_22', columns='pca', weight=50),
+    ArmConfig(name='test', model_path='./catboost_model_W2V',
+              features_table='i_koskin_posts_features_lesson_25', columns='w2v', weight=50),
+])
+
+
+def get_config_fingerprint(config: ExperimentConfig) -> str:
+    # Функция для получения отпечатка настройки эксперимента по соли, именам и моделям плеч
+    # (веса в отпечаток не входят: их и меняет файл весов)
+    arms = [[arm.name, arm.model_path, arm.features_table] for arm in config.arms]
+    return hashlib.sha256(json.dumps([config.salt, arms]).encode()).hexdigest()[:16]
+
+
+def load_experiment_config(path: str = EXPERIMENTS_CONFIG) -> ExperimentConfig:
+    # Функция для чтения настройки эксперимента из JSON-файла
+    if not path:
+        return DEFAULT_EXPERIMENT
+    with open(path) as f:
+        return ExperimentConfig(**json.load(f))
+
+
+class ExperimentRegistry:
+    # Плечи эксперимента с весами. Пользователь попадает в плечо по MD5 от user_id с солью:
+    # номер корзины 0..99 сравнивается с накопленными долями весов (для 50/50 — корзины
+    # 0..49 и 50..99). Плечо загружается при первом обращении (load_engine собирает движок
+    # скоринга; одновременные запросы ждут одну загрузку) и выгружается, когда его вес
+    # становится нулевым, поэтому новое плечо не стоит памяти и времени старта, пока не включено.
+    # Веса, измененные без перезапуска, пишутся в файл weights_path, а каждый воркер раз в
+    # weights_check_interval секунд проверяет его mtime и применяет новые веса у себя.
+    # Файл привязан к отпечатку настройки: веса, записанные для другого набора плеч или моделей,
+    # не применяются. Запись — под файловой блокировкой, чтобы воркеры, одновременно
+    # меняющие веса разных плеч, не затирали изменения друг друга.
+    # Перезагрузка загруженных плеч — через reloader (model_reload.ModelReloader).
+
+    def __init__(self, config: ExperimentConfig, load_engine: Callable[[ArmConfig, bool], ScoringEngine],
+                 warm_up: Callable[[ScoringEngine], None],
+                 on_load: Optional[Callable[[str, ScoringEngine], None]] = None,
+                 on_swap: Optional[Callable[[str, ScoringEngine, ScoringEngine], None]] = None,
+                 on_unload: Optional[Callable[[str, ScoringEngine], None]] = None,
+                 weights_path: str = EXPERIMENTS_WEIGHTS,
+                 weights_check_interval: float = EXPERIMENTS_WEIGHTS_CHECK_INTERVAL):
+        names = [arm.name for arm in config.arms]
+        if len(set(names)) != len(names):
+            raise ValueError('Arm names must be unique')
+        self.salt = config.salt
+        self.arms: Dict[str, ArmConfig] = {arm.name: arm for arm in config.arms}
+        self.load_engine = load_engine
+        self.on_load = on_load
+        self.on_unload = on_unload
+        self.engines: Dict[str, ScoringEngine] = {}  # загруженные плечи
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.arms}
+        self._boundaries = self._get_boundaries({name: arm.weight for name, arm in self.arms.items()})
+        self.reloader = ModelReloader(
+            self.engines, lambda name, reload_features: load_engine(self.arms[name], reload_features),
+            warm_up, on_swap, watch_paths={name: arm.model_path for name, arm in self.arms.items()},
+            swap_lock=self._lock)
+
+        self.config_fingerprint = get_config_fingerprint(config)
+        self.weights_path = weights_path
+        self.weights_check_interval = weights_check_interval
+        self._weights_lock = threading.Lock()
+        self._weights_mtime = None
+        self._weights_checked_at = 0.0
+        if self.weights_path:
+            self._check_weights()
+
+    @staticmethod
+    def _get_boundaries(weights: Dict[str, float]) -> List[tuple]:
+        # Функция для получения верхних границ корзин плеч с ненулевым весом
+        if any(weight < 0 for weight in weights.values()):
+            raise ValueError('Arm weights must be non-negative')
+        total = sum(weights.values())
+        if total <= 0:
+            raise ValueError('At least one arm must have a positive weight')
+        boundaries, cumulative = [], 0.0
+        for name, weight in weights.items():
+            cumulative += weight
+            if weight > 0:
+                boundaries.append((cumulative / total * 100, name))
+        return boundaries
+
+    def get_arm_name(self, user_id: int) -> str:
+        # Функция для определения плеча пользователя
+        self._refresh_weights()
+        bucket = int(hashlib.md5(f"{user_id}{self.salt}".encode()).hexdigest(), 16) % 100
+        boundaries = self._boundaries
+        for boundary, name in boundaries:
+            if bucket < boundary:
+                return name
+        return boundaries[-1][1]
+
+    def get_engine(self, name: str) -> ScoringEngine:
+        # Функция для получения движка скоринга плеча (с загрузкой при первом обращении)
+        scoring_engine = self.engines.get(name)
+        if scoring_engine is not None:
+            return scoring_engine
+        if name not in self.arms:
+            raise ValueError('Unknown group')
+
+        with self._load_locks[name]:
+            scoring_engine = self.engines.get(name)
+            if scoring_engine is not None:
+                return scoring_engine
+            logger.info(f'experiment arm {name}: loading')
+            scoring_engine = self.load_engine(self.arms[name], False)
+            with self._lock:
+                # Плечо, вес которого обнулили во время загрузки, не сохраняется
+                keep = self.arms[name].weight > 0
+                if keep:
+                    self.engines[name] = scoring_engine
+            if keep:
+                self.reloader.track(name)
+                if self.on_load is not None:
+                    self.on_load(name, scoring_engine)
+            return scoring_engine
+
+    def _apply_weights(self, new_weights: Dict[str, float]):
+        # Функция для применения весов плеч в текущем воркере (вес 0 выгружает плечо)
+        with self._lock:
+            weights = {arm_name: arm.weight for arm_name, arm in self.arms.items()}
+            weights.update(new_weights)
+            self._boundaries = self._get_boundaries(weights)
+            unloaded = {}
+            for name, weight in new_weights.items():
+                self.arms[name].weight = weight
+                if weight == 0 and name in self.engines:
+                    unloaded[name] = self.engines.pop(name)
+        for name, scoring_engine in unloaded.items():
+            logger.info(f'experiment arm {name}: unloaded')
+            if self.on_unload is not None:
+                self.on_unload(name, scoring_engine)
+
+    def _check_weights(self):
+        # Функция для применения весов из файла, если он изменился с прошлой проверки
+        # (плечи, которых нет в настройке эксперимента, пропускаются)
+        self._weights_checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.weights_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._weights_mtime:
+            return
+        self._weights_mtime = mtime
+        try:
+            with open(self.weights_path) as f:
+                data = json.load(f)
+            if data.get('config') != self.config_fingerprint:
+                logger.warning(f'experiment weights {self.weights_path}: written for another config, ignored')
+                return
+            weights = {name: float(weight) for name, weight in data['weights'].items() if name in self.arms}
+            self._apply_weights(weights)
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f'experiment weights {self.weights_path}: ignored ({e})')
+            return
+        logger.info(f'experiment weights {self.weights_path}: applied {weights}')
+
+    def _refresh_weights(self):
+        # Функция для проверки файла весов, если с прошлой проверки прошло weights_check_interval
+        if self.weights_path and time.monotonic() - self._weights_checked_at >= self.weights_check_interval:
+            with self._weights_lock:
+                if time.monotonic() - self._weights_checked_at >= self.weights_check_interval:
+                    self._check_weights()
+
+    @contextmanager
+    def _weights_file_lock(self):
+        # Межпроцессная блокировка файла весов: чтение, изменение и запись — одна операция
+        if not self.weights_path:
+            yield
+            return
+        with open(f'{self.weights_path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def set_weight(self, name: str, weight: float):
+        # Функция для изменения веса плеча во всех воркерах: вес применяется в текущем воркере
+        # и записывается в файл весов (через временный файл с атомарной подменой),
+        # остальные воркеры подхватывают его при следующей проверке
+        if name not in self.arms:
+            raise KeyError(name)
+        with self._weights_lock, self._weights_file_lock():
+            if self.weights_path:
+                # Веса, измененные другими воркерами, перечитываются под блокировкой и не затираются
+                self._weights_mtime = None
+                self._check_weights()
+            self._apply_weights({name: weight})
+            if self.weights_path:
+                weights = {arm_name: arm.weight for arm_name, arm in self.arms.items()}
+                tmp_path = f'{self.weights_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({'config': self.config_fingerprint, 'weights': weights}, f)
+                os.replace(tmp_path, self.weights_path)
+                self._weights_mtime = os.stat(self.weights_path).st_mtime_ns
+
+    def preload(self):
+        # Функция для загрузки всех плеч с ненулевым весом
+        for name, arm in self.arms.items():
+            if arm.weight > 0:
+                self.get_engine(name)
+
+    def stats(self) -> Dict:
+        # Функция для получения состояния плеч: вес, загружено ли плечо, версия модели
+        self._refresh_weights()
+        reload_stats = self.reloader.stats()
+        return {name: {'weight': arm.weight, 'loaded': name in self.engines,
+                       'model_path': arm.model_path, 'features_table': arm.features_table,
+                       **(reload_stats.get(name, {}) if name in self.engines else {})}
+                for name, arm in self.arms.items()}
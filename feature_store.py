@@ -0,0 +1,230 @@
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from sql_loader import is_high_cardinality
+
+try:
+    import pyarrow as pa
+except ImportError:  # без pyarrow тексты при подключении декодируются в строки Python
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Каталог общего хранилища признаков (пустое значение отключает режим хранилища)
+FEATURE_STORE_DIR = os.getenv('FEATURE_STORE_DIR', '')
+# Максимальный возраст таблицы в хранилище в секундах, после которого первый запущенный
+# воркер строит ее заново
+FEATURE_STORE_MAX_AGE = float(os.getenv('FEATURE_STORE_MAX_AGE', 24 * 60 * 60))
+# Версия формата хранилища: при изменении все записанные таблицы строятся заново
+FEATURE_STORE_VERSION = 2
+
+
+class FeatureStore:
+    # Хранилище таблиц в виде .npy файлов, которые воркеры открывают через mmap.
+    # Таблицу строит один процесс (под файловой блокировкой), остальные только
+    # подключают read-only представления: страницы данных лежат в page cache
+    # в одном экземпляре на всю машину. Таблица строится заново, если она записана
+    # по другому запросу или из другой БД (не совпал отпечаток) или старше max_age.
+    #
+    # Формат таблицы <name>:
+    #   <name>.<dtype>.npy  — числовые колонки одного типа одной матрицей (Fortran-order,
+    #                         чтобы каждая колонка была непрерывной)
+    #   <name>.<column>.codes.npy — коды строковых колонок с небольшим числом значений
+    #   <name>.<column>.offsets.npy, <name>.<column>.bytes.npy — почти неповторяющиеся
+    #                         строки (тексты постов): границы строк (int64) и их UTF-8 байты
+    #   <name>.json         — схема: порядок колонок, типы, категории строковых колонок,
+    #                         отпечаток и время записи
+
+    def __init__(self, path: str, source: str = '', max_age: float = FEATURE_STORE_MAX_AGE):
+        self.path = path
+        self.source = source  # откуда строятся таблицы (адрес БД), входит в отпечаток
+        self.max_age = max_age
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def lock(self):
+        # Межпроцессная блокировка: пока один воркер строит хранилище, остальные ждут
+        with open(self._file('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_fingerprint(self, query: str) -> str:
+        # Функция для получения отпечатка таблицы по запросу, источнику и версии формата
+        normalized_query = ' '.join(query.split())
+        return hashlib.sha256(f'{FEATURE_STORE_VERSION}:{self.source}:{normalized_query}'.encode()).hexdigest()[:16]
+
+    def has(self, name: str, query: str = '') -> bool:
+        # Функция для проверки, что объект записан в хранилище по тому же запросу и не устарел
+        if not os.path.exists(self._file(f'{name}.json')):
+            return False
+        schema = self._load_schema(name)
+        if schema.get('fingerprint') != self.get_fingerprint(query):
+            logger.info(f'feature store {name}: fingerprint mismatch')
+            return False
+        if time.time() - schema.get('created_at', 0) > self.max_age:
+            logger.info(f'feature store {name}: stale')
+            return False
+        return True
+
+    def remove(self, name: str) -> None:
+        # Функция для удаления файлов объекта (процессы, которые держат их в mmap,
+        # дочитывают старые данные до перезапуска)
+        for path in glob.glob(self._file(f'{name}.*')):
+            os.remove(path)
+
+    def save_array(self, name: str, array: np.ndarray) -> None:
+        # Функция для записи массива через временный файл с атомарной подменой
+        tmp_path = self._file(f'{name}.{os.getpid()}.tmp.npy')
+        np.save(tmp_path, array)
+        os.replace(tmp_path, self._file(f'{name}.npy'))
+
+    def load_array(self, name: str) -> np.ndarray:
+        # Функция для подключения массива без копирования (read-only mmap)
+        return np.load(self._file(f'{name}.npy'), mmap_mode='r')
+
+    def _save_schema(self, name: str, schema: Dict, query: str) -> None:
+        schema = {**schema, 'fingerprint': self.get_fingerprint(query), 'created_at': time.time()}
+        tmp_path = self._file(f'{name}.{os.getpid()}.tmp.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(schema, f, ensure_ascii=False)
+        os.replace(tmp_path, self._file(f'{name}.json'))
+
+    def _load_schema(self, name: str) -> Dict:
+        with open(self._file(f'{name}.json')) as f:
+            return json.load(f)
+
+    def save_frame(self, name: str, df: pd.DataFrame, query: str = '') -> None:
+        # Функция для записи DataFrame в хранилище (схема пишется последней,
+        # поэтому наличие <name>.json означает, что таблица записана целиком)
+        schema = {'columns': list(df.columns), 'numeric': {}, 'categorical': {}, 'text': []}
+
+        # Вещественные колонки храним во float32: CatBoost все равно приводит признаки к float32
+        df = df.astype({c: np.float32 for c in df.columns if pd.api.types.is_float_dtype(df[c])})
+        numeric_columns = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])
+                           and not pd.api.types.is_bool_dtype(df[c])]
+        for dtype in sorted({str(df[c].dtype) for c in numeric_columns}):
+            columns = [c for c in numeric_columns if str(df[c].dtype) == dtype]
+            self.save_array(f'{name}.{dtype}', np.asfortranarray(df[columns].to_numpy(dtype=dtype)))
+            schema['numeric'][dtype] = columns
+
+        for column in df.columns:
+            if column in numeric_columns:
+                continue
+            codes, categories = pd.factorize(df[column].astype(str))
+            if is_high_cardinality(len(categories), len(df)):
+                # Почти неповторяющиеся строки: словарь категорий был бы копией всей колонки в схеме
+                self._save_text(f'{name}.{column}', df[column].astype(str))
+                schema['text'].append(column)
+                continue
+            codes_dtype = np.int16 if len(categories) < 2 ** 15 else np.int32
+            self.save_array(f'{name}.{column}.codes', codes.astype(codes_dtype))
+            schema['categorical'][column] = [str(c) for c in categories]
+
+        self._save_schema(name, schema, query)
+
+    def _save_text(self, name: str, values: pd.Series) -> None:
+        # Функция для записи строк одним буфером UTF-8 байт и границами строк в нем
+        encoded = [value.encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        self.save_array(f'{name}.offsets', offsets)
+        self.save_array(f'{name}.bytes', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    def _load_text(self, name: str) -> pd.Series:
+        # Функция для подключения строк: с pyarrow — строковая колонка Arrow поверх mmap
+        # без копирования, без него — строки Python
+        offsets = self.load_array(f'{name}.offsets')
+        data = self.load_array(f'{name}.bytes')
+        if pa is not None:
+            array = pa.LargeStringArray.from_buffers(len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data))
+            return pd.Series(pd.arrays.ArrowExtensionArray(array), copy=False)
+        data = data.tobytes()
+        return pd.Series([data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+    def load_frame(self, name: str) -> pd.DataFrame:
+        # Функция для подключения DataFrame: числовые колонки — представления mmap-матриц,
+        # строковые — pd.Categorical поверх mmap-кодов, тексты — строки поверх mmap-буфера
+        schema = self._load_schema(name)
+        parts = []
+        for dtype, dtype_columns in schema['numeric'].items():
+            matrix = self.load_array(f'{name}.{dtype}')
+            parts.append(pd.DataFrame(matrix, columns=dtype_columns, copy=False))
+        for column, categories in schema['categorical'].items():
+            codes = self.load_array(f'{name}.{column}.codes')
+            parts.append(pd.Series(pd.Categorical.from_codes(codes, categories=categories), name=column))
+        for column in schema.get('text', []):
+            parts.append(self._load_text(f'{name}.{column}').rename(column))
+        # concat по колонкам не склеивает блоки, поэтому данные остаются в mmap
+        return pd.concat(parts, axis=1)[schema['columns']]
+
+    def save_arrays(self, name: str, arrays: Dict[str, np.ndarray], query: str = '') -> None:
+        # Функция для записи набора массивов (схема пишется последней)
+        for key, array in arrays.items():
+            self.save_array(f'{name}.{key}', array)
+        self._save_schema(name, {'arrays': list(arrays)}, query)
+
+    def load_arrays(self, name: str) -> Dict[str, np.ndarray]:
+        # Функция для подключения набора массивов без копирования
+        schema = self._load_schema(name)
+        return {key: self.load_array(f'{name}.{key}') for key in schema['arrays']}
+
+    def get_or_build_arrays(self, name: str, builder: Callable[[], Dict[str, np.ndarray]],
+                            query: str = '') -> Dict[str, np.ndarray]:
+        # Функция для получения набора массивов из хранилища (с построением, если их нет
+        # или они записаны по другому запросу или устарели)
+        with self.lock():
+            if not self.has(name, query):
+                logger.info(f'feature store {name}: building')
+                self.remove(name)
+                self.save_arrays(name, builder(), query)
+            arrays = self.load_arrays(name)
+        logger.info(f'feature store {name}: attached')
+        return arrays
+
+    def get_or_build_frame(self, name: str, loader: Callable[[], pd.DataFrame], query: str = '') -> pd.DataFrame:
+        # Функция для получения таблицы из хранилища; если ее нет (или она записана по другому
+        # запросу или устарела) — первый процесс загружает ее через loader и записывает,
+        # остальные ждут и подключают готовую. Подключение тоже под блокировкой, чтобы
+        # не смешать файлы старой и перестраиваемой таблицы
+        with self.lock():
+            if not self.has(name, query):
+                logger.info(f'feature store {name}: building')
+                self.remove(name)
+                self.save_frame(name, loader(), query)
+            df = self.load_frame(name)
+        logger.info(f'feature store {name}: attached')
+        return df
+
+
+def get_process_memory() -> Dict:
+    # Функция для получения памяти текущего процесса (в МиБ).
+    # shared — страницы, общие с другими процессами (в т.ч. mmap файлов хранилища)
+    memory = {'pid': os.getpid()}
+    try:
+        with open('/proc/self/statm') as f:
+            _, resident, shared = (int(v) for v in f.read().split()[:3])
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        memory['rss_mb'] = round(resident * page_size / 2 ** 20, 1)
+        memory['shared_mb'] = round(shared * page_size / 2 ** 20, 1)
+        memory['private_mb'] = round((resident - shared) * page_size / 2 ** 20, 1)
+    except OSError:
+        # Вне Linux доступен только пиковый RSS
+        memory['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10, 1)
+    return memory
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+
+# Примерные накладные расходы на одну запись кэша (ключ, словарь, массив numpy)
+ENTRY_OVERHEAD_BYTES = 400
+
+
+class FeedCache:
+    # LRU кэш ранжированных лент. Ключ — (user_id, exp_group, time_of_day, day_of_week):
+    # только от этого зависят входы модели, поэтому лента меняется лишь на границе
+    # временного интервала. Хранятся post_id лучших depth постов, любой limit <= depth
+    # отдается срезом. Записи вытесняются по объему памяти и истекают на границе интервала.
+
+    def __init__(self, max_bytes: int, depth: int):
+        self.max_bytes = max_bytes
+        self.depth = depth
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0  # растет при каждом сбросе кэша
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.depth > 0
+
+    def get(self, key: Hashable, now: datetime) -> Optional[np.ndarray]:
+        # Функция для получения ленты из кэша (None, если ее нет или она истекла)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, post_ids: np.ndarray, expires_at: datetime,
+            generation: Optional[int] = None) -> None:
+        # Функция для сохранения ленты в кэш с вытеснением самых старых записей.
+        # generation — поколение кэша на момент начала расчета ленты: если с тех пор кэш
+        # сбрасывался, лента посчитана по устаревшим данным и не сохраняется
+        post_ids = np.asarray(post_ids, dtype=np.int32)
+        size = post_ids.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (post_ids, expires_at, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self) -> None:
+        # Функция для сброса кэша (например, после обновления данных о лайках или замены модели)
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        # Функция для получения счетчиков кэша
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'depth': self.depth,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
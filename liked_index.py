@@ -0,0 +1,170 @@
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+# Слияние новых лайков переписывает только строки затронутых пользователей (они лежат
+# поверх основного CSR); когда в таких строках набирается больше этой доли всех лайков,
+# строки вливаются в основной CSR
+LIKES_COMPACT_SHARE = float(os.getenv('LIKES_COMPACT_SHARE', 0.05))
+
+
+def get_last_liked_at(liked_posts: pd.DataFrame) -> np.datetime64:
+    # Функция для получения времени самого свежего лайка (NaT, если времени нет)
+    if 'timestamp' not in liked_posts.columns or not len(liked_posts):
+        return np.datetime64('NaT', 'us')
+    return np.datetime64(pd.to_datetime(liked_posts['timestamp']).max(), 'us')
+
+
+class LikedPostsIndex:
+    # Индекс лайкнутых постов по пользователям в формате CSR:
+    # post_ids[offsets[row]:offsets[row + 1]] — отсортированные посты пользователя,
+    # строка пользователя ищется в плотном массиве rows по user_id за O(1).
+    # Если у лайков есть колонка timestamp, индекс помнит время самого свежего из них
+    # (high_water_mark) — с него начинается догрузка новых лайков.
+    # Догруженные лайки не перестраивают CSR: строки затронутых пользователей целиком
+    # (старые и новые посты) лежат в словаре updated_rows поверх него, а при накоплении
+    # LIKES_COMPACT_SHARE всех лайков вливаются в CSR за один линейный проход
+
+    def __init__(self, liked_posts: pd.DataFrame):
+        user_ids = liked_posts['user_id'].to_numpy(dtype=np.int64)
+        post_ids = liked_posts['post_id'].to_numpy(dtype=np.int64)
+
+        # Сортируем лайки по пользователю, внутри пользователя — по посту
+        order = np.lexsort((post_ids, user_ids))
+        user_ids = user_ids[order]
+        post_ids = post_ids[order]
+
+        unique_users, starts = np.unique(user_ids, return_index=True)
+        self.offsets = np.append(starts, len(user_ids)).astype(np.int64)
+        self.post_ids = post_ids.astype(np.int32)
+
+        # Плотный массив user_id -> номер строки (-1 для пользователей без лайков)
+        max_user_id = int(unique_users.max()) if len(unique_users) else -1
+        self.rows = np.full(max_user_id + 1, -1, dtype=np.int32)
+        self.rows[unique_users] = np.arange(len(unique_users), dtype=np.int32)
+
+        self.updated_rows: Dict[int, np.ndarray] = {}
+        self.n_likes = len(self.post_ids)
+        self.high_water_mark = get_last_liked_at(liked_posts)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'LikedPostsIndex':
+        # Функция для создания индекса из готовых массивов (например, из общего хранилища)
+        index = cls.__new__(cls)
+        index.offsets = arrays['offsets']
+        index.post_ids = arrays['post_ids']
+        index.rows = arrays['rows']
+        index.updated_rows = {}
+        index.n_likes = len(index.post_ids)
+        index.high_water_mark = arrays['high_water_mark'][0] if 'high_water_mark' in arrays \
+            else np.datetime64('NaT', 'us')
+        return index
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        # Функция для получения массивов индекса (для записи в общее хранилище)
+        index = self.compact()
+        return {'offsets': index.offsets, 'post_ids': index.post_ids, 'rows': index.rows,
+                'high_water_mark': np.array([index.high_water_mark], dtype='datetime64[us]')}
+
+    def merge(self, liked_posts: pd.DataFrame) -> 'LikedPostsIndex':
+        # Функция для получения нового индекса с добавленными лайками (повторы отбрасываются).
+        # Переписываются только строки пользователей из liked_posts, массивы CSR общие с
+        # текущим индексом. Текущий индекс не меняется: запросы, которые его уже взяли,
+        # дорабатывают на нем
+        index = LikedPostsIndex.__new__(LikedPostsIndex)
+        index.offsets, index.post_ids, index.rows = self.offsets, self.post_ids, self.rows
+        index.updated_rows = dict(self.updated_rows)
+        index.n_likes = self.n_likes
+        new_likes = liked_posts[['user_id', 'post_id']].to_numpy(dtype=np.int64)
+        new_likes = new_likes[np.lexsort((new_likes[:, 1], new_likes[:, 0]))]
+        users, starts = np.unique(new_likes[:, 0], return_index=True)
+        for user_id, user_posts in zip(users.tolist(), np.split(new_likes[:, 1], starts[1:])):
+            liked = self.get(user_id)
+            row = np.union1d(liked, user_posts).astype(np.int32)
+            if len(row) != len(liked):
+                index.updated_rows[user_id] = row
+                index.n_likes += len(row) - len(liked)
+        index.high_water_mark = np.fmax(self.high_water_mark, get_last_liked_at(liked_posts))
+        if sum(map(len, index.updated_rows.values())) > LIKES_COMPACT_SHARE * len(index.post_ids):
+            index = index.compact()
+        return index
+
+    def compact(self) -> 'LikedPostsIndex':
+        # Функция для получения индекса, в котором переписанные строки влиты в CSR. Строки уже
+        # отсортированы, поэтому новые массивы собираются копированием отрезков без сортировки
+        if not self.updated_rows:
+            return self
+        updated_users = np.fromiter(self.updated_rows, dtype=np.int64, count=len(self.updated_rows))
+        updated_users.sort()
+        base_users = np.flatnonzero(self.rows >= 0)
+        user_ids = np.union1d(base_users, updated_users)
+        lengths = np.zeros(len(user_ids), dtype=np.int64)
+        lengths[np.searchsorted(user_ids, base_users)] = np.diff(self.offsets)
+        updated = [self.updated_rows[user_id] for user_id in updated_users.tolist()]
+        lengths[np.searchsorted(user_ids, updated_users)] = [len(row) for row in updated]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+        # Лайки основного CSR, кроме переписанных строк, переносятся со сдвигом своей строки
+        post_ids = np.empty(offsets[-1], dtype=np.int32)
+        base_rows = np.repeat(np.arange(len(base_users)), np.diff(self.offsets))
+        kept = ~np.isin(base_users, updated_users)[base_rows]
+        shift = offsets[:-1][np.searchsorted(user_ids, base_users)] - self.offsets[:-1]
+        post_ids[(np.arange(len(self.post_ids)) + shift[base_rows])[kept]] = self.post_ids[kept]
+        for user_id, row in zip(updated_users.tolist(), updated):
+            start = offsets[np.searchsorted(user_ids, user_id)]
+            post_ids[start:start + len(row)] = row
+
+        index = LikedPostsIndex.__new__(LikedPostsIndex)
+        index.offsets, index.post_ids = offsets, post_ids
+        index.rows = np.full(int(user_ids.max()) + 1, -1, dtype=np.int32)
+        index.rows[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+        index.updated_rows = {}
+        index.n_likes = len(post_ids)
+        index.high_water_mark = self.high_water_mark
+        return index
+
+    def get(self, user_id: int) -> np.ndarray:
+        # Функция для получения лайкнутых пользователем постов (без копирования)
+        row = self.updated_rows.get(user_id)
+        return row if row is not None else self.get_base(user_id)
+
+    def unseen_mask(self, user_id: int, post_positions: np.ndarray, n_candidates: int) -> np.ndarray:
+        # Функция для получения маски непросмотренных постов среди кандидатов.
+        # post_positions — плотный массив post_id -> позиция поста среди кандидатов (-1, если его нет)
+        mask = np.ones(n_candidates, dtype=bool)
+        liked = self.get(user_id)
+        liked = liked[liked < len(post_positions)]
+        positions = post_positions[liked]
+        mask[positions[positions >= 0]] = False
+        return mask
+
+    def like_counts(self, post_positions: np.ndarray, n_candidates: int) -> np.ndarray:
+        # Функция для подсчета лайков каждого кандидата (популярность поста).
+        # post_positions — плотный массив post_id -> позиция поста среди кандидатов (-1, если его нет)
+        def count(liked: np.ndarray) -> np.ndarray:
+            liked = liked[liked < len(post_positions)]
+            positions = post_positions[liked]
+            return np.bincount(positions[positions >= 0], minlength=n_candidates)
+
+        counts = count(self.post_ids)
+        if self.updated_rows:
+            # Переписанные строки заменяют строки основного CSR
+            replaced = [self.get_base(user_id) for user_id in self.updated_rows]
+            counts += count(np.concatenate(list(self.updated_rows.values())))
+            counts -= count(np.concatenate(replaced))
+        return counts
+
+    def get_base(self, user_id: int) -> np.ndarray:
+        # Функция для получения строки пользователя в основном CSR (без переписанных строк)
+        if user_id < 0 or user_id >= len(self.rows) or self.rows[user_id] < 0:
+            return self.post_ids[:0]
+        row = self.rows[user_id]
+        return self.post_ids[self.offsets[row]:self.offsets[row + 1]]
+
+    @property
+    def nbytes(self) -> int:
+        # Объем памяти, занимаемый индексом
+        return self.offsets.nbytes + self.post_ids.nbytes + self.rows.nbytes \
+            + sum(row.nbytes for row in self.updated_rows.values())
@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from liked_index import LikedPostsIndex
+
+logger = logging.getLogger(__name__)
+
+# Период в секундах, с которым догружаются новые лайки (0 — индекс лайков не обновляется)
+LIKES_REFRESH_INTERVAL = float(os.getenv('LIKES_REFRESH_INTERVAL', 0))
+# База и таблица событий, из которой догружаются лайки (пустой адрес — основная база сервиса;
+# для проверки на локальной копии: sqlite:///feed.db и feed_data)
+LIKES_DATABASE_URL = os.getenv('LIKES_DATABASE_URL', '')
+LIKES_TABLE = os.getenv('LIKES_TABLE', 'public.feed_data')
+
+
+class LikesRefresher:
+    # Фоновая догрузка лайков. Индекс помнит время самого свежего лайка (high_water_mark),
+    # каждые interval секунд из таблицы событий читаются только лайки не раньше этого времени
+    # (сравнение нестрогое: события с той же секундой, записанные позже, не теряются, а повторы
+    # отбрасываются при слиянии). Новые лайки сливаются в новый индекс, который передается в
+    # set_index; запросы, уже взявшие старый индекс, дорабатывают на нем.
+
+    def __init__(self, engine, get_index: Callable[[], LikedPostsIndex], set_index: Callable[[LikedPostsIndex], None],
+                 interval: float = LIKES_REFRESH_INTERVAL, table: str = LIKES_TABLE):
+        self.engine = engine
+        self.get_index = get_index
+        self.set_index = set_index
+        self.interval = interval
+        self.query = text(f"""
+            SELECT DISTINCT post_id, user_id, timestamp
+            FROM {table}
+            WHERE action = 'like' AND timestamp >= :since
+        """)
+        self.refreshes = 0
+        self.new_likes = 0
+        self.errors = 0
+        self.last_refresh_at = None
+        self.last_duration_s = None
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='likes-refresher', daemon=True)
+            self._thread.start()
+
+    def load_new_likes(self, since: np.datetime64) -> pd.DataFrame:
+        # Функция для загрузки лайков не раньше since (без high-water mark — всех лайков)
+        since = datetime(1970, 1, 1) if np.isnat(since) else pd.Timestamp(since).to_pydatetime()
+        # Время передается строкой ISO без лишних долей секунды: так оно сравнивается
+        # и с timestamp в PostgreSQL, и с текстовым временем в SQLite
+        with self.engine.connect() as conn:
+            return pd.read_sql(self.query, conn, params={'since': since.isoformat(sep=' ')},
+                               parse_dates=['timestamp'])
+
+    def refresh(self) -> int:
+        # Функция для одного шага догрузки: возвращает число прочитанных событий лайка
+        start = time.perf_counter()
+        index = self.get_index()
+        new_likes = self.load_new_likes(index.high_water_mark)
+        if len(new_likes):
+            merged = index.merge(new_likes)
+            if merged.n_likes != index.n_likes or merged.high_water_mark != index.high_water_mark:
+                self.set_index(merged)
+
+        self.refreshes += 1
+        self.new_likes += len(new_likes)
+        self.last_refresh_at = datetime.now().isoformat(timespec='seconds')
+        self.last_duration_s = round(time.perf_counter() - start, 3)
+        return len(new_likes)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                n_likes = self.refresh()
+                logger.info(f'likes refresh: {n_likes} like events in {self.last_duration_s} s')
+            except Exception:
+                # Индекс остается прежним, попытка повторится через interval
+                self.errors += 1
+                logger.exception('likes refresh: failed')
+
+    def stats(self) -> Dict:
+        # Функция для получения счетчиков догрузки лайков
+        index = self.get_index()
+        return {
+            'interval_s': self.interval,
+            'high_water_mark': None if np.isnat(index.high_water_mark) else str(index.high_water_mark),
+            'likes': index.n_likes,
+            'refreshes': self.refreshes,
+            'new_likes': self.new_likes,
+            'errors': self.errors,
+            'last_refresh_at': self.last_refresh_at,
+            'last_duration_s': self.last_duration_s,
+        }
@@ -0,0 +1,197 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Доля запросов ранжирования, которые выполняются под профилировщиком (0 — профилирование выключено)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+
+# Границы корзин гистограмм в секундах: этапы запроса — от десятков микросекунд, запрос целиком — до секунд
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    # Счетчик с метками (значения меток передаются в порядке label_names)
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.label_names, labels)} {value:g}')
+        return lines
+
+
+class Histogram:
+    # Гистограмма с метками: число наблюдений по корзинам, их сумма и количество.
+    # Наблюдение — поиск корзины и два сложения под блокировкой, поэтому гистограммы
+    # можно обновлять на каждом этапе каждого запроса
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счетчики корзин (последняя — +Inf), сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            values[0][index] += 1
+            values[1] += value
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        # Функция для получения числа наблюдений и их суммы по меткам
+        with self._lock:
+            return {labels: (sum(counts), total) for labels, (counts, total) in self._values.items()}
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.label_names + ('le',), labels + (format_bound(bound),))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+def format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    # Функция для записи меток в формате Prometheus: {name="value",...}
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+# Метрики сервиса
+STAGE_SECONDS = Histogram('recommendation_stage_seconds', 'Duration of ranking request stages',
+                          ('exp_group', 'stage'), STAGE_BUCKETS)
+REQUEST_SECONDS = Histogram('recommendation_request_seconds', 'Duration of /post/recommendations requests',
+                            ('exp_group',), REQUEST_BUCKETS)
+RECOMMENDATIONS = Counter('recommendations_total', 'Recommendation feeds served, by feed source',
+                          ('exp_group', 'source'))
+PROFILED_REQUESTS = Counter('profiled_requests_total', 'Ranking requests run under the sampling profiler', ())
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, RECOMMENDATIONS, PROFILED_REQUESTS]
+
+
+def render_metrics() -> str:
+    # Функция для получения всех метрик в текстовом формате Prometheus
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+class StageTimer:
+    # Замер этапов одного запроса ранжирования: lap(stage) закрывает этап, начавшийся
+    # с предыдущей отметки, и записывает его длительность в гистограмму этапов
+
+    def __init__(self, exp_group: str):
+        self.exp_group = exp_group
+        self.last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        STAGE_SECONDS.observe(now - self.last, self.exp_group, stage)
+        self.last = now
+
+
+_local = threading.local()
+
+
+@contextmanager
+def track_stages(exp_group: str) -> Iterator[StageTimer]:
+    # Контекст запроса ранжирования: внутри него lap() в этом потоке (в том числе в движке
+    # скоринга) отмечает этапы запроса. Вне контекста, например в пакетном эндпоинте
+    # или в потоке микробатчинга, lap() ничего не делает
+    previous = getattr(_local, 'timer', None)
+    _local.timer = timer = StageTimer(exp_group)
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+def lap(stage: str) -> None:
+    # Функция для отметки конца этапа текущего запроса ранжирования (если он замеряется)
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.lap(stage)
+
+
+class SamplingProfiler:
+    # Профилирование доли запросов: выбранный запрос выполняется под cProfile, его статистика
+    # добавляется к накопленной. Одновременно профилируется не больше одного запроса,
+    # остальные выбранные в это время выполняются без профилировщика
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.requests = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def sample(self) -> Iterator[None]:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self.requests += 1
+            PROFILED_REQUESTS.inc()
+        finally:
+            self._busy.release()
+
+    def report(self, limit: int = 30, sort: str = 'cumulative') -> str:
+        # Функция для получения самых затратных функций по накопленной статистике
+        with self._lock:
+            if self._stats is None:
+                return 'no profiled requests\n'
+            stream = io.StringIO()
+            self._stats.stream = stream
+            stream.write(f'profiled requests: {self.requests}\n')
+            self._stats.sort_stats(sort).print_stats(limit)
+            return stream.getvalue()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = None
+            self.requests = 0
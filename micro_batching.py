@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import time as time_module
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from scoring import ScoringEngine, get_time_features
+
+# Сколько миллисекунд планировщик ждет соседние запросы, прежде чем скорить пакет (0 — микробатчинг выключен)
+MICRO_BATCH_WAIT_MS = float(os.getenv('MICRO_BATCH_WAIT_MS', 0))
+# Максимальное число запросов в одном вызове модели
+MICRO_BATCH_MAX_SIZE = int(os.getenv('MICRO_BATCH_MAX_SIZE', 32))
+
+
+class MicroBatcher:
+    # Планировщик микробатчей для одной модели: одиночные запросы из разных потоков
+    # складываются в очередь, отдельный поток забирает их пачкой (пока не наберется
+    # max_size или не истечет max_wait после первого запроса) и скорит одним вызовом
+    # predict_proba. Пока идет вызов модели, новые запросы копятся в очереди и
+    # попадают в следующий пакет без ожидания.
+
+    def __init__(self, scoring_engine: ScoringEngine, max_wait_ms: float = MICRO_BATCH_WAIT_MS,
+                 max_size: int = MICRO_BATCH_MAX_SIZE):
+        self.scoring_engine = scoring_engine
+        self.max_wait = max_wait_ms / 1000
+        self.max_size = max_size
+        self._queue = queue.SimpleQueue()
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def predict(self, user_features: Dict, time: datetime, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        # Функция для получения вероятностей лайка (тот же интерфейс, что у ScoringEngine.predict):
+        # поток ждет, пока его запрос будет посчитан в составе пакета
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                # Планировщик остановлен (модель заменена новой версией): скорим запрос сами
+                return self.scoring_engine.predict(user_features, time, rows)
+            self._queue.put((user_features, time, rows, future))
+        return future.result()
+
+    def close(self):
+        # Функция для остановки планировщика: запросы, уже стоящие в очереди, досчитываются,
+        # после чего поток завершается
+        with self._close_lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def _collect(self) -> List[tuple]:
+        # Функция для набора пакета: ждем первый запрос, затем добираем остальные до срока или лимита
+        # (метка остановки None завершает пакет и остается последним элементом)
+        batch = [self._queue.get()]
+        deadline = time_module.monotonic() + self.max_wait
+        while len(batch) < self.max_size and batch[-1] is not None:
+            timeout = deadline - time_module.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch = self._collect()
+            if batch[-1] is None:
+                closed = True
+                batch.pop()
+            # Временные признаки общие для всего вызова, поэтому пакет делится по временным интервалам
+            groups = {}
+            for item in batch:
+                groups.setdefault(get_time_features(item[1]), []).append(item)
+            for items in groups.values():
+                self._score(items)
+
+    def _score(self, items: List[tuple]):
+        # Функция для скоринга пакета одним вызовом модели и раздачи результатов ждущим потокам
+        try:
+            predicts = self.scoring_engine.predict_many([item[0] for item in items], items[0][1],
+                                                        [item[2] for item in items])
+        except Exception as e:
+            for item in items:
+                item[3].set_exception(e)
+            return
+
+        self.requests += len(items)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(items))
+        for item, user_predicts in zip(items, predicts):
+            item[3].set_result(user_predicts)
+
+    def stats(self) -> Dict:
+        # Функция для получения счетчиков планировщика
+        return {
+            'max_wait_ms': self.max_wait * 1000,
+            'max_size': self.max_size,
+            'queued': self._queue.qsize(),
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch': self.requests / self.batches if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+        }
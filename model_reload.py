@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Период в секундах, с которым проверяются файлы моделей (0 — наблюдение выключено)
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', 0))
+# Сколько вызовов скоринга прогревают новую версию модели перед подменой
+RELOAD_WARMUP_CALLS = int(os.getenv('RELOAD_WARMUP_CALLS', 3))
+
+
+class ModelReloader:
+    # Фоновая перезагрузка версий моделей без остановки сервиса. Новая версия собирается
+    # функцией build и прогревается функцией warm_up в отдельном потоке, затем подменяет
+    # текущую одним присваиванием в словаре versions (имя -> версия). Запросы берут версию
+    # из словаря один раз и дорабатывают на ней, поэтому старая версия освобождается, когда
+    # завершится последний такой запрос; обслуживание запросов перезагрузку не ждет.
+    # Если заданы watch_paths (имя -> файл модели), отдельный поток перезагружает модель,
+    # когда ее файл изменился и не менялся в течение watch_interval (запись завершена).
+    # Модели могут появляться в versions и исчезать из него (загрузка и выгрузка по требованию):
+    # swap_lock — общая с владельцем словаря блокировка, под которой версия подменяется,
+    # только если модель все еще загружена.
+
+    def __init__(self, versions: Dict[str, Any], build: Callable[[str, bool], Any],
+                 warm_up: Callable[[Any], None], on_swap: Optional[Callable[[str, Any, Any], None]] = None,
+                 watch_paths: Optional[Dict[str, str]] = None, watch_interval: float = MODEL_WATCH_INTERVAL,
+                 swap_lock: Optional[threading.Lock] = None):
+        self.versions = versions
+        self.build = build
+        self.warm_up = warm_up
+        self.on_swap = on_swap
+        self.swap_lock = swap_lock or threading.Lock()
+        self._lock = threading.Lock()
+        self._loading = set()
+        self._status = {}
+        for name in versions:
+            self.track(name)
+
+        self.watch_paths = watch_paths or {}
+        self.watch_interval = watch_interval
+        if self.watch_paths and self.watch_interval > 0:
+            self._watched = {name: self._get_file_state(path) for name, path in self.watch_paths.items()}
+            self._thread = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+            self._thread.start()
+
+    def track(self, name: str):
+        # Функция для начала учета версий модели name (после ее первой загрузки)
+        with self._lock:
+            self._status[name] = {'version': 1, 'loaded_at': datetime.now().isoformat(timespec='seconds'),
+                                  'duration_s': None, 'error': None}
+
+    def reload(self, name: str, reload_features: bool = False) -> bool:
+        # Функция для запуска перезагрузки модели name в фоне (reload_features — перечитать и признаки постов).
+        # Возвращает False, если перезагрузка этой модели уже идет
+        if name not in self.versions:
+            raise KeyError(name)
+        with self._lock:
+            if name in self._loading:
+                return False
+            self._loading.add(name)
+        threading.Thread(target=self._reload, args=(name, reload_features),
+                         name=f'model-reload-{name}', daemon=True).start()
+        return True
+
+    def _reload(self, name: str, reload_features: bool):
+        start = time.perf_counter()
+        try:
+            logger.info(f'model reload {name}: loading (features: {reload_features})')
+            version = self.build(name, reload_features)
+            self.warm_up(version)
+
+            with self.swap_lock:
+                old_version = self.versions.get(name)
+                if old_version is not None:
+                    self.versions[name] = version
+            if old_version is None:
+                logger.info(f'model reload {name}: model was unloaded, new version dropped')
+                return
+            if self.on_swap is not None:
+                self.on_swap(name, old_version, version)
+
+            duration = time.perf_counter() - start
+            with self._lock:
+                status = self._status.setdefault(name, {'version': 0})
+                status.update(version=status['version'] + 1, loaded_at=datetime.now().isoformat(timespec='seconds'),
+                              duration_s=round(duration, 2), error=None)
+            logger.info(f'model reload {name}: swapped in {duration:.1f} s')
+        except Exception as e:
+            # Текущая версия продолжает обслуживать запросы
+            logger.exception(f'model reload {name}: failed')
+            with self._lock:
+                self._status.setdefault(name, {'version': 0})['error'] = repr(e)
+        finally:
+            with self._lock:
+                self._loading.discard(name)
+
+    @staticmethod
+    def _get_file_state(path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _watch(self):
+        # Цикл наблюдения: изменение файла запоминается, перезагрузка начинается,
+        # когда при следующей проверке файл остался тем же (незагруженная модель
+        # прочитает новый файл при загрузке, ее перезагружать не нужно)
+        pending = {}
+        while True:
+            time.sleep(self.watch_interval)
+            for name, path in self.watch_paths.items():
+                state = self._get_file_state(path)
+                if state is None or state == self._watched[name]:
+                    pending.pop(name, None)
+                elif pending.get(name) != state:
+                    pending[name] = state
+                elif name not in self.versions or self._reload_changed(name, path):
+                    self._watched[name] = state
+                    del pending[name]
+
+    def _reload_changed(self, name: str, path: str) -> bool:
+        try:
+            started = self.reload(name)
+        except KeyError:  # модель выгрузили между проверками
+            return True
+        if started:
+            logger.info(f'model reload {name}: {path} changed')
+        return started
+
+    def stats(self) -> Dict:
+        # Функция для получения состояния версий моделей
+        with self._lock:
+            return {name: {**status, 'loading': name in self._loading} for name, status in self._status.items()}
@@ -0,0 +1,45 @@
+import json
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+class PostStore:
+    # Хранилище текстов и тем постов для сборки ответа. Строится один раз при старте:
+    # плотный массив post_id -> строка, колонки текста и темы и готовый JSON-фрагмент
+    # каждого поста. Ответ собирается склейкой фрагментов, поэтому его цена зависит
+    # только от числа отдаваемых постов, а не от размера каталога.
+
+    def __init__(self, post_table: pd.DataFrame):
+        self.post_ids = post_table['post_id'].to_numpy().astype(np.int64)
+        self.texts = post_table['text'].astype(str).to_numpy(dtype=object)
+        self.topics = post_table['topic'].astype(str).to_numpy(dtype=object)
+
+        # Плотный массив post_id -> строка хранилища (-1, если поста нет)
+        self.positions = np.full(int(self.post_ids.max()) + 1 if len(self.post_ids) else 0, -1, dtype=np.int32)
+        self.positions[self.post_ids] = np.arange(len(self.post_ids), dtype=np.int32)
+
+        # JSON поста в том же виде, в каком его сериализует PostGet
+        self.fragments = [
+            json.dumps({'id': int(i), 'text': text, 'topic': topic},
+                       ensure_ascii=False, separators=(',', ':')).encode()
+            for i, text, topic in zip(self.post_ids, self.texts, self.topics)
+        ]
+
+    def get_rows(self, post_ids: List[int]) -> np.ndarray:
+        # Функция для получения строк хранилища по post_id (неизвестные посты отбрасываются)
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        post_ids = post_ids[(post_ids >= 0) & (post_ids < len(self.positions))]
+        rows = self.positions[post_ids]
+        return rows[rows >= 0]
+
+    def get_posts(self, post_ids: List[int]) -> List[Dict]:
+        # Функция для получения id, текста и темы постов в порядке post_ids
+        return [{'id': int(self.post_ids[row]), 'text': self.texts[row], 'topic': self.topics[row]}
+                for row in self.get_rows(post_ids)]
+
+    def encode(self, post_ids: List[int]) -> bytes:
+        # Функция для получения JSON-массива постов склейкой готовых фрагментов
+        return b'[' + b','.join([self.fragments[row] for row in self.get_rows(post_ids)]) + b']'
+
@@ -0,0 +1,109 @@
+# Пакетная задача: заранее считает ленты всех пользователей из таблицы признаков на каждый
+# из 8 временных интервалов и пишет их в каталог, из которого сервис отдает ленты
+# (PRECOMPUTED_FEEDS_DIR). Скоринг — тот же, что у пакетного эндпоинта сервиса
+# (app.get_recommended_feeds_batch: группа эксперимента из get_exp_group, весь каталог,
+# без лайкнутых постов). Пользователи делятся на чанки, чанки считаются в пуле процессов;
+# прерванный прогон при повторном запуске продолжается с недостающих чанков.
+# Запуск из корня проекта: python precompute.py --output ./precomputed_feeds [--workers 8]
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+import numpy as np
+
+from precomputed_feeds import FeedsWriter, get_bucket_time
+from scoring import TIME_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+service = None  # модуль app (импортируется в main после настройки окружения)
+writer = None
+
+
+def score_chunk(index: int, user_ids: List[int], depth: int) -> int:
+    # Функция для расчета лент одного чанка пользователей на все временные интервалы
+    # (выполняется в процессе пула, результат сразу пишется в файл чанка)
+    arm_codes = {name: code for code, name in enumerate(service.experiments.arms)}
+    rows = {user_id: row for row, user_id in enumerate(user_ids)}
+    exp_groups = np.zeros(len(user_ids), dtype=np.int8)
+    post_ids = np.full((len(user_ids), len(TIME_BUCKETS), depth), -1, dtype=np.int32)
+    for bucket_index, bucket in enumerate(TIME_BUCKETS):
+        feeds = service.get_recommended_feeds_batch(user_ids, depth, get_bucket_time(bucket))
+        for user_id, exp_group, feed in feeds:
+            row = rows[user_id]
+            exp_groups[row] = arm_codes[exp_group]
+            post_ids[row, bucket_index, :len(feed)] = feed
+    writer.save_part(index, np.asarray(user_ids, dtype=np.int32), exp_groups, post_ids)
+    return len(user_ids)
+
+
+def get_params(user_ids: np.ndarray, depth: int, chunk_size: int) -> dict:
+    # Функция для получения параметров прогона: прерванный прогон продолжается, только если они совпали
+    experiments = service.experiments
+    return {
+        'users': hashlib.sha256(user_ids.tobytes()).hexdigest()[:16],
+        'n_users': len(user_ids),
+        'depth': depth,
+        'chunk_size': chunk_size,
+        'salt': experiments.salt,
+        'arms': {name: [arm.weight, arm.model_path, arm.features_table] for name, arm in experiments.arms.items()},
+        'models': get_model_fingerprints(),
+    }
+
+
+def get_model_fingerprints() -> dict:
+    # Функция для получения отпечатков моделей загруженных плеч (записываются в feeds.json,
+    # сервис не отдает ленты группы, если ее модель с тех пор заменили)
+    return {name: scoring_engine.fingerprint for name, scoring_engine in service.experiments.engines.items()}
+
+
+def main():
+    global service, writer
+    parser = argparse.ArgumentParser(description='Precompute ranked feeds for all users')
+    parser.add_argument('--output', default=os.getenv('PRECOMPUTED_FEEDS_DIR') or './precomputed_feeds',
+                        help='directory with precomputed feeds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='scoring processes')
+    parser.add_argument('--depth', type=int, default=100, help='posts per feed')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='users per chunk (unit of resume)')
+    parser.add_argument('--restart', action='store_true', help='discard an unfinished run')
+    args = parser.parse_args()
+
+    # Ленты считаются моделью, а не берутся из прошлого прогона или кэша; фоновые потоки
+    # сервиса не нужны. CatBoost — один поток на процесс, параллелизм дают процессы пула
+    os.environ.update({'PRECOMPUTED_FEEDS_DIR': '', 'FEED_CACHE_SIZE_MB': '0', 'MICRO_BATCH_WAIT_MS': '0',
+                       'LIKES_REFRESH_INTERVAL': '0', 'MODEL_WATCH_INTERVAL': '0'})
+    os.environ.setdefault('CATBOOST_THREAD_COUNT', '1')
+    import app
+    service = app
+
+    # Данные и модели загружаются один раз до запуска пула: процессы пула создаются
+    # через fork и читают их из общих страниц памяти
+    service.experiments.preload()
+    user_ids = np.unique(service.df_user['user_id'].to_numpy()).astype(np.int32)
+    writer = FeedsWriter(args.output, get_params(user_ids, args.depth, args.chunk_size), args.restart)
+
+    chunks = [user_ids[start:start + args.chunk_size].tolist() for start in range(0, len(user_ids), args.chunk_size)]
+    pending = [index for index in range(len(chunks)) if not writer.has_part(index)]
+    logger.info(f'precompute run {writer.run_id}: {len(user_ids)} users, {len(chunks)} chunks, '
+                f'{len(chunks) - len(pending)} done, {args.workers} workers')
+
+    start_time = time.perf_counter()
+    done_users = 0
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        futures = [pool.submit(score_chunk, index, chunks[index], args.depth) for index in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            done_users += future.result()
+            elapsed = time.perf_counter() - start_time
+            logger.info(f'chunk {done}/{len(pending)}: {done_users / elapsed:.0f} users/s')
+
+    manifest = writer.finish(len(chunks), len(user_ids), list(service.experiments.arms), get_model_fingerprints())
+    logger.info(f'precompute run {manifest["run_id"]}: finished in {time.perf_counter() - start_time:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from scoring import TIME_BUCKETS, get_time_features
+
+logger = logging.getLogger(__name__)
+
+# Каталог заранее посчитанных лент (пустое значение — ленты считаются только онлайн)
+PRECOMPUTED_FEEDS_DIR = os.getenv('PRECOMPUTED_FEEDS_DIR', '')
+# Максимальный возраст лент в секундах: более старые не отдаются, лента считается онлайн
+PRECOMPUTED_FEEDS_MAX_AGE = float(os.getenv('PRECOMPUTED_FEEDS_MAX_AGE', 6 * 60 * 60))
+# Как часто (в секундах) сервис проверяет, не записала ли пакетная задача новые ленты
+PRECOMPUTED_FEEDS_CHECK_INTERVAL = float(os.getenv('PRECOMPUTED_FEEDS_CHECK_INTERVAL', 60))
+
+# Номер временного интервала по его признакам (время суток, будний/выходной день)
+BUCKET_INDEX = {bucket: index for index, bucket in enumerate(TIME_BUCKETS)}
+
+# Формат каталога лент:
+#   feeds.json                     — описание готового прогона: run_id, время расчета, глубина, группы
+#                                    и отпечатки моделей групп
+#   feeds-<run_id>.user_ids.npy    — user_id по возрастанию (int32)
+#   feeds-<run_id>.exp_groups.npy  — номер группы пользователя в списке exp_groups (int8)
+#   feeds-<run_id>.post_ids.npy    — post_id лучших depth постов: пользователь × интервал × место
+#                                    (int32, -1 — лента короче depth)
+#   job.json, parts-<run_id>/      — незавершенный прогон: параметры и готовые чанки пользователей
+# Файлы прогона не перезаписываются, поэтому сервис может держать в mmap предыдущий прогон,
+# пока пакетная задача пишет следующий; feeds.json подменяется последним.
+
+
+def get_bucket_time(bucket: tuple) -> datetime:
+    # Функция для получения момента времени, который попадает во временной интервал
+    # (неделя с понедельника 1 января 2024 года: час — начало времени суток, день — первый подходящий)
+    time_of_day, day_of_week = bucket
+    hour = next(hour for hour in range(24) if get_time_features(datetime(2024, 1, 1, hour))[0] == time_of_day)
+    day = next(day for day in range(1, 8) if get_time_features(datetime(2024, 1, day))[1] == day_of_week)
+    return datetime(2024, 1, day, hour)
+
+
+def read_json(path: str) -> Optional[Dict]:
+    # Функция для чтения JSON-файла (None, если файла нет)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path: str, data: Dict) -> None:
+    # Функция для записи JSON через временный файл с атомарной подменой
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class FeedsWriter:
+    # Запись прогона пакетной задачи. Пользователи делятся на чанки, каждый готовый чанк
+    # пишется отдельным файлом (атомарно), поэтому прерванный прогон продолжается с
+    # недостающих чанков. Прогон продолжается, только если совпали его параметры
+    # (пользователи, глубина, размер чанка, настройка эксперимента); иначе начинается заново.
+    # После всех чанков они склеиваются в mmap-массивы и подменяется feeds.json.
+
+    def __init__(self, path: str, params: Dict, restart: bool = False):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        job = None if restart else read_json(self._file('job.json'))
+        if job is not None and job['params'] != params:
+            logger.info(f'precomputed feeds: parameters changed, run {job["run_id"]} is discarded')
+            job = None
+        if job is None:
+            self._remove_unfinished()
+            run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+            job = {'run_id': run_id, 'created_at': time.time(), 'params': params}
+            os.makedirs(self._file(f'parts-{run_id}'))
+            write_json(self._file('job.json'), job)
+        else:
+            logger.info(f'precomputed feeds: resuming run {job["run_id"]}')
+        self.run_id = job['run_id']
+        self.created_at = job['created_at']  # возраст лент считается от начала прогона
+        self.params = params
+        self.parts_path = self._file(f'parts-{self.run_id}')
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _remove_unfinished(self):
+        # Функция для удаления чанков незавершенного прогона
+        for parts_path in glob.glob(self._file('parts-*')):
+            shutil.rmtree(parts_path)
+        if os.path.exists(self._file('job.json')):
+            os.remove(self._file('job.json'))
+
+    def _part_file(self, index: int) -> str:
+        return os.path.join(self.parts_path, f'part-{index:05d}.npz')
+
+    def has_part(self, index: int) -> bool:
+        return os.path.exists(self._part_file(index))
+
+    def save_part(self, index: int, user_ids: np.ndarray, exp_groups: np.ndarray, post_ids: np.ndarray) -> None:
+        # Функция для записи готового чанка через временный файл с атомарной подменой
+        tmp_path = os.path.join(self.parts_path, f'part-{index:05d}.{os.getpid()}.tmp.npz')
+        np.savez(tmp_path, user_ids=user_ids, exp_groups=exp_groups, post_ids=post_ids)
+        os.replace(tmp_path, self._part_file(index))
+
+    def finish(self, n_parts: int, n_users: int, exp_groups: List[str], model_fingerprints: Dict[str, str]) -> Dict:
+        # Функция для склейки чанков в массивы прогона (чанки идут по возрастанию user_id,
+        # поэтому склеенные user_id тоже упорядочены) и публикации прогона в feeds.json
+        depth = self.params['depth']
+        prefix = self._file(f'feeds-{self.run_id}')
+        user_ids = np.lib.format.open_memmap(f'{prefix}.user_ids.npy', mode='w+', dtype=np.int32, shape=(n_users,))
+        groups = np.lib.format.open_memmap(f'{prefix}.exp_groups.npy', mode='w+', dtype=np.int8, shape=(n_users,))
+        post_ids = np.lib.format.open_memmap(f'{prefix}.post_ids.npy', mode='w+', dtype=np.int32,
+                                             shape=(n_users, len(TIME_BUCKETS), depth))
+        start = 0
+        for index in range(n_parts):
+            with np.load(self._part_file(index)) as part:
+                end = start + len(part['user_ids'])
+                user_ids[start:end] = part['user_ids']
+                groups[start:end] = part['exp_groups']
+                post_ids[start:end] = part['post_ids']
+            start = end
+        if start != n_users:
+            raise ValueError(f'Parts contain {start} users, expected {n_users}')
+        for array in (user_ids, groups, post_ids):
+            array.flush()
+        del user_ids, groups, post_ids
+
+        manifest = {'run_id': self.run_id, 'created_at': self.created_at, 'finished_at': time.time(),
+                    'depth': depth, 'time_buckets': [list(bucket) for bucket in TIME_BUCKETS],
+                    'exp_groups': exp_groups, 'model_fingerprints': model_fingerprints, 'n_users': n_users}
+        write_json(self._file('feeds.json'), manifest)
+
+        # Прогон опубликован: чанки и файлы предыдущих прогонов больше не нужны
+        # (сервис, который еще держит старые файлы в mmap, читает их до перезагрузки)
+        self._remove_unfinished()
+        for old_file in glob.glob(self._file('feeds-*.npy')):
+            if not os.path.basename(old_file).startswith(f'feeds-{self.run_id}.'):
+                os.remove(old_file)
+        return manifest
+
+
+class PrecomputedFeeds:
+    # Ленты, заранее посчитанные пакетной задачей precompute.py, в режиме чтения через mmap:
+    # на запрос — бинарный поиск пользователя и срез его ленты для текущего временного
+    # интервала, без вызова модели. Ленты нет (None), если пользователя нет в прогоне,
+    # его группа эксперимента с тех пор изменилась, модель группы заменили после прогона
+    # (отпечаток модели не совпал) или прогон старше max_age — тогда сервис считает ленту
+    # онлайн. Новый прогон подхватывается по изменению feeds.json.
+
+    def __init__(self, path: str, max_age: float = PRECOMPUTED_FEEDS_MAX_AGE,
+                 check_interval: float = PRECOMPUTED_FEEDS_CHECK_INTERVAL):
+        self.path = path
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._feeds: Optional[Dict] = None
+        self._manifest_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.outdated = 0
+        self._check()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _check(self):
+        # Функция для подключения нового прогона, если feeds.json изменился с прошлой проверки
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self._file('feeds.json')).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        manifest = read_json(self._file('feeds.json'))
+        if [tuple(bucket) for bucket in manifest['time_buckets']] != TIME_BUCKETS:
+            logger.warning(f'precomputed feeds {manifest["run_id"]}: time buckets do not match, ignored')
+            return
+        prefix = self._file(f'feeds-{manifest["run_id"]}')
+        self._feeds = {
+            **manifest,
+            'user_ids': np.load(f'{prefix}.user_ids.npy', mmap_mode='r'),
+            'exp_groups': np.load(f'{prefix}.exp_groups.npy', mmap_mode='r'),
+            'post_ids': np.load(f'{prefix}.post_ids.npy', mmap_mode='r'),
+            'group_codes': {exp_group: code for code, exp_group in enumerate(manifest['exp_groups'])},
+        }
+        self._manifest_mtime = mtime
+        logger.info(f'precomputed feeds {manifest["run_id"]}: attached ({manifest["n_users"]} users)')
+
+    def _get_feeds(self) -> Optional[Dict]:
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.check_interval:
+                    self._check()
+        return self._feeds
+
+    @property
+    def depth(self) -> int:
+        feeds = self._get_feeds()
+        return feeds['depth'] if feeds is not None else 0
+
+    def get(self, user_id: int, exp_group: str, now: datetime,
+            model_fingerprint: Optional[str] = None) -> Optional[np.ndarray]:
+        # Функция для получения заранее посчитанной ленты пользователя (post_id по убыванию скора).
+        # model_fingerprint — отпечаток модели, которая сейчас обслуживает группу
+        feeds = self._get_feeds()
+        if feeds is None:
+            self.misses += 1
+            return None
+        if time.time() - feeds['created_at'] > self.max_age:
+            self.stale += 1
+            return None
+        if model_fingerprint is not None and feeds.get('model_fingerprints', {}).get(exp_group) != model_fingerprint:
+            self.outdated += 1
+            return None
+        user_ids = feeds['user_ids']
+        row = int(np.searchsorted(user_ids, user_id))
+        if row == len(user_ids) or user_ids[row] != user_id \
+                or feeds['exp_groups'][row] != feeds['group_codes'].get(exp_group, -1):
+            self.misses += 1
+            return None
+        self.hits += 1
+        post_ids = np.asarray(feeds['post_ids'][row, BUCKET_INDEX[get_time_features(now)]])
+        return post_ids[post_ids >= 0]
+
+    def stats(self) -> Dict:
+        # Функция для получения состояния подключенного прогона и счетчиков
+        feeds = self._get_feeds()
+        run = {} if feeds is None else {
+            'run_id': feeds['run_id'], 'n_users': feeds['n_users'], 'depth': feeds['depth'],
+            'age_s': round(time.time() - feeds['created_at'], 1),
+        }
+        return {'path': self.path, 'max_age_s': self.max_age, **run,
+                'hits': self.hits, 'misses': self.misses, 'stale': self.stale, 'outdated': self.outdated}
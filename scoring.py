@@ -0,0 +1,289 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from compiled_model import hash_cat_values
+
+# Колонки признаков в том порядке, в котором их видели модели при обучении
+CONTROL_COLUMNS = ['post_id', 'time_of_day', 'day_of_week', 'topic',
+                   'pca_1', 'pca_2', 'gender', 'city', 'exp_group',
+                   'os', 'source', 'age_group']
+
+TEST_COLUMNS = (['post_id', 'time_of_day', 'day_of_week', 'topic']
+                + [f'vector_{i}' for i in range(100)]
+                + ['gender', 'city', 'exp_group', 'os', 'source', 'age_group'])
+
+# Схемы колонок по имени (для настройки плеч эксперимента)
+COLUMN_SCHEMAS = {'pca': CONTROL_COLUMNS, 'w2v': TEST_COLUMNS}
+
+# Колонки, которые зависят от времени запроса
+TIME_COLUMNS = ['time_of_day', 'day_of_week']
+
+# Метки времени суток по часу (повторяют pd.cut с bins=[0, 6, 12, 18, 24], right=False)
+TIME_OF_DAY_BY_HOUR = ['night'] * 6 + ['morning'] * 6 + ['afternoon'] * 6 + ['evening'] * 6
+# Метки дня недели по номеру дня (повторяют pd.cut с bins=[-1, 4, 6])
+DAY_OF_WEEK_BY_WEEKDAY = ['weekday'] * 5 + ['weekend'] * 2
+# Все возможные сочетания временных признаков
+TIME_BUCKETS = [(time_of_day, day_of_week)
+                for time_of_day in ('night', 'morning', 'afternoon', 'evening')
+                for day_of_week in ('weekday', 'weekend')]
+
+
+def get_time_features(time: datetime) -> Tuple[str, str]:
+    # Функция для получения временных признаков (время суток, будний/выходной день)
+    return TIME_OF_DAY_BY_HOUR[time.hour], DAY_OF_WEEK_BY_WEEKDAY[time.weekday()]
+
+
+def get_time_bucket_end(time: datetime) -> datetime:
+    # Функция для получения момента, когда сменятся временные признаки.
+    # Время суток меняется каждые 6 часов, будний/выходной — в полночь,
+    # которая тоже является границей времени суток
+    bucket_start = time.replace(hour=time.hour // 6 * 6, minute=0, second=0, microsecond=0)
+    return bucket_start + timedelta(hours=6)
+
+
+def get_top_positions(predicts: np.ndarray, limit: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    # Функция для получения позиций limit лучших предсказаний по убыванию (среди разрешенных маской).
+    # argpartition отбирает лучшие за линейное время, сортируются только отобранные;
+    # при равных предсказаниях раньше идет меньшая позиция
+    positions = np.arange(len(predicts)) if mask is None else np.flatnonzero(mask)
+    if limit <= 0:
+        return positions[:0]
+    scores = predicts[positions]
+    if limit < len(positions):
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        positions, scores = positions[top], scores[top]
+    return positions[np.lexsort((positions, -scores))]
+
+class ScoringEngine:
+    # Движок скоринга: признаки постов хранятся одним колоночным блоком,
+    # который строится один раз при старте. На каждый запрос в блок
+    # подставляются только колонки пользователя и времени.
+
+    def __init__(self, model, posts_features: pd.DataFrame, columns: List[str], thread_count: int = -1,
+                 fingerprint: str = ''):
+        self.model = model
+        self.thread_count = thread_count  # потоки CatBoost на один вызов (-1 — все ядра)
+        self.fingerprint = fingerprint  # отпечаток файла модели (с ним сверяются заранее посчитанные ленты)
+        posts_features = self._init_posts(posts_features, columns, model.get_cat_feature_indices())
+
+        # Категориальные признаки храним как category, числовые — как float32:
+        # CatBoost читает такой DataFrame без поэлементного разбора строк
+        # (concat по колонкам не копирует данные, если они уже нужного типа,
+        # например подключены из общего хранилища признаков)
+        block = []
+        for column in self.columns:
+            if column in self.request_columns:
+                continue
+            if column in self.cat_columns:
+                block.append(posts_features[column].astype(str).astype('category'))
+            else:
+                block.append(posts_features[column].astype(np.float32))
+        self.posts_block = pd.concat(block, axis=1)
+
+        # Общий массив нулевых кодов для колонок-констант (одно значение на все посты)
+        self._constant_codes = np.zeros(self.n_posts, dtype=np.int8)
+        self._constant_codes.flags.writeable = False
+
+        # Временных сочетаний всего 8, поэтому блоки временных колонок строятся
+        # заранее, и запрос только выбирает блок своего интервала
+        self.time_columns = [c for c in self.request_columns if c in TIME_COLUMNS]
+        self.user_columns = [c for c in self.request_columns if c not in TIME_COLUMNS]
+        self.time_blocks = {}
+        for bucket in TIME_BUCKETS:
+            values = dict(zip(TIME_COLUMNS, bucket))
+            self.time_blocks[bucket] = pd.DataFrame({
+                column: self._constant_column(values[column], self.n_posts) for column in self.time_columns
+            }, index=self.posts_block.index)
+
+    def _init_posts(self, posts_features: pd.DataFrame, columns: List[str], cat_indices) -> pd.DataFrame:
+        # Функция для разбора колонок модели и каталога постов (общая часть движков)
+        self.columns = list(columns)
+        cat_indices = set(cat_indices)
+        self.cat_columns = [c for i, c in enumerate(self.columns) if i in cat_indices]
+
+        self.posts_features = posts_features  # исходная таблица (для новой версии модели на тех же признаках)
+        posts_features = posts_features.reset_index(drop=True)
+        self.post_ids = posts_features['post_id'].to_numpy()
+        self.n_posts = len(posts_features)
+
+        # Плотный массив post_id -> позиция поста в блоке (-1, если поста нет)
+        self.post_positions = np.full(int(self.post_ids.max()) + 1 if self.n_posts else 0, -1, dtype=np.int32)
+        self.post_positions[self.post_ids] = np.arange(self.n_posts, dtype=np.int32)
+
+        # Колонки, которых нет в таблице постов, заполняются на каждый запрос
+        self.request_columns = [c for c in self.columns if c not in posts_features.columns
+                                or c in TIME_COLUMNS]
+        return posts_features
+
+    def get_rows(self, post_ids: np.ndarray) -> np.ndarray:
+        # Функция для получения позиций постов в блоке по их post_id (неизвестные посты отбрасываются)
+        post_ids = np.asarray(post_ids)
+        post_ids = post_ids[(post_ids >= 0) & (post_ids < len(self.post_positions))]
+        rows = self.post_positions[post_ids]
+        return rows[rows >= 0]
+
+    def _constant_column(self, value, n_rows: int) -> pd.Categorical:
+        # Функция для создания категориальной колонки из одного значения без копирования данных
+        return pd.Categorical.from_codes(self._constant_codes[:n_rows], categories=[str(value)])
+
+    def build_features(self, user_features: Dict, time: datetime, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        # Функция для сборки матрицы признаков пользователь × посты.
+        # rows — позиции постов-кандидатов в блоке (по умолчанию все посты каталога)
+        posts_block = self.posts_block if rows is None else self.posts_block.take(rows).reset_index(drop=True)
+        n_rows = len(posts_block)
+
+        time_block = self.time_blocks[get_time_features(time)]
+        if n_rows < self.n_posts:
+            time_block = time_block.iloc[:n_rows]
+
+        user_block = {}
+        for column in self.user_columns:
+            if column in self.cat_columns:
+                user_block[column] = self._constant_column(user_features[column], n_rows)
+            else:
+                user_block[column] = np.full(n_rows, user_features[column], dtype=np.float32)
+        features = pd.concat([posts_block, time_block, pd.DataFrame(user_block)], axis=1)
+        return features[self.columns]
+
+    def predict(self, user_features: Dict, time: datetime, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        # Функция для получения вероятностей лайка по всем постам каталога (или по кандидатам rows)
+        features = self.build_features(user_features, time, rows)
+        metrics.lap('features')
+        return self.model.predict_proba(features, thread_count=self.thread_count)[:, 1]
+
+    def build_batch_features(self, users_features: List[Dict], time: datetime,
+                             rows_list: Optional[List[Optional[np.ndarray]]] = None) -> pd.DataFrame:
+        # Функция для сборки одной матрицы признаков сразу для нескольких пользователей:
+        # строки постов каждого пользователя идут подряд. rows_list — позиции кандидатов
+        # для каждого пользователя (None — весь каталог)
+        n_users = len(users_features)
+        time_of_day, day_of_week = get_time_features(time)
+
+        if rows_list is None:
+            post_rows = np.tile(np.arange(self.n_posts), n_users)
+            counts = np.full(n_users, self.n_posts)
+        else:
+            rows_list = [np.arange(self.n_posts) if rows is None else rows for rows in rows_list]
+            post_rows = np.concatenate(rows_list)
+            counts = np.array([len(rows) for rows in rows_list])
+        user_rows = np.repeat(np.arange(n_users), counts)
+
+        request_block = {}
+        for column in self.request_columns:
+            if column == 'time_of_day':
+                values = [time_of_day] * n_users
+            elif column == 'day_of_week':
+                values = [day_of_week] * n_users
+            else:
+                values = [user_features[column] for user_features in users_features]
+
+            if column in self.cat_columns:
+                codes, categories = pd.factorize(np.array([str(v) for v in values], dtype=object))
+                request_block[column] = pd.Categorical.from_codes(codes[user_rows], categories=categories)
+            else:
+                request_block[column] = np.asarray(values, dtype=np.float32)[user_rows]
+
+        posts_block = self.posts_block.take(post_rows).reset_index(drop=True)
+        features = pd.concat([posts_block, pd.DataFrame(request_block)], axis=1)
+        return features[self.columns]
+
+    def predict_many(self, users_features: List[Dict], time: datetime,
+                     rows_list: Optional[List[Optional[np.ndarray]]] = None) -> List[np.ndarray]:
+        # Функция для получения вероятностей лайка для нескольких пользователей одним вызовом модели.
+        # Возвращает по массиву предсказаний на пользователя (по всем постам или по его кандидатам)
+        if not users_features:
+            return []
+        features = self.build_batch_features(users_features, time, rows_list)
+        predicts = self.model.predict_proba(features, thread_count=self.thread_count)[:, 1]
+        if rows_list is None:
+            return list(predicts.reshape(len(users_features), self.n_posts))
+        counts = [self.n_posts if rows is None else len(rows) for rows in rows_list]
+        return np.split(predicts, np.cumsum(counts)[:-1])
+
+
+class CompiledScoringEngine(ScoringEngine):
+    # Движок скоринга на упакованной модели (compiled_model.CompiledModel). Категории постов
+    # хэшируются один раз, бинарные признаки, зависящие только от постов (пороги числовых
+    # признаков, one-hot и счетчики по категориям поста), считаются при старте, а деревья без
+    # признаков пользователя и времени сразу сворачиваются в одну оценку на пост. На запрос
+    # считаются только признаки с участием пользователя и времени. Модель CatBoost и блок
+    # признаков постов в pandas движку не нужны: категориальные колонки берутся из метаданных
+    # упаковки, входы постов строятся прямо из таблицы признаков.
+
+    def __init__(self, compiled_model, posts_features: pd.DataFrame, columns: List[str]):
+        self.compiled_model = compiled_model
+        self.fingerprint = compiled_model.fingerprint
+        posts_features = self._init_posts(posts_features, columns, compiled_model.cat_features)
+        positions = {column: i for i, column in enumerate(self.columns)}
+        self.request_positions = {positions[column]: column for column in self.request_columns}
+
+        # Входы модели по постам: числовые — float32, категориальные — хэши CatBoost
+        # (строковое представление значения, как в блоке признаков ScoringEngine)
+        post_inputs = {}
+        for column in self.columns:
+            if column in self.request_columns:
+                continue
+            if column in self.cat_columns:
+                codes, uniques = pd.factorize(posts_features[column].astype(str))
+                post_inputs[positions[column]] = hash_cat_values(uniques)[codes]
+            else:
+                post_inputs[positions[column]] = posts_features[column].to_numpy(dtype=np.float32)
+
+        # Бинарные признаки, которые зависят от запроса, и деревья, в которых они встречаются
+        request_inputs = set(self.request_positions)
+        is_request = np.array([bool(inputs & request_inputs) for inputs in compiled_model.split_inputs], dtype=bool)
+        self.request_splits = np.flatnonzero(is_request)
+        tree_splits = compiled_model.tree_splits
+        is_request_tree = ((tree_splits >= 0) & is_request[np.maximum(tree_splits, 0)]).any(axis=1)
+        self.request_trees = np.flatnonzero(is_request_tree)
+
+        post_indexes = compiled_model.get_leaf_indexes(np.flatnonzero(~is_request), post_inputs, self.n_posts)
+        post_trees = np.flatnonzero(~is_request_tree)
+        self.post_scores = compiled_model.get_leaf_sums(post_indexes[post_trees], post_trees)
+        self.post_indexes = post_indexes[self.request_trees]
+
+        # Входы постов, которые нужны признакам запроса (счетчики по комбинациям категорий поста и пользователя)
+        used_inputs = set().union(*[compiled_model.split_inputs[split] for split in self.request_splits])
+        self.request_post_inputs = {position: post_inputs[position] for position in used_inputs - request_inputs}
+        self._hashes = {}  # (колонка, значение) -> хэш
+
+    def _get_hash(self, column: str, value) -> np.ndarray:
+        # Функция для получения хэша значения категориального признака запроса (с кэшем)
+        key = (column, str(value))
+        hashes = self._hashes.get(key)
+        if hashes is None:
+            hashes = self._hashes[key] = hash_cat_values([value])
+        return hashes
+
+    def predict(self, user_features: Dict, time: datetime, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        # Функция для получения вероятностей лайка по всем постам каталога (или по кандидатам rows)
+        n_rows = self.n_posts if rows is None else len(rows)
+        inputs = dict(self.request_post_inputs) if rows is None else \
+            {position: values[rows] for position, values in self.request_post_inputs.items()}
+
+        # Признаки пользователя и времени — массивы из одного значения на все строки
+        time_values = dict(zip(TIME_COLUMNS, get_time_features(time)))
+        for position, column in self.request_positions.items():
+            value = time_values[column] if column in TIME_COLUMNS else user_features[column]
+            if column in self.cat_columns:
+                inputs[position] = self._get_hash(column, value)
+            else:
+                inputs[position] = np.array([value], dtype=np.float32)
+        metrics.lap('features')
+
+        indexes = self.compiled_model.get_leaf_indexes(self.request_splits, inputs, n_rows, self.request_trees)
+        indexes |= self.post_indexes if rows is None else self.post_indexes[:, rows]
+        post_scores = self.post_scores if rows is None else self.post_scores[rows]
+        return self.compiled_model.get_probability(
+            post_scores + self.compiled_model.get_leaf_sums(indexes, self.request_trees))
+
+    def predict_many(self, users_features: List[Dict], time: datetime,
+                     rows_list: Optional[List[Optional[np.ndarray]]] = None) -> List[np.ndarray]:
+        # Функция для получения вероятностей лайка для нескольких пользователей
+        # (упакованная модель считает каждого пользователя векторно, склейка в один вызов не нужна)
+        rows_list = rows_list or [None] * len(users_features)
+        return [self.predict(user_features, time, rows) for user_features, rows in zip(users_features, rows_list)]
@@ -0,0 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable
+
+# Число потоков, в которых параллельно идет скоринг
+SCORING_THREADS = int(os.getenv('SCORING_THREADS', os.cpu_count() or 1))
+# Сколько запросов может ждать свободный поток, прежде чем сервис начнет отвечать 503
+SCORING_QUEUE_SIZE = int(os.getenv('SCORING_QUEUE_SIZE', 64))
+# Потоки CatBoost на один вызов модели: вместе с SCORING_THREADS не больше числа ядер
+CATBOOST_THREAD_COUNT = int(os.getenv('CATBOOST_THREAD_COUNT', max(1, (os.cpu_count() or 1) // SCORING_THREADS)))
+
+
+class QueueFullError(Exception):
+    # Очередь на скоринг переполнена
+    pass
+
+
+class ScoringExecutor:
+    # Выделенный пул потоков для скоринга с ограничением очереди и склейкой запросов:
+    # одинаковые запросы, пришедшие, пока первый еще считается, ждут его результат,
+    # а не запускают модель повторно. Запрос занимает место в очереди, пока его работа
+    # не закончится в пуле, даже если клиент уже отключился и ожидание отменено.
+    # Методы и колбэки вызываются только из event loop, поэтому словарь выполняющихся
+    # запросов не требует блокировок.
+
+    def __init__(self, max_workers: int = SCORING_THREADS, max_queue: int = SCORING_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scoring')
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: Hashable, func: Callable, *args):
+        # Функция для выполнения func(*args) в пуле скоринга (с ключом для склейки одинаковых запросов)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise QueueFullError()
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, func, *args)
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        self.submitted += 1
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        # Функция для освобождения места в очереди, когда работа в пуле закончилась
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            future.exception()  # ошибку уже получили ожидающие; без них — не логировать ее как потерянную
+
+    def stats(self) -> Dict:
+        # Функция для получения счетчиков пула скоринга
+        return {
+            'threads': self.max_workers,
+            'max_queue': self.max_queue,
+            'pending': self.pending,
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'rejected': self.rejected,
+        }
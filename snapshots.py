@@ -0,0 +1,117 @@
+import glob
+import hashlib
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # без pyarrow снимки отключены, данные грузятся из БД
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Каталог с локальными снимками таблиц (пустое значение отключает снимки)
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', './snapshots')
+# Максимальный возраст снимка в секундах, после которого он считается устаревшим
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', 24 * 60 * 60))
+# Версия формата снимков: при изменении все старые снимки становятся недействительными
+SNAPSHOT_VERSION = 3
+
+
+def get_fingerprint(query: str, source: str = '') -> str:
+    # Функция для получения отпечатка снимка по запросу, источнику (адресу БД) и версии формата
+    normalized_query = ' '.join(query.split())
+    return hashlib.sha256(f'{SNAPSHOT_VERSION}:{source}:{normalized_query}'.encode()).hexdigest()[:16]
+
+
+def get_snapshot_path(name: str, fingerprint: str) -> str:
+    # Функция для получения пути к файлу снимка. Отпечаток входит в имя файла, поэтому
+    # снимки одной таблицы, снятые разными запросами или из разных БД, не вытесняют друг друга
+    return os.path.join(SNAPSHOT_DIR, f'{name}-{fingerprint}.arrow')
+
+
+def remove_stale_snapshots(name: str) -> None:
+    # Функция для удаления устаревших снимков таблицы (в том числе снятых другими запросами
+    # и в прежнем формате без отпечатка в имени)
+    for path in glob.glob(os.path.join(SNAPSHOT_DIR, f'{glob.escape(name)}-*.arrow')) \
+            + glob.glob(os.path.join(SNAPSHOT_DIR, f'{glob.escape(name)}.arrow')):
+        try:
+            if time.time() - os.path.getmtime(path) > SNAPSHOT_MAX_AGE:
+                os.remove(path)
+        except OSError:
+            pass  # снимок уже удалил другой процесс
+
+
+def read_snapshot(name: str, query: str, source: str = '') -> Optional[pd.DataFrame]:
+    # Функция для чтения снимка через memory-map.
+    # Возвращает None, если снимка нет, он устарел или снят другим запросом
+    if pa is None or not SNAPSHOT_DIR:
+        return None
+    path = get_snapshot_path(name, get_fingerprint(query, source))
+    if not os.path.exists(path):
+        return None
+
+    mapped_file = pa.memory_map(path, 'r')
+    reader = pa.ipc.open_file(mapped_file)
+    metadata = reader.schema.metadata or {}
+    fingerprint = metadata.get(b'fingerprint', b'').decode()
+    created_at = float(metadata.get(b'created_at', b'0'))
+
+    if fingerprint != get_fingerprint(query, source):
+        logger.info(f'snapshot {name}: fingerprint mismatch')
+        return None
+    if time.time() - created_at > SNAPSHOT_MAX_AGE:
+        logger.info(f'snapshot {name}: stale')
+        return None
+
+    # Страницы файла берутся из page cache и общие для всех процессов,
+    # числовые колонки без пропусков переходят в pandas без копирования
+    table = reader.read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def write_snapshot(name: str, query: str, df: pd.DataFrame, source: str = '') -> None:
+    # Функция для записи снимка (несжатый Arrow IPC, чтобы его можно было отобразить в память).
+    # Файл пишется во временный и атомарно подменяется, чтобы читатели не увидели половину
+    if pa is None or not SNAPSHOT_DIR:
+        return
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    remove_stale_snapshots(name)
+    fingerprint = get_fingerprint(query, source)
+    path = get_snapshot_path(name, fingerprint)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'fingerprint': fingerprint.encode(),
+        b'created_at': str(time.time()).encode(),
+    })
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def load_with_snapshot(name: str, query: str, loader: Callable[[str], pd.DataFrame],
+                       refresh: bool = False, source: str = '') -> pd.DataFrame:
+    # Функция для загрузки таблицы: сначала из локального снимка, при его отсутствии — из БД
+    # (refresh — загрузить из БД в любом случае и обновить снимок; source — адрес БД,
+    # из которой грузит loader, чтобы не отдать снимок другой БД)
+    df = None if refresh else read_snapshot(name, query, source)
+    if df is not None:
+        logger.info(f'snapshot {name}: loaded {len(df)} rows')
+        return df
+
+    logger.info(f'snapshot {name}: loading from database')
+    df = loader(query)
+    try:
+        write_snapshot(name, query, df, source)
+    except OSError as e:
+        logger.warning(f'snapshot {name}: not saved ({e})')
+    return df
@@ -0,0 +1,178 @@
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Размер чанка, которым строки читаются из БД (пик памяти при загрузке — в основном строки
+# текущего чанка в виде объектов Python, поэтому чанк меньше прежних 200000 строк)
+LOAD_CHUNKSIZE = int(os.getenv('LOAD_CHUNKSIZE', 50000))
+# Строковая колонка хранится как category, пока различных значений не больше этой доли
+# прочитанных строк (и не больше CATEGORY_MAX_COUNT); иначе — обычными строками (например, тексты постов)
+CATEGORY_MAX_SHARE = 0.5
+CATEGORY_MIN_COUNT = 256
+CATEGORY_MAX_COUNT = 2 ** 15
+
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+# Запрос, число строк которого дешево узнать заранее: колонки одной таблицы без условий,
+# соединений и группировок (count(*) по запросу с GROUP BY повторил бы всю агрегацию)
+PLAIN_QUERY_RE = re.compile(r'^\s*SELECT\s+[\w\s,.*]+?\s+FROM\s+[\w.]+\s*;?\s*$', flags=re.IGNORECASE)
+
+# Память загруженных таблиц: таблица -> строки и объем до и после сжатия типов (МиБ)
+load_reports: Dict[str, Dict] = {}
+
+
+def is_high_cardinality(n_unique: int, n_rows: int) -> bool:
+    # Функция для проверки, что строковую колонку не стоит хранить как category
+    return n_unique > max(CATEGORY_MIN_COUNT, CATEGORY_MAX_SHARE * n_rows) or n_unique > CATEGORY_MAX_COUNT
+
+
+class ColumnBuffer:
+    # Колонка итоговой таблицы, которая заполняется чанками по мере чтения. Тип выбирается
+    # по первому чанку: целые — int32 (int64, если значения не помещаются), дробные — float32,
+    # строки — коды category со словарем, который пополняется от чанка к чанку (почти
+    # неповторяющиеся строки, например тексты, склеиваются из чанков как есть). Массив
+    # выделяется сразу на ожидаемое число строк и при необходимости расширяется, поэтому
+    # чанки не копятся в памяти до склейки.
+
+    def __init__(self, sample: pd.Series, n_rows: int):
+        dtype = sample.dtype
+        self.categories: Optional[Dict] = None
+        self.chunks: Optional[List[pd.Series]] = None
+        if pd.api.types.is_bool_dtype(dtype):
+            self.values = np.empty(n_rows, dtype=bool)
+        elif pd.api.types.is_integer_dtype(dtype):
+            self.values = np.empty(n_rows, dtype=np.int32)
+        elif pd.api.types.is_float_dtype(dtype):
+            self.values = np.empty(n_rows, dtype=np.float32)
+        elif isinstance(dtype, np.dtype) and dtype.kind == 'M':
+            self.values = np.empty(n_rows, dtype=dtype)
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            if is_high_cardinality(sample.iloc[:1000].nunique(), min(len(sample), 1000)):
+                # Уже в начале таблицы значения почти не повторяются (например, тексты постов):
+                # колонка склеивается из чанков в том типе строк, в котором ее прочитал pandas
+                self.values = None
+                self.chunks = []
+            else:
+                self.values = np.empty(n_rows, dtype=np.int32)  # коды в словаре categories
+                self.categories = {}
+        else:
+            # Прочие типы (например, время с часовым поясом) склеиваются из чанков как есть
+            self.values = None
+            self.chunks = []
+
+    def _reserve(self, size: int):
+        # Функция для расширения массива, если в таблице оказалось больше строк, чем ожидалось
+        if size > len(self.values):
+            values = np.empty(max(size, len(self.values) * 3 // 2), dtype=self.values.dtype)
+            values[:len(self.values)] = self.values
+            self.values = values
+
+    def put(self, start: int, series: pd.Series):
+        # Функция для записи чанка в строки start..start + len(series)
+        if self.chunks is not None:
+            self.chunks.append(series)
+            return
+        end = start + len(series)
+        self._reserve(end)
+        if self.categories is not None:
+            self._put_strings(start, end, series)
+        elif self.values.dtype in (np.int32, np.int64):
+            if not pd.api.types.is_integer_dtype(series.dtype):
+                # В чанке появились пропуски (pandas читает такие целые как float64):
+                # и int32, и уже расширенный int64 переходят во float64, иначе NaN стал бы INT64_MIN
+                self.values = self.values.astype(np.float64)
+                self.values[start:end] = series.to_numpy(dtype=np.float64)
+                return
+            values = series.to_numpy()
+            if self.values.dtype == np.int32 and len(values) \
+                    and (values.min() < INT32_MIN or values.max() > INT32_MAX):
+                self.values = self.values.astype(np.int64)
+            self.values[start:end] = values
+        else:
+            self.values[start:end] = series.to_numpy(dtype=self.values.dtype)
+
+    def _put_strings(self, start: int, end: int, series: pd.Series):
+        codes, uniques = pd.factorize(series)
+        # Коды чанка переводятся в коды общего словаря (пропуски остаются -1)
+        mapping = np.array([self.categories.setdefault(value, len(self.categories)) for value in uniques] + [-1],
+                           dtype=np.int32)
+        self.values[start:end] = mapping[codes]
+
+        if is_high_cardinality(len(self.categories), end):
+            # Значения почти не повторяются: дальше колонка хранится строками
+            strings = np.append(np.array(list(self.categories), dtype=object), np.nan)
+            self.chunks = [pd.Series(strings[self.values[:end]], dtype=series.dtype)]
+            self.values = None
+            self.categories = None
+
+    def finish(self, n_rows: int):
+        # Функция для получения готовой колонки из n_rows строк
+        if self.chunks is not None:
+            return pd.concat(self.chunks, ignore_index=True) if self.chunks else pd.Series([], dtype=object)
+        values = self.values[:n_rows] if n_rows == len(self.values) else self.values[:n_rows].copy()
+        if self.categories is not None:
+            return pd.Categorical.from_codes(values, categories=pd.Index(list(self.categories), dtype=object))
+        return values
+
+
+def get_table_name(query: str) -> str:
+    # Функция для получения имени таблицы запроса (для отчета о памяти)
+    match = re.search(r'\bFROM\s+([\w.]+)', query, flags=re.IGNORECASE)
+    return match.group(1) if match else ' '.join(query.split())[:60]
+
+
+def get_memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def count_rows(engine, query: str) -> Optional[int]:
+    # Функция для получения числа строк результата запроса, если его дешево посчитать
+    # (None для запросов с условиями, соединениями и группировками)
+    if not PLAIN_QUERY_RE.match(query):
+        return None
+    with engine.connect() as conn:
+        return int(pd.read_sql(f'SELECT count(*) AS n_rows FROM ({query}) AS q', conn).iloc[0, 0])
+
+
+def load_sql_compact(engine, query: str, parse_dates: Optional[Sequence[str]] = None,
+                     chunksize: int = LOAD_CHUNKSIZE) -> pd.DataFrame:
+    # Функция для загрузки результата запроса чанками со сжатием типов на лету. Массивы колонок
+    # выделяются сразу на все строки, и каждый чанк записывается в них в итоговых типах:
+    # пик памяти близок к размеру готовой таблицы плюс один чанк, а не к удвоенному размеру
+    # таблицы с типами по умолчанию (список чанков + pd.concat). Если таблица не уместилась
+    # в первый чанк, число строк простого запроса к таблице запрашивается отдельным count(*);
+    # для остальных запросов (например, агрегации лайков) массивы растут по мере чтения
+    start_time = time.perf_counter()
+    conn = engine.connect().execution_options(stream_results=True)
+    try:
+        columns: Dict[str, ColumnBuffer] = {}
+        loaded_rows, raw_bytes = 0, 0
+        for chunk in pd.read_sql(query, conn, chunksize=chunksize, parse_dates=parse_dates):
+            if not columns:
+                n_rows = len(chunk) if len(chunk) < chunksize else count_rows(engine, query) or 4 * chunksize
+                columns = {column: ColumnBuffer(chunk[column], n_rows) for column in chunk.columns}
+            for column, buffer in columns.items():
+                buffer.put(loaded_rows, chunk[column])
+            loaded_rows += len(chunk)
+            raw_bytes += chunk.memory_usage(deep=True).sum()
+    finally:
+        conn.close()
+
+    df = pd.DataFrame({column: buffer.finish(loaded_rows) for column, buffer in columns.items()}, copy=False)
+    table = get_table_name(query)
+    report = load_reports[table] = {
+        'rows': loaded_rows,
+        'default_types_mb': round(raw_bytes / 2 ** 20, 1),
+        'compact_mb': round(get_memory_mb(df), 1),
+        'load_s': round(time.perf_counter() - start_time, 2),
+    }
+    logger.info(f'sql load {table}: {report["rows"]} rows, {report["default_types_mb"]} MiB with default types '
+                f'-> {report["compact_mb"]} MiB in {report["load_s"]} s')
+    return df
@@ -0,0 +1,190 @@
+# Построение W2V признаков постов (таблица i_koskin_posts_features_lesson_25) вне ноутбука
+# Project_catboost_model_W2V.ipynb: текст приводится к нижнему регистру, разбивается на слова
+# (как preprocess_text: все, кроме букв, цифр и _, — разделители), вектор поста — среднее векторов
+# известных модели слов (как vectorize_text, нулевой вектор, если таких слов нет).
+# В инкрементальном режиме (по умолчанию) считаются только посты, которых еще нет в таблице признаков.
+# Запуск из корня проекта: DATABASE_URL=... python text_embeddings.py [--full] [--workers 8]
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, create_engine, inspect, text
+
+try:
+    from gensim.utils import SaveLoad
+except ImportError:  # без gensim векторы читаются только из .npz (см. WordVectors.save)
+    SaveLoad = None
+
+logger = logging.getLogger(__name__)
+
+# Векторы слов W2V модели, на которой обучена модель плеча test (словарь и матрица в .npz)
+W2V_VECTORS_PATH = os.getenv('W2V_VECTORS_PATH', './w2v_vectors.npz')
+# Количество постов в одной задаче пула процессов
+EMBED_CHUNK_SIZE = int(os.getenv('EMBED_CHUNK_SIZE', 1000))
+
+# Количество post_id в одном запросе текстов новых постов
+NEW_POSTS_QUERY_SIZE = 1000
+
+POST_TEXT_TABLE = 'public.post_text_df'
+POST_FEATURES_TABLE = 'i_koskin_posts_features_lesson_25'
+
+# Количество текстов на одну выборку строк матрицы векторов (см. WordVectors)
+GATHER_TEXTS = 64
+
+# Слово — непрерывная последовательность символов \w (то же, что split() после замены \W на пробел)
+TOKEN_RE = re.compile(r'\w+')
+
+
+class WordVectors:
+    # Словарь W2V модели и матрица векторов слов. Слова текстов переводятся в номера строк
+    # матрицы по словарю слово -> номер, векторы текстов — выборка строк матрицы по номерам и
+    # сумма по отрезкам слов каждого текста (np.add.reduceat) вместо поиска и усреднения векторов
+    # слово за словом. Выборка строк делается по GATHER_TEXTS текстов: небольшой буфер
+    # переиспользуется аллокатором, а буфер на весь пакет (слова × размер вектора) стоил бы
+    # больше самого расчета из-за выделения новых страниц памяти.
+
+    def __init__(self, words: Sequence[str], vectors: np.ndarray):
+        self.words = list(words)
+        self.word_index = {word: i for i, word in enumerate(self.words)}
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(self.word_index) != len(self.words) or len(self.words) != len(self.vectors):
+            raise ValueError('Words must be unique and match vector rows')
+
+    @property
+    def vector_size(self) -> int:
+        return self.vectors.shape[1]
+
+    @classmethod
+    def load(cls, path: str) -> 'WordVectors':
+        # Функция для загрузки векторов: .npz этого модуля или сохраненная модель gensim
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                return cls(data['words'].tolist(), data['vectors'])
+        if SaveLoad is None:
+            raise ImportError('gensim is required to read gensim models')
+        model = SaveLoad.load(path)
+        keyed_vectors = getattr(model, 'wv', model)  # Word2Vec или KeyedVectors
+        return cls(keyed_vectors.index_to_key, keyed_vectors.vectors)
+
+    def save(self, path: str) -> None:
+        # Функция для сохранения словаря и матрицы (в ноутбуке:
+        # WordVectors(model_w2v.wv.index_to_key, model_w2v.wv.vectors).save('w2v_vectors.npz'))
+        np.savez(path, words=np.asarray(self.words, dtype=str), vectors=self.vectors)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # Функция для получения векторов текстов (float32, тексты × размер вектора)
+        get_id = self.word_index.get
+        token_ids, counts = [], np.zeros(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            # Неизвестные модели слова отбрасываются
+            ids = [word_id for word_id in map(get_id, TOKEN_RE.findall(text.lower())) if word_id is not None]
+            token_ids.extend(ids)
+            counts[i] = len(ids)
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        bounds = np.concatenate([[0], np.cumsum(counts)])  # отрезки слов текстов в token_ids
+
+        embeddings = np.zeros((len(texts), self.vector_size), dtype=np.float32)
+        for start in range(0, len(texts), GATHER_TEXTS):
+            end = min(start + GATHER_TEXTS, len(texts))
+            rows = start + np.flatnonzero(counts[start:end])
+            if not len(rows):
+                continue  # нет известных слов — нулевой вектор, как в vectorize_text
+            sums = np.add.reduceat(self.vectors[token_ids[bounds[start]:bounds[end]]],
+                                   bounds[rows] - bounds[start], axis=0)
+            embeddings[rows] = sums / counts[rows, None]
+        return embeddings
+
+
+word_vectors = None  # векторы для процессов пула (передаются через fork)
+
+
+def embed_chunk(texts: List[str]) -> np.ndarray:
+    # Функция для расчета векторов одного чанка постов в процессе пула
+    return word_vectors.embed(texts)
+
+
+def embed_texts(vectors: WordVectors, texts: List[str], workers: int = 1,
+                chunk_size: int = EMBED_CHUNK_SIZE) -> np.ndarray:
+    # Функция для расчета векторов текстов чанками в пуле из workers процессов
+    # (процессы создаются через fork и не копируют матрицу векторов)
+    global word_vectors
+    if workers <= 1 or len(texts) <= chunk_size:
+        return vectors.embed(texts)
+    word_vectors = vectors
+    chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        return np.concatenate(list(pool.map(embed_chunk, chunks)))
+
+
+def build_post_features(posts: pd.DataFrame, vectors: WordVectors, workers: int = 1) -> pd.DataFrame:
+    # Функция для сборки признаков постов: post_id, topic и vector_0..vector_{n-1}
+    embeddings = embed_texts(vectors, posts['text'].astype(str).tolist(), workers)
+    vector_df = pd.DataFrame(embeddings, columns=[f'vector_{i}' for i in range(vectors.vector_size)])
+    return pd.concat([posts[['post_id', 'topic']].reset_index(drop=True), vector_df], axis=1)
+
+
+def load_posts(engine, table: str, only_new: bool) -> pd.DataFrame:
+    # Функция для загрузки текстов постов (only_new — только тех, которых нет в таблице признаков).
+    # Новые посты — разность множеств post_id (в таблице признаков нет индекса по post_id,
+    # поэтому NOT EXISTS в запросе сравнивал бы каждый пост с каждым), их тексты читаются
+    # по спискам post_id
+    query = f'SELECT post_id, text, topic FROM {POST_TEXT_TABLE}'
+    if not only_new:
+        return pd.read_sql(query, engine)
+    post_ids = pd.read_sql(f'SELECT post_id FROM {POST_TEXT_TABLE}', engine)['post_id'].to_numpy()
+    known_ids = pd.read_sql(f'SELECT post_id FROM {table}', engine)['post_id'].to_numpy()
+    new_ids = np.setdiff1d(post_ids, known_ids).tolist()
+    query = text(f'{query} WHERE post_id IN :post_ids').bindparams(bindparam('post_ids', expanding=True))
+    chunks = [pd.read_sql(query, engine, params={'post_ids': new_ids[start:start + NEW_POSTS_QUERY_SIZE]})
+              for start in range(0, len(new_ids), NEW_POSTS_QUERY_SIZE)]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=['post_id', 'text', 'topic'])
+
+
+def update_post_features(engine, vectors: WordVectors, table: str = POST_FEATURES_TABLE,
+                         full: bool = False, workers: int = 1) -> int:
+    # Функция для записи признаков постов в БД: full — пересчитать таблицу целиком,
+    # иначе дописать только новые посты. Возвращает количество записанных постов
+    full = full or not inspect(engine).has_table(table)
+    start_time = time.perf_counter()
+    posts = load_posts(engine, table, only_new=not full)
+    if posts.empty:
+        logger.info(f'post features {table}: no new posts')
+        return 0
+
+    features = build_post_features(posts, vectors, workers)
+    if full:
+        features.to_sql(table, engine, if_exists='replace', index=False, chunksize=10000)
+    else:
+        # Колонки, которых нет у новых постов (например, оставшиеся от сборки в ноутбуке), — пустые
+        columns = pd.read_sql(f'SELECT * FROM {table} WHERE 1 = 0', engine).columns
+        features.reindex(columns=columns).to_sql(table, engine, if_exists='append', index=False, chunksize=10000)
+    logger.info(f'post features {table}: {len(features)} posts written '
+                f'({"full" if full else "incremental"}) in {time.perf_counter() - start_time:.1f} s')
+    return len(features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build W2V post features')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help='database with write access')
+    parser.add_argument('--vectors', default=W2V_VECTORS_PATH, help='word vectors (.npz or gensim model)')
+    parser.add_argument('--table', default=POST_FEATURES_TABLE, help='post features table')
+    parser.add_argument('--full', action='store_true', help='rebuild the whole table instead of new posts only')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='embedding processes')
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+
+    logging.basicConfig(level=logging.INFO)
+    update_post_features(create_engine(args.database_url), WordVectors.load(args.vectors),
+                         args.table, args.full, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class UserStore:
+    # Признаки пользователей в виде колонок-массивов с плотным индексом user_id -> строка:
+    # поиск пользователя — одно обращение к массиву вместо прохода по всей таблице.
+    # Строковые колонки хранятся словарным кодированием (коды + словарь значений).
+
+    def __init__(self, users_features: pd.DataFrame):
+        user_ids = users_features['user_id'].to_numpy().astype(np.int64)
+        self.n_users = len(user_ids)
+
+        # Плотный массив user_id -> строка (-1 для неизвестных пользователей)
+        self.rows = np.full(int(user_ids.max()) + 1 if self.n_users else 0, -1, dtype=np.int32)
+        self.rows[user_ids] = np.arange(self.n_users, dtype=np.int32)
+
+        # column -> (values, categories): для строковых колонок values — коды, categories — словарь
+        self.columns = {}
+        for column in users_features.columns:
+            if column == 'user_id':
+                continue
+            series = users_features[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Код -1 (пропуск) указывает на последний элемент словаря — NaN
+                categories = np.append(np.asarray(series.cat.categories, dtype=object), np.nan)
+                self.columns[column] = (series.cat.codes.to_numpy(), categories)
+            elif pd.api.types.is_numeric_dtype(series.dtype):
+                self.columns[column] = (series.to_numpy(), None)
+            else:
+                codes, categories = pd.factorize(series, use_na_sentinel=False)
+                codes = codes.astype(np.int16 if len(categories) < 2 ** 15 else np.int32)
+                self.columns[column] = (codes, np.asarray(categories, dtype=object))
+
+    def __contains__(self, user_id: int) -> bool:
+        return 0 <= user_id < len(self.rows) and self.rows[user_id] >= 0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        # Функция для получения признаков пользователя (None для неизвестного пользователя)
+        if user_id not in self:
+            return None
+        row = self.rows[user_id]
+        return {column: values[row] if categories is None else categories[values[row]]
+                for column, (values, categories) in self.columns.items()}